@@ -1,17 +1,20 @@
-import os, sys
+import os, sys, io, json, uuid, threading
 
-from flask import Flask, render_template, request, jsonify, Response
-
-from bs4 import BeautifulSoup
+import numpy as np
+from flask import Flask, render_template, request, jsonify, Response, session, stream_with_context, get_template_attribute
 
 
 # when using in heroku/docker
 sys.path.append("/")
 # for local development in flask
 # sys.path.append("/home/mexposit/telmb/")
-from molybdenum import MolybdenumModel
+from molybdenum import MolybdenumModel, SimulationPool
+from model_store import create_model_store
+from jobs import JobQueue, SessionModels
 
 app = Flask(__name__)
+# sessions are signed with this key, all workers serving the app must share it
+app.secret_key = os.environ.get('MOLYBDENUM_SECRET_KEY') or os.urandom(24)
 
 defaults = {
     'default_spec_conc' : 10,
@@ -20,8 +23,109 @@ defaults = {
 }
 
 
-# initialize empty molybdenum model
-mb_model = MolybdenumModel()
+# models of each browser session, kept in memory or in a SQLite database
+# given by MOLYBDENUM_STORE so that several workers can serve the same session
+model_store = create_model_store(
+    store_path=os.environ.get('MOLYBDENUM_STORE'),
+    max_sessions=int(os.environ.get('MOLYBDENUM_MAX_SESSIONS', 100)),
+    max_bytes=int(float(os.environ.get('MOLYBDENUM_MAX_MEMORY_MB', 512))*2**20),
+)
+
+def get_model_session():
+    """Gets the model session of the browser doing the request
+
+    Returns:
+        ModelSession with the model and the last results of the browser,
+        created if it is the first request of the browser
+    """
+    if 'session_id' not in session:
+        session['session_id'] = uuid.uuid4().hex
+    return model_store.get(session['session_id'])
+
+# models that simulate for each session, they keep the compiled models so
+# that simulating again after changing values does not compile
+session_models = SessionModels(max_sessions=int(os.environ.get('MOLYBDENUM_MAX_SESSIONS', 100)))
+# simulations run in the background so that requests return immediately
+job_queue = JobQueue(
+    max_workers=int(os.environ.get('MOLYBDENUM_JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('MOLYBDENUM_MAX_PENDING_JOBS', 50)),
+    session_models=session_models,
+)
+# matplotlib figures are global, plots of different jobs cannot overlap
+plot_lock = threading.Lock()
+# graph revisions of a session are checked and updated one request at a time
+graph_lock = threading.Lock()
+
+# optional pool of processes that keep tellurium loaded and models compiled,
+# simulations of the same model go to the same process. Until it is ready
+# simulations run in the app
+pool_processes = int(os.environ.get('MOLYBDENUM_POOL_PROCESSES', 0))
+sim_pool = None
+
+# molybdenum imports tellurium when it is first needed, import it while the
+# app already answers requests so that the first simulation does not wait
+def preload_simulator():
+    global sim_pool
+    import tellurium
+    if pool_processes > 0:
+        sim_pool = SimulationPool(processes=pool_processes)
+
+# worker processes of the pool import this file again as __mp_main__ when
+# the app is run as a script, only the app starts them
+if ((os.environ.get('MOLYBDENUM_PRELOAD', '1') == '1') or (pool_processes > 0)) and (__name__ != '__mp_main__'):
+    threading.Thread(target=preload_simulator, daemon=True).start()
+
+def simulate_job(session_id, mb_model, plot='data'):
+    """Simulates a model in the job queue and keeps results in its session
+
+    Args:
+        session_id: str, session that submitted the simulation
+        mb_model: MolybdenumModel with the snapshot of the session model
+            taken when submitted, see SessionModels
+        plot: "data" if the browser plots the results from /results_data,
+            "image" to plot them in the server
+
+    Returns:
+        plot of the results as html image, None if plot is "data"
+    """
+    if (sim_pool is not None) and (plot != 'image'):
+        # plotting images needs the compiled model, only data comes from the pool
+        results = sim_pool.run(mb_model).result()
+    else:
+        te_model, results = mb_model.run()
+    # keep results in the session so that they can be downloaded, without
+    # saving the model, it may have been edited while simulating
+    model_store.save_results(session_id, results)
+    if plot != 'image':
+        return None
+    # now create plot representation, with class="img-fluid" to make it responsive with bootstrap
+    with plot_lock:
+        te_plot_img = mb_model.get_plot_as_htmlimage(te_model, img_class='img-fluid')
+    return te_plot_img
+
+def render_form(mb_model, prev_model):
+    """Renders the form with the model or the rows that changed in it
+
+    Args:
+        mb_model: MolybdenumModel after the changes of the request
+        prev_model: ModelSnapshot of the model before the changes, only
+            used if the request has ?patch=1
+
+    Returns:
+        model_form.html with all the model, or if the request has ?patch=1
+        a json with the rows of the form to replace or add and the ids of
+        rows to remove, see MolybdenumModel.diff_model()
+    """
+    if request.args.get('patch') != '1':
+        return render_template("model_form.html", model_data=mb_model.todict())
+    form_patch = dict()
+    for comp_class, comp_patch in mb_model.diff_model(prev_model).items():
+        render_row = get_template_attribute("form_rows.html", f"{comp_class}_row")
+        form_patch[comp_class] = {
+            'changed': [[comp_id, str(render_row(comp_id, comp))] for comp_id, comp in comp_patch['changed']],
+            'removed': comp_patch['removed'],
+        }
+    return jsonify(form_patch)
 
 # # initialize a dictionary that will keep all model information
 # model_data = model_builder.init_model()
@@ -48,11 +152,35 @@ def updated_graph():
         # got request from javascript that runs everytime screen is touched
         pass
     
-    # update model information with updated connection data
-    mb_model.update_from_graph(conn_data)
+    model_session = get_model_session()
+    mb_model = model_session.model
+    # the graph editor numbers its posts, drop the ones older than the last
+    # graph applied, they can arrive out of order. Graphs without revision
+    # (Ex. the empty graph of a new page) are always applied
+    graph_client = conn_data.pop('client', None)
+    graph_revision = conn_data.pop('revision', None)
+    if graph_revision is not None:
+        with graph_lock:
+            if (graph_client == model_session.graph_client) and (graph_revision <= model_session.graph_revision):
+                return Response(status=204)
+            model_session.graph_client = graph_client
+            model_session.graph_revision = graph_revision
+    patch = request.args.get('patch') == '1'
+    graph_changed = mb_model.graph_changed(conn_data)
+    # nothing to do if only the position of nodes changed. Only the graph
+    # editor, which asks for patches and numbers its posts, can skip the
+    # answer, other posts (Ex. initForm of a new page) need the whole form
+    if (not graph_changed) and patch and (graph_revision is not None):
+        return Response(status=204)
+    # the form rows to update are found comparing with the model before the
+    # changes, only needed if the browser asked for them
+    prev_model = mb_model.snapshot() if patch else None
+    if graph_changed:
+        # update model information with updated connection data
+        mb_model.update_from_graph(conn_data)
+        model_store.save(model_session)
     # pass model dictionary representation to update the form
-    model_data = mb_model.todict()
-    return render_template("model_form.html", model_data=model_data)
+    return render_form(mb_model, prev_model)
 
 #background process triggered when form has been updated
 @app.route('/updated_form', methods=["GET","POST"])
@@ -61,14 +189,19 @@ def updated_form():
     form_data = request.form
     # convert it to a list of tuples (name, value) for each element
     form_lists = (list(form_data.lists()))
+    model_session = get_model_session()
+    mb_model = model_session.model
+    # only compared with the model after the changes if the browser asked
+    # for the rows that changed, see render_form()
+    prev_model = mb_model.snapshot() if request.args.get('patch') == '1' else None
     # update background model
     try:
         mb_model.update_from_form(form_lists)
     except Exception as e:
         return jsonify(message=str(e)),500
+    model_store.save(model_session)
 
-    model_data = mb_model.todict()
-    return render_template("model_form.html", model_data=model_data)
+    return render_form(mb_model, prev_model)
 
 
 #background process triggered to update model representations
@@ -86,11 +219,17 @@ def update_representation():
         # mb_model.update_from_form(form_lists)
     # except Exception as e:
         # return jsonify(message=str(e)),500
+    mb_model = get_model_session().model
+    # representations only change with the model, the browser keeps the last ones
+    model_hash = mb_model.get_model_hash()
+    if request.if_none_match.contains(model_hash):
+        return Response(status=304)
     try:
         print("TRying")
-        antimony_rep = mb_model.toAntimony()
-        sbml_rep = mb_model.toSBMLstr()
-        molybdenum_rep = mb_model.todict()
+        representations = mb_model.get_representations()
+        antimony_rep = representations['antimony']
+        sbml_rep = representations['sbml']
+        molybdenum_rep = representations['dict']
         # if compilation of model was successful set success status
         status = 'success'
         error_message = '' # empty error message
@@ -115,7 +254,9 @@ def update_representation():
 
         # this generates error in console. We handle error, we don't want error in console
         # return jsonify(message=str(e)),500
-    return jsonify([status, error_message, antimony_rep, sbml_rep, str(molybdenum_rep)])
+    response = jsonify([status, error_message, antimony_rep, sbml_rep, str(molybdenum_rep)])
+    response.set_etag(model_hash)
+    return response
 
 
 #background process triggered to update model representations
@@ -125,30 +266,211 @@ def run_model():
     form_data = request.form
     # convert it to a list of tuples (name, value) for each element
     form_lists = (list(form_data.lists()))
+    # how results are plotted is not a simulation parameter
+    plot = form_data.get('plot', 'data')
+    form_lists = [form_input for form_input in form_lists if form_input[0] != 'plot']
     # TODO: check that end is > start, or let antimony raise error if this is the case
+    model_session = get_model_session()
+    mb_model = model_session.model
     # update background model
     try:
         mb_model.update_sim_params(form_lists)
     except Exception as e:
         return jsonify(message=str(e)),500
-    te_model, results = mb_model.run()
-    # make results acessible out of the function
-    run_model.results = results
-    # now create plot representation
-    te_plot_img = mb_model.get_plot_as_htmlimage(te_model)
-    # use beautifulsoup to add the class="img-fluid" to the image to make it responsive with bootstrap
-    soup = BeautifulSoup(te_plot_img, 'html.parser')
-    soup.find("img")['class'] = "img-fluid"
-    return str(soup)
+    model_store.save(model_session)
+    # simulate in the job queue, client polls /job_status for the plot
+    try:
+        job = job_queue.submit(model_session.session_id, mb_model, simulate_job, job_args=(plot,))
+    except RuntimeError as e:
+        return jsonify(message=str(e)),503
+    return jsonify(job.todict()),202
+
+# steady state of the model, or along a range of values of a parameter
+# with ?scan=k1&start=0.1&end=1&points=50
+@app.route('/steady_state')
+def steady_state():
+    model_session = get_model_session()
+    mb_model = model_session.model
+    scan_name = request.args.get('scan')
+    try:
+        # solved on a snapshot with the models of the session, like jobs, so
+        # that edits and simulations of the session do not change it meanwhile
+        with session_models.use(model_session.session_id, mb_model.snapshot()) as ss_model:
+            if not scan_name:
+                return jsonify(ss_model.steady_state())
+            scan_start = request.args.get('start', type=float)
+            scan_end = request.args.get('end', type=float)
+            if (scan_start is None) or (scan_end is None):
+                raise ValueError(f'Scanning {scan_name} needs start and end values')
+            scan_values = np.linspace(scan_start, scan_end, request.args.get('points', 50, type=int))
+            scan_results = ss_model.steady_state_scan(scan_name, scan_values)
+    except ValueError as e:
+        # no steady state or wrong scan
+        return jsonify(message=str(e)),400
+    except Exception as e:
+        # Ex. the model could not be compiled
+        return jsonify(message=str(e)),500
+    # NaN is not valid json, points without steady state are null
+    results = [[None if np.isnan(val) else val for val in row] for row in scan_results['results'].tolist()]
+    return jsonify({'columns': scan_results['columns'], 'values': scan_results['values'].tolist(), 'results': results})
+
+# cancel events of the simulations streamed to each session, see /stream_run
+run_streams = dict()
+run_streams_lock = threading.Lock()
+
+# simulate showing results while they are computed, as Server-Sent Events
+@app.route('/stream_run')
+def stream_run():
+    # simulation parameters come in the url, EventSource can only do GET
+    form_lists = [form_input for form_input in request.args.lists() if form_input[0] not in ('plot', 'chunk_points')]
+    chunk_points = request.args.get('chunk_points', 100, type=int)
+    model_session = get_model_session()
+    mb_model = model_session.model
+    try:
+        mb_model.update_sim_params(form_lists)
+        if chunk_points < 1:
+            raise ValueError(f'Chunks must have at least 1 point, but got {chunk_points}')
+    except Exception as e:
+        return jsonify(message=str(e)),500
+    model_store.save(model_session)
+    session_id = model_session.session_id
+    # simulate a snapshot, so that edits of the model during the stream do
+    # not change it
+    model_snapshot = mb_model.snapshot()
+    # a new stream of the session cancels the previous one
+    cancel_event = threading.Event()
+    with run_streams_lock:
+        if session_id in run_streams:
+            run_streams[session_id].set()
+        run_streams[session_id] = cancel_event
+
+    def generate_events():
+        chunks = []
+        try:
+            # same compiled models as the jobs of the session, see SessionModels
+            with session_models.use(session_id, model_snapshot) as stream_model:
+                for chunk in stream_model.iter_run(chunk_points=chunk_points, cancel_event=cancel_event):
+                    chunks.append(chunk)
+                    chunk_data = {
+                        'columns': stream_model.get_result_columns(chunk.colnames)[1:],
+                        'time': chunk[:, 0].tolist(),
+                        'values': chunk[:, 1:].tolist(),
+                    }
+                    yield f'event: chunk\ndata: {json.dumps(chunk_data)}\n\n'
+                if cancel_event.is_set():
+                    yield 'event: cancelled\ndata: {}\n\n'
+                    return
+                results = stream_model.join_results(chunks)
+            # keep results in the session so that they can be downloaded,
+            # without saving the model, it may have been edited meanwhile
+            model_store.save_results(session_id, results)
+            yield 'event: done\ndata: {}\n\n'
+        except Exception as e:
+            yield f'event: error\ndata: {json.dumps({"message": str(e)})}\n\n'
+        finally:
+            # also reached when the browser closes the stream, which stops the simulation
+            with run_streams_lock:
+                if run_streams.get(session_id) is cancel_event:
+                    del run_streams[session_id]
+
+    return Response(generate_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# stop the simulation streamed to the session, if any
+@app.route('/cancel_run', methods=["POST"])
+def cancel_run():
+    with run_streams_lock:
+        cancel_event = run_streams.get(get_model_session().session_id)
+    if cancel_event is None:
+        return jsonify(message='There is no simulation running'),404
+    cancel_event.set()
+    return jsonify(message='Simulation cancelled')
+
+# status of simulations submitted to /run_model
+@app.route("/job_status/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(get_model_session().session_id, job_id)
+    if job is None:
+        return jsonify(message=f'Could not find job {job_id}'),404
+    job_info = job.todict()
+    if (job.status == 'done') and (job.result is not None):
+        job_info['plot'] = job.result
+    return jsonify(job_info)
+
+# trajectories of the last simulation, for the browser to plot them
+@app.route("/results_data")
+def results_data():
+    model_session = get_model_session()
+    if model_session.results is None:
+        return jsonify(message='There are no results, run the model first'),404
+    # trajectories are downsampled to this number of points, keeping their shape
+    try:
+        max_points = int(request.args.get('points', 1000))
+        trajectories = model_session.model.get_trajectories(model_session.results, max_points=max_points)
+    except ValueError as e:
+        return jsonify(message=str(e)),400
+    if request.args.get('format', 'json') == 'npz':
+        # binary arrays named time_<species> and values_<species>
+        npz_io = io.BytesIO()
+        np.savez(npz_io, **{f'{att}_{col_name}': np.array(traj[att])
+                            for col_name, traj in trajectories['trajectories'].items()
+                            for att in ('time', 'values')})
+        return Response(npz_io.getvalue(), mimetype='application/octet-stream')
+    return jsonify(trajectories)
 
 # download CSV results
 @app.route("/download_results")
 def download_results():
-    result_df = mb_model.te_result_to_df(run_model.results)
+    model_session = get_model_session()
+    if model_session.results is None:
+        return jsonify(message='There are no results, run the model first'),404
+    mb_model = model_session.model
+    results = model_session.results
+    # part of the results to download, Ex. ?columns=S,P&start=0&end=10&format=csv
+    try:
+        columns = request.args.get('columns')
+        columns = None if not columns else columns.split(',')
+        time_start = request.args.get('start', type=float)
+        time_end = request.args.get('end', type=float)
+        col_names, col_indices, rows = mb_model.select_results(results, columns=columns,
+                                                               time_start=time_start, time_end=time_end)
+    except ValueError as e:
+        return jsonify(message=str(e)),400
+
+    file_format = request.args.get('format', 'csv')
+    if file_format == 'csv':
+        # written in chunks while sent, never as a whole string in memory
+        csv_chunks = mb_model.iter_results_csv(results, columns=columns, time_start=time_start, time_end=time_end)
+        return Response(
+            stream_with_context(csv_chunks),
+            mimetype='text/csv',
+            headers={"Content-disposition":"attachment; filename=simresult.csv"})
+
+    arr = np.asarray(results)[rows][:, col_indices]
+    file_io = io.BytesIO()
+    if file_format == 'npz':
+        np.savez_compressed(file_io, **{col_name: arr[:, col_idx] for col_idx, col_name in enumerate(col_names)})
+        mimetype = 'application/octet-stream'
+    elif file_format in ('parquet', 'arrow'):
+        # optional, only imported when downloading results as parquet or arrow
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            return jsonify(message=f'Downloading {file_format} files requires pyarrow, which is not installed'),400
+        table = pa.table({col_name: arr[:, col_idx] for col_idx, col_name in enumerate(col_names)})
+        if file_format == 'parquet':
+            pq.write_table(table, file_io)
+        else:
+            with pa.ipc.new_file(file_io, table.schema) as writer:
+                writer.write_table(table)
+        mimetype = 'application/vnd.apache.arrow.file' if file_format == 'arrow' else 'application/octet-stream'
+    else:
+        return jsonify(message=f'Unrecognized format {file_format}, must be one of "csv", "npz", "parquet" or "arrow"'),400
     return Response(
-        result_df.to_csv(index=False),
-        mimetype='text/csv',
-        headers={"Content-disposition":"attachment; filename=simresult.csv"})
+        file_io.getvalue(),
+        mimetype=mimetype,
+        headers={"Content-disposition":f"attachment; filename=simresult.{file_format}"})
 
 # #background process happening without any refreshing
 # @app.route('/background_process_test', methods=["GET","POST"])
@@ -0,0 +1,185 @@
+import hashlib, threading, uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from molybdenum import MolybdenumModel
+
+
+class Job(object):
+    """Simulation submitted by a session
+
+    Attributes:
+        job_id: str, key of the job in the queue
+        session_id: str, session that submitted the job, only it can see it
+        key: str, hash of the submitted model, identical submissions have
+            the same key
+        status: 'pending', 'running', 'done' or 'error'
+        result: value returned by the job function once done
+        error: str, error message if the job failed
+    """
+    def __init__(self, session_id, key):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.key = key
+        self.status = 'pending'
+        self.result = None
+        self.error = ''
+
+    def todict(self):
+        """Exports the status of the job, without its result"""
+        return {'job_id': self.job_id, 'status': self.status, 'error': self.error}
+
+
+class SessionModels(object):
+    """Models used to simulate the snapshots of each session
+
+    Args:
+        max_sessions: number of sessions whose models are kept, the least
+            recently used ones are removed first
+
+    Notes:
+        each session has one MolybdenumModel that loads every snapshot it
+        simulates, so the compiled models cached by
+        MolybdenumModel.get_temodel() are reused by all the simulations of
+        the session. A compiled model cannot simulate in two threads at the
+        same time, while the model of a session is busy other simulations
+        of the session use a new model
+    """
+    def __init__(self, max_sessions=100):
+        self.max_sessions = max_sessions
+        # session_id: (lock, MolybdenumModel), least recently used first
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def use(self, session_id, model_snapshot):
+        """Gets a model of the session with the snapshot loaded
+
+        Args:
+            session_id: str, session simulating the snapshot
+            model_snapshot: ModelSnapshot to simulate, loaded without copying
+
+        Yields:
+            MolybdenumModel with the snapshot, only used by the caller until
+            the with block ends
+        """
+        with self._lock:
+            if session_id not in self._models:
+                self._models[session_id] = (threading.Lock(), MolybdenumModel())
+            self._models.move_to_end(session_id)
+            model_lock, sim_model = self._models[session_id]
+            while len(self._models) > self.max_sessions:
+                self._models.popitem(last=False)
+        if not model_lock.acquire(blocking=False):
+            # busy with another simulation of the session
+            model_lock, sim_model = threading.Lock(), MolybdenumModel()
+            model_lock.acquire()
+        try:
+            sim_model.loadm(model_snapshot)
+            yield sim_model
+        finally:
+            model_lock.release()
+
+
+class JobQueue(object):
+    """Runs simulations in a bounded pool of threads
+
+    Args:
+        max_workers: number of jobs running at the same time
+        max_pending: maximum number of jobs waiting or running, submit()
+            raises an error above it
+        max_finished: number of finished jobs kept so that their results
+            can be collected, oldest ones are removed first
+        session_models: SessionModels used to simulate, so that jobs reuse
+            the compiled models of previous simulations of the session. If
+            None, the queue keeps its own
+
+    Notes:
+        simulations run in the compiled code of roadrunner, so threads are
+        enough to run several of them at the same time
+    """
+    def __init__(self, max_workers=2, max_pending=50, max_finished=200, session_models=None):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.session_models = SessionModels() if session_models is None else session_models
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # job_id: Job, in order of submission
+        self._jobs = OrderedDict()
+        # (session_id, key): job_id of jobs not finished yet
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, mb_model, job_function, job_args=()):
+        """Submits a simulation of a model
+
+        Args:
+            session_id: str, session submitting the job
+            mb_model: MolybdenumModel to simulate, a snapshot is taken so
+                that later edits do not change the job
+            job_function: function called with the session id, a model
+                with the snapshot (see SessionModels.use()) and job_args, its
+                return value is the result of the job
+            job_args: tuple of other arguments passed to job_function, part
+                of what makes two submissions identical
+
+        Returns:
+            job: Job, if the session already has an identical job that has
+                not finished that one is returned instead of submitting a new one
+
+        Raises:
+            RuntimeError if there are already max_pending jobs waiting
+        """
+        model_snapshot = mb_model.snapshot()
+        key = hashlib.sha1((mb_model.tojson() + repr(job_args)).encode()).hexdigest()
+        with self._lock:
+            job_id = self._pending.get((session_id, key))
+            if job_id is not None:
+                return self._jobs[job_id]
+            if len(self._pending) >= self.max_pending:
+                raise RuntimeError('Too many simulations waiting, try again later')
+            job = Job(session_id, key)
+            self._jobs[job.job_id] = job
+            self._pending[(session_id, key)] = job.job_id
+        self._executor.submit(self._run, job, model_snapshot, job_function, job_args)
+        return job
+
+    def get(self, session_id, job_id):
+        """Gets a job submitted by a session
+
+        Args:
+            session_id: str, session that submitted the job
+            job_id: str, id returned when submitting it
+
+        Returns:
+            Job, or None if it does not exist, was removed or belongs to
+            another session
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if (job is None) or (job.session_id != session_id):
+            return None
+        return job
+
+    def _run(self, job, model_snapshot, job_function, job_args):
+        job.status = 'running'
+        try:
+            with self.session_models.use(job.session_id, model_snapshot) as job_model:
+                job.result = job_function(job.session_id, job_model, *job_args)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'error'
+        # once finished, identical submissions create a new job
+        with self._lock:
+            self._pending.pop((job.session_id, job.key), None)
+        self._remove_finished()
+        return None
+
+    def _remove_finished(self):
+        # remove oldest finished jobs above max_finished
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.status in ('done', 'error')]
+            for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self._jobs[job_id]
+        return None
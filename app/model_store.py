@@ -0,0 +1,339 @@
+import json, pickle, sqlite3, threading, time
+from collections import OrderedDict
+
+from molybdenum import MolybdenumModel
+
+
+class ModelSession(object):
+    """Model and last simulation results of one browser session
+
+    Attributes:
+        session_id: str, key of the session in the store
+        model: MolybdenumModel edited by the session
+        results: NamedArray of the last simulation, None if not run yet
+        revision: int, increased by SQLiteModelStore every time the session
+            is saved, to know if the copy kept in memory is up to date
+        graph_client: str, id of the page that sent the last graph applied
+        graph_revision: int, revision of the last graph applied, graphs of
+            the same page with lower revisions are outdated
+    """
+    def __init__(self, session_id, model=None, results=None, revision=0, graph_client=None, graph_revision=-1):
+        self.session_id = session_id
+        self.model = MolybdenumModel() if model is None else model
+        self.results = results
+        self.revision = revision
+        self.graph_client = graph_client
+        self.graph_revision = graph_revision
+        # (model revision, length of the model as json) of the last estimate
+        self._model_size = None
+
+    def get_model_size(self, model_json=None):
+        """Estimates the memory used by the model in bytes
+
+        Args:
+            model_json: str, the model already exported by tojson(), if None
+                it is exported only if the model changed since the last call
+
+        Returns:
+            length of the model exported as json
+        """
+        revision = self.model.get_revision()
+        if model_json is None:
+            if (self._model_size is not None) and (self._model_size[0] == revision):
+                return self._model_size[1]
+            model_json = self.model.tojson()
+        self._model_size = (revision, len(model_json))
+        return self._model_size[1]
+
+    def get_size(self):
+        """Estimates the memory used by the session in bytes
+
+        Returns:
+            size of the model exported as json plus size of the results array
+        """
+        size = self.get_model_size()
+        if self.results is not None:
+            size += self.results.nbytes
+        return size
+
+
+class MemoryModelStore(object):
+    """Keeps sessions in memory, evicting the least recently used ones
+
+    Args:
+        max_sessions: maximum number of sessions kept
+        max_bytes: maximum memory used by all sessions, as estimated by
+            ModelSession.get_size(). The session being saved is never evicted
+
+    Notes:
+        sessions are only shared by the threads of one process, use
+        SQLiteModelStore when the app is served by several processes
+    """
+    def __init__(self, max_sessions=100, max_bytes=512*2**20):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        # session_id: (size, ModelSession), least recently used first
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Gets the session with session_id, creating it if it does not exist
+
+        Args:
+            session_id: str, key of the session, Ex. from the flask session
+
+        Returns:
+            ModelSession, changes done to it are kept, but call save() after
+            changing it so that its size is updated
+        """
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                return self._sessions[session_id][1]
+        model_session = ModelSession(session_id)
+        self.save(model_session)
+        return model_session
+
+    def save(self, model_session):
+        """Stores the session and evicts old sessions if limits are exceeded
+
+        Args:
+            model_session: ModelSession to store
+
+        Returns:
+            None, the session is stored as the most recently used one
+        """
+        size = model_session.get_size()
+        with self._lock:
+            if model_session.session_id in self._sessions:
+                self._total_bytes -= self._sessions.pop(model_session.session_id)[0]
+            self._sessions[model_session.session_id] = (size, model_session)
+            self._total_bytes += size
+            self._evict()
+        return None
+
+    def save_results(self, session_id, results):
+        """Stores the results of a simulation of the session
+
+        Args:
+            session_id: str, key of the session
+            results: NamedArray of the simulation
+
+        Returns:
+            None, only the results are replaced, so edits of the model
+            saved in the meantime are kept. Nothing is done if the session
+            was evicted
+        """
+        with self._lock:
+            if session_id not in self._sessions:
+                return None
+            model_session = self._sessions[session_id][1]
+            model_session.results = results
+        self.save(model_session)
+        return None
+
+    def delete(self, session_id):
+        """Removes the session with session_id from the store, if there"""
+        with self._lock:
+            if session_id in self._sessions:
+                self._total_bytes -= self._sessions.pop(session_id)[0]
+        return None
+
+    def _evict(self):
+        # remove least recently used sessions, keeping always the last one
+        while (len(self._sessions) > 1) and ((len(self._sessions) > self.max_sessions) or (self._total_bytes > self.max_bytes)):
+            self._total_bytes -= self._sessions.popitem(last=False)[1][0]
+        return None
+
+
+class SQLiteModelStore(object):
+    """Keeps sessions in a SQLite database, shared by several processes
+
+    Args:
+        path: path of the database file, created if it does not exist
+        max_sessions: maximum number of sessions kept in the database
+        max_bytes: maximum size of all sessions in the database, as estimated
+            by ModelSession.get_size()
+        cache_sessions: number of sessions also kept in memory by this
+            process. They are reused while their revision matches the one
+            in the database, which keeps their compiled models
+
+    Notes:
+        models are stored as json and results are pickled, the database is
+        meant to be a local file of the server and not a shared one
+    """
+    def __init__(self, path, max_sessions=1000, max_bytes=2*2**30, cache_sessions=32):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        # session_id: ModelSession, least recently used first
+        self.cache_sessions = cache_sessions
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         'session_id TEXT PRIMARY KEY, model TEXT, results BLOB, '
+                         'size INTEGER, revision INTEGER, last_access REAL, graph_revision TEXT)')
+
+    def _connect(self):
+        # one connection per call so that it can be used from any thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, session_id):
+        """Gets the session with session_id, creating it if it does not exist
+
+        Args:
+            session_id: str, key of the session, Ex. from the flask session
+
+        Returns:
+            ModelSession, call save() after changing it so that other
+            processes see the changes
+        """
+        with self._connect() as conn:
+            conn.execute('UPDATE sessions SET last_access = ? WHERE session_id = ?', (time.time(), session_id))
+            row = conn.execute('SELECT revision FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        if row is None:
+            model_session = ModelSession(session_id)
+            self.save(model_session)
+            return model_session
+        # reuse the session of this process if nobody changed it
+        with self._lock:
+            cached = self._cache.get(session_id)
+        if (cached is not None) and (cached.revision == row[0]):
+            self._cache_session(cached)
+            return cached
+        with self._connect() as conn:
+            row = conn.execute('SELECT model, results, revision, graph_revision FROM sessions WHERE session_id = ?',
+                               (session_id,)).fetchone()
+        if row is None:
+            # evicted by another process in the meantime
+            return self.get(session_id)
+        model_json, results, revision, graph_revision = row
+        model = MolybdenumModel()
+        model.loadm(json.loads(model_json, object_hook=node_keys_to_int))
+        results = None if results is None else pickle.loads(results)
+        graph_client, graph_revision = json.loads(graph_revision)
+        model_session = ModelSession(session_id, model=model, results=results, revision=revision,
+                                     graph_client=graph_client, graph_revision=graph_revision)
+        self._cache_session(model_session)
+        return model_session
+
+    def save(self, model_session):
+        """Stores the session and evicts old sessions if limits are exceeded
+
+        Args:
+            model_session: ModelSession to store
+
+        Returns:
+            None, the model and the graph revision are written to the
+            database. Results are only written by save_results()
+        """
+        model_json = model_session.model.tojson()
+        model_size = model_session.get_model_size(model_json)
+        graph_revision = json.dumps([model_session.graph_client, model_session.graph_revision])
+        with self._connect() as conn:
+            conn.execute("INSERT INTO sessions (session_id, model, size, revision) VALUES (?, '', 0, 0) "
+                         "ON CONFLICT(session_id) DO NOTHING", (model_session.session_id,))
+            # replace the size of the previous model, keeping the one of the results
+            conn.execute('UPDATE sessions SET model = ?, size = size - LENGTH(model) + ?, '
+                         'revision = revision + 1, last_access = ?, graph_revision = ? WHERE session_id = ?',
+                         (model_json, model_size, time.time(), graph_revision, model_session.session_id))
+            model_session.revision = conn.execute('SELECT revision FROM sessions WHERE session_id = ?',
+                                                  (model_session.session_id,)).fetchone()[0]
+            self._evict(conn, model_session.session_id)
+        self._cache_session(model_session)
+        return None
+
+    def save_results(self, session_id, results):
+        """Stores the results of a simulation of the session
+
+        Args:
+            session_id: str, key of the session
+            results: NamedArray of the simulation
+
+        Returns:
+            None, only the results column is written, so edits of the model
+            saved in the meantime by any process are kept. Nothing is done
+            if the session was evicted
+        """
+        results_blob = pickle.dumps(results)
+        with self._connect() as conn:
+            # size of the model, as json, plus size of the new results
+            conn.execute('UPDATE sessions SET results = ?, size = LENGTH(model) + ?, '
+                         'revision = revision + 1, last_access = ? WHERE session_id = ?',
+                         (results_blob, results.nbytes, time.time(), session_id))
+            row = conn.execute('SELECT revision FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            if row is None:
+                return None
+            self._evict(conn, session_id)
+        # the session kept in memory stays valid if it was up to date
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if (cached is not None) and (cached.revision == row[0] - 1):
+                cached.results = results
+                cached.revision = row[0]
+        return None
+
+    def delete(self, session_id):
+        """Removes the session with session_id from the store, if there"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+        with self._lock:
+            self._cache.pop(session_id, None)
+        return None
+
+    def _cache_session(self, model_session):
+        # keep the session in memory as the most recently used one
+        with self._lock:
+            self._cache[model_session.session_id] = model_session
+            self._cache.move_to_end(model_session.session_id)
+            while len(self._cache) > self.cache_sessions:
+                self._cache.popitem(last=False)
+        return None
+
+    def _evict(self, conn, keep_id):
+        # remove least recently used sessions, keeping always keep_id
+        n_sessions, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions').fetchone()
+        rows = conn.execute('SELECT session_id, size FROM sessions WHERE session_id != ? '
+                            'ORDER BY last_access', (keep_id,))
+        evicted = []
+        for session_id, size in rows:
+            if (n_sessions <= self.max_sessions) and (total_bytes <= self.max_bytes):
+                break
+            evicted.append((session_id,))
+            n_sessions -= 1
+            total_bytes -= size
+        conn.executemany('DELETE FROM sessions WHERE session_id = ?', evicted)
+        with self._lock:
+            for (session_id,) in evicted:
+                self._cache.pop(session_id, None)
+        return None
+
+
+def node_keys_to_int(dct):
+    """Converts node ids back to integers when loading models from json
+
+    json turns the integer keys of node_to_id into strings
+    """
+    if all(key.isdigit() for key in dct.keys()) and (len(dct) > 0):
+        return {int(key): val for key, val in dct.items()}
+    return dct
+
+
+def create_model_store(store_path=None, max_sessions=100, max_bytes=512*2**20):
+    """Creates the store used by the app
+
+    Args:
+        store_path: path of a SQLite database, if None sessions are kept in
+            memory of the process
+        max_sessions: maximum number of sessions kept
+        max_bytes: maximum memory used by all sessions
+
+    Returns:
+        MemoryModelStore or SQLiteModelStore
+    """
+    if store_path:
+        return SQLiteModelStore(store_path, max_sessions=max_sessions, max_bytes=max_bytes)
+    return MemoryModelStore(max_sessions=max_sessions, max_bytes=max_bytes)
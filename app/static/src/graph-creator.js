@@ -21,19 +21,29 @@ document.onload = (function(d3, saveAs, Blob, undefined){
       var jsonModel = {"nodes": thisGraph.nodes, "edges": saveEdges}; 
       return jsonModel
     };
+    // posts are numbered so that the server can drop the ones arriving late
+    var graphClient = Math.random().toString(36).slice(2);
+    var graphRevision = 0;
     // pass JSON data to flask (as json)
     var transferJson = function(thisGraph){
       var jsonModel = modelToJson(thisGraph);
+      graphRevision += 1;
+      jsonModel.client = graphClient;
+      jsonModel.revision = graphRevision;
       $.ajax({
         type: "POST", // HTTP method POST or GET
         contentType: 'application/json; charset=utf-8', //type that is sent
-        dataType:'html', // expected receive type to determine success
-        url: '/updated_graph', // where to make Ajax calls
+        dataType:'json', // expected receive type to determine success
+        url: '/updated_graph?patch=1', // where to make Ajax calls, only get rows of the form that changed
         processData: false,
         data:JSON.stringify(jsonModel), //get model in json
-        success: function (response) {
-					// update form
-					$("#modelParameters").html(response);
+        success: function (response, textStatus, xhr) {
+					// 204 when the post was outdated or did not change the model
+					if (xhr.status == 204) {
+						return;
+					}
+					// update rows of the form that changed
+					applyFormPatch(response);
 				},
 				error: function (xhr) {
           console.log("Did not receive correct data type to update form")
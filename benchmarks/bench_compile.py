@@ -0,0 +1,54 @@
+"""Compares the time to compile models loading SBML directly or through antimony
+
+Run from the repository root:
+    python benchmarks/bench_compile.py
+"""
+import sys
+import time
+
+sys.path.append(".")
+from molybdenum import MolybdenumModel
+
+
+def build_chain_model(n_reactions):
+    """Builds a linear chain S0 -> S1 -> ... with n_reactions mass action reactions"""
+    species = {}
+    reactions = {}
+    params = {}
+    for i in range(n_reactions + 1):
+        species[f"spec{i + 1}"] = {"name": f"S{i}", "amt": 10.0 if i == 0 else 0.0, "fixed": False}
+    for i in range(n_reactions):
+        reactions[f"reac{i + 1}"] = {
+            "name": f"v{i}",
+            "reagents": [f"S{i}"],
+            "products": [f"S{i + 1}"],
+            "expression": f"k{i}*S{i}",
+        }
+        params[f"param{i + 1}"] = {"name": f"k{i}", "val": 0.1}
+    mbmodel = MolybdenumModel()
+    mbmodel.loadm({
+        "species": species,
+        "reactions": reactions,
+        "params": params,
+        "sim_params": {"sim_start": 0.0, "sim_end": 10.0, "sim_points": 100},
+    })
+    return mbmodel
+
+
+def time_compile(mbmodel, from_antimony, repeats):
+    """Returns the best time out of repeats to compile the model"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        mbmodel.compile_model(from_antimony=from_antimony)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    print(f"{'reactions':>10} {'antimony (s)':>14} {'sbml (s)':>10} {'speedup':>8}")
+    for n_reactions, repeats in [(10, 5), (100, 3), (1000, 1)]:
+        mbmodel = build_chain_model(n_reactions)
+        t_antimony = time_compile(mbmodel, True, repeats)
+        t_sbml = time_compile(mbmodel, False, repeats)
+        print(f"{n_reactions:>10} {t_antimony:>14.3f} {t_sbml:>10.3f} {t_antimony / t_sbml:>8.2f}")
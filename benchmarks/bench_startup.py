@@ -0,0 +1,71 @@
+"""Measures import time of molybdenum and time to first response of the web app
+
+Run from the repository root:
+    python benchmarks/bench_startup.py
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def time_import(statement, repeats):
+    """Returns the best time out of repeats to run statement in a new python process"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True, env=get_env())
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_first_response(repeats, url_path="/"):
+    """Returns the best time out of repeats from starting the app to its first response"""
+    times = []
+    for _ in range(repeats):
+        port = get_free_port()
+        env = get_env()
+        env["PORT"] = str(port)
+        start = time.perf_counter()
+        app_process = subprocess.Popen([sys.executable, os.path.join("app", "app.py")], env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}{url_path}", timeout=1) as response:
+                        response.read()
+                    break
+                except OSError:
+                    if app_process.poll() is not None:
+                        raise RuntimeError("The app exited before answering")
+                    time.sleep(0.01)
+            times.append(time.perf_counter() - start)
+        finally:
+            app_process.terminate()
+            app_process.wait()
+    return min(times)
+
+
+def get_env():
+    """Environment with the repository root in the python path"""
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join([os.getcwd(), env.get("PYTHONPATH", "")])
+    return env
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+if __name__ == "__main__":
+    # baseline to subtract the start of the interpreter
+    t_python = time_import("pass", 5)
+    print(f"{'measure':>36} {'time (s)':>10}")
+    print(f"{'python start':>36} {t_python:>10.3f}")
+    print(f"{'import molybdenum':>36} {time_import('import molybdenum', 5):>10.3f}")
+    print(f"{'import molybdenum and tellurium':>36} {time_import('import molybdenum, tellurium', 3):>10.3f}")
+    print(f"{'app first response':>36} {time_first_response(3):>10.3f}")
@@ -1 +1,3 @@
-from .molybdenum import MolybdenumModel
\ No newline at end of file
+from .molybdenum import MolybdenumModel
+from .snapshot import ModelSnapshot
+from .pool import SimulationPool
@@ -1,13 +1,97 @@
-import re, copy, io, base64
+import re, io, base64
 import warnings
 import json
+import hashlib
+import heapq
+import importlib
+import itertools
+import os
+import weakref
+from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .snapshot import ModelSnapshot, FrozenDict, MODEL_KEYS, copy_component, thaw
+from .stats import EnsembleStats
+
+
+class LazyModule(object):
+    """Module imported the first time one of its attributes is used
+
+    Args:
+        module_name: name of the module, Ex. "tellurium"
+
+    Notes:
+        tellurium, simplesbml (which imports tellurium), roadrunner and pandas
+        take seconds to import, loading them lazily keeps importing
+        molybdenum fast when only editing models (loadm, toGraph...)
+    """
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, attr)
+
+
+pd = LazyModule('pandas')
+roadrunner = LazyModule('roadrunner')
+simplesbml = LazyModule('simplesbml')
+te = LazyModule('tellurium')
+optimize = LazyModule('scipy.optimize')
+
+# mathematical characters used to split reaction expressions into species,
+# parameters and numbers. Surrounding them with parenthesis keeps them after
+# splitting, so joining the split expression gives back the expression
+MATH_CHARS = r'([+\-*/\[\]\(\)\s,;^])'
+
+# prefix of the ids generated for each component class, see get_new_id()
+ID_PREFIXES = {'species': 'spec',
+               'reactions': 'reac',
+               'params': 'param'}
+
+def model_component(key):
+    """Creates the property used to access one of the MODEL_KEYS of a model
+
+    The property returns the dictionary kept in the model. While it is
+    shared with a snapshot it is returned as a read-only view, the methods
+    that edit the model copy it first, see MolybdenumModel.unshare()
+    """
+    def get_component(self):
+        if self.is_shared(key):
+            return FrozenDict(self._model_data[key])
+        return self._model_data[key]
+
+    def set_component(self, value):
+        self._model_data[key] = value
+        self._shared.discard(key)
+        self._revision += 1
+
+    return property(get_component, set_component)
 
-import pandas as pd
-import simplesbml
-import tellurium as te
 
 class MolybdenumModel(object):
+    # model components, stored in self._model_data
+    species = model_component('species')
+    reactions = model_component('reactions')
+    params = model_component('params')
+    node_to_id = model_component('node_to_id')
+    sim_params = model_component('sim_params')
+
     def __init__(self):
+        # dictionaries of the model components and keys of the ones that are
+        # shared with a snapshot and must be copied before being edited
+        self._model_data = dict()
+        self._shared = set()
+        # weak references to the snapshots taken from the model, and
+        # snapshot the model was loaded from, see is_shared()
+        self._snapshots = []
+        self._loaded_snapshot = None
+        # number of edits of the model, see get_revision()
+        self._revision = 0
         self.species = dict()
         self.reactions = dict()
         self.params = dict()
@@ -15,6 +99,31 @@ class MolybdenumModel(object):
         self.sim_params = dict()
         # not implemented yet
         # self.events = dict()   
+        # compiled tellurium models keyed by the structure of the model, so
+        # that changing values does not require compiling it again
+        self._temodels = OrderedDict()
+        self._temodels_maxsize = 8
+        # steady states keyed by get_steady_state_key(), see steady_state()
+        self._steady_states = OrderedDict()
+        self._steady_states_maxsize = 256
+        # split reaction expressions by reaction id, see get_expr_tokens()
+        self._expr_tokens = dict()
+        # reverse lookups kept up to date by the methods that edit the model,
+        # see build_indexes()
+        self._id_to_node = dict()
+        self._spec_name_to_id = dict()
+        self._param_name_to_id = dict()
+        # state used to generate new ids by component class, see get_new_id()
+        self._id_allocators = dict()
+        # (model hash, representations) of the last get_representations() call
+        self._representations = None
+        # (revision, model hash) of the last get_model_hash() call
+        self._model_hash = None
+        # (structure key, SBML string) of the last get_model_info() call
+        self._model_info_sbml = None
+        # hash of the last graph applied by update_from_graph(), None when
+        # the model was changed by other means since then
+        self._graph_hash = None
 
     def create_ids(self):
         """
@@ -29,6 +138,7 @@ class MolybdenumModel(object):
                 keys: integers corresponding to node ids
                 values: corresponding ids in the molybdenum model
         """
+        self._graph_hash = None
         node_to_id = dict()
         mb_ids = list(self.species.keys()) + list(self.reactions.keys())
         
@@ -36,9 +146,88 @@ class MolybdenumModel(object):
             node_to_id[node_id] = mb_id
 
         self.node_to_id = node_to_id
+        self.build_indexes()
 
         return None
 
+    def build_indexes(self):
+        """Builds the reverse lookups of the model from scratch
+
+        Args:
+            uses node_to_id, species names and parameter names of the model
+
+        Returns:
+            assigns to the model in self:
+                _id_to_node: molybdenum ids as keys, node ids as values
+                _spec_name_to_id: species names as keys, species ids as values
+                _param_name_to_id: parameter names as keys, parameter ids as values
+
+        Notes:
+            methods that edit the model update these lookups as they go, so
+            this is only needed when the model is loaded or edited directly
+        """
+        self._id_to_node = {mb_id: node_id for node_id, mb_id in self.node_to_id.items()}
+        self._spec_name_to_id = {spec['name']: spec_id for spec_id, spec in self.species.items()}
+        self._param_name_to_id = {param['name']: param_id for param_id, param in self.params.items()}
+        return None
+
+    def get_node_id(self, mb_id):
+        """Gets the node id of a species or reaction
+
+        Args:
+            mb_id: id of the species or reaction in the molybdenum model
+
+        Returns:
+            node_id: integer node id assigned to mb_id in node_to_id
+
+        Raises:
+            KeyError if mb_id has no node id
+        """
+        node_id = self._id_to_node.get(mb_id)
+        if (node_id is None) or (self.node_to_id.get(node_id) != mb_id):
+            # node_to_id was edited directly, lookups are outdated
+            self.build_indexes()
+            node_id = self._id_to_node[mb_id]
+        return node_id
+
+    def get_spec_id(self, name):
+        """Gets the id of a species from its name
+
+        Args:
+            name: name of the species. Ex. 'E'
+
+        Returns:
+            spec_id: id of the species in the molybdenum model. Ex. 'spec1'
+
+        Raises:
+            KeyError if there is no species with that name
+        """
+        spec_id = self._spec_name_to_id.get(name)
+        if (spec_id is None) or (spec_id not in self.species) or (self.species[spec_id]['name'] != name):
+            # species were edited directly, lookups are outdated
+            self.build_indexes()
+            spec_id = self._spec_name_to_id[name]
+        return spec_id
+
+    def get_param_id(self, name):
+        """Gets the id of a parameter from its name
+
+        Args:
+            name: name of the parameter. Ex. 'kon'
+
+        Returns:
+            param_id: id of the parameter in the molybdenum model. Ex. 'param2'
+
+        Raises:
+            KeyError if there is no parameter with that name
+        """
+        param_id = self._param_name_to_id.get(name)
+        if (param_id is None) or (param_id not in self.params) or (self.params[param_id]['name'] != name):
+            # parameters were edited directly, lookups are outdated
+            self.build_indexes()
+            param_id = self._param_name_to_id[name]
+        return param_id
+
     def loadm(self, molybdenum_model):
         """Creates internal representation of molybdenum model from a dictionary
 
@@ -105,13 +294,17 @@ class MolybdenumModel(object):
                 }
             }
         """
-        if type(molybdenum_model) != dict:
+        if isinstance(molybdenum_model, ModelSnapshot):
+            # snapshots cannot change, so their dictionaries are shared until
+            # the model uses them
+            mbmod = dict(molybdenum_model._data)
+        elif type(molybdenum_model) == dict:
+            # copy is important or next steps would be modifying initial dictionary
+            # copying each element is enough, there are no deeper dictionaries
+            mbmod = {key: copy_component(val) if (key in MODEL_KEYS) and (type(val) == dict) else val
+                     for key, val in molybdenum_model.items()}
+        else:
             raise ValueError(f'Molybdenum model must be entered as a dictionary, but got {type(molybdenum_model)}')
-        
-        
-        # copy is important or next steps would be modifying initial dictionary
-        # deepcopy is required because there are recursive lists/dictionaries and .copy() does not copy them
-        mbmod = copy.deepcopy(molybdenum_model)
 
         if 'species' not in mbmod.keys():
             raise ValueError(f'Molybdenum model must have a "species" key')
@@ -153,6 +346,15 @@ class MolybdenumModel(object):
         else:
             # keep empty, if user tries to use it, will raise error
             self.sim_params = dict()
+
+        if isinstance(molybdenum_model, ModelSnapshot):
+            self._shared.update(key for key in MODEL_KEYS if key in mbmod.keys())
+            self._loaded_snapshot = molybdenum_model
+        else:
+            self._loaded_snapshot = None
+        self.build_indexes()
+        # the model does not come from a graph
+        self._graph_hash = None
         return None
     
     def todict(self):
@@ -163,9 +365,89 @@ class MolybdenumModel(object):
 
         Returns:
             molybdenum representation of the model in a dictionary as defined
-            as input in loadm() function
+            as input in loadm() function. It is a copy, use snapshot() to
+            export the model without copying it
+        """
+        model_dict = {key: thaw(self._model_data[key]) for key in MODEL_KEYS}
+        return model_dict
+
+    def snapshot(self):
+        """Takes a read-only snapshot of the model
+
+        Args:
+            internal model representation
+
+        Returns:
+            model_snapshot: ModelSnapshot, a read-only dictionary with the
+                same keys as todict(). It does not change when the model is
+                edited and can be loaded in other models with loadm()
+
+        Notes:
+            the model is not copied when taking the snapshot. Until each
+            model component is edited, reading it from the model gives a
+            read-only view, and the methods that edit it copy it first, see
+            unshare(). Edit the model through its methods or call unshare()
+            before changing its dictionaries directly. Once the snapshot is
+            no longer used the model stops sharing its components, see
+            is_shared()
+        """
+        # snapshots of a model loaded from a snapshot may share its dictionaries
+        model_snapshot = ModelSnapshot({key: self._model_data[key] for key in MODEL_KEYS},
+                                       source=self._loaded_snapshot)
+        self._shared.update(MODEL_KEYS)
+        # forget the snapshots that are no longer used
+        self._snapshots = [snapshot_ref for snapshot_ref in self._snapshots if snapshot_ref() is not None]
+        self._snapshots.append(weakref.ref(model_snapshot))
+        return model_snapshot
+
+    def is_shared(self, key):
+        """Checks if a model component is shared with a snapshot
+
+        Args:
+            key: one of the MODEL_KEYS, Ex. 'species'
+
+        Returns:
+            shared: bool, True if a snapshot still in use has the component.
+                Components of snapshots that are no longer used are
+                marked as not shared, so they are edited without copying
+        """
+        if key not in self._shared:
+            return False
+        component = self._model_data[key]
+        snapshots = [snapshot_ref() for snapshot_ref in self._snapshots]
+        if self._loaded_snapshot is not None:
+            snapshots.append(self._loaded_snapshot)
+        if any((model_snapshot is not None) and (model_snapshot._data.get(key) is component)
+               for model_snapshot in snapshots):
+            return True
+        # the snapshots sharing it were dropped
+        self._shared.discard(key)
+        return False
+
+    def unshare(self, *keys):
+        """Copies model components shared with a snapshot before editing them
+
+        Args:
+            keys: MODEL_KEYS of the components to edit, Ex. 'species'
+
+        Returns:
+            replaces each component still shared with a snapshot with a copy
+            that only this model uses, components not shared are left as
+            they are. It is called by every method that edits the model, so
+            it also counts as an edit, see get_revision()
         """
-        return self.__dict__
+        self._revision += 1
+        for key in keys:
+            if not self.is_shared(key):
+                continue
+            prev_component = self._model_data[key]
+            self._model_data[key] = copy_component(prev_component)
+            self._shared.discard(key)
+            # the id generator refers to the component it was built from
+            allocator = self._id_allocators.get(key)
+            if (allocator is not None) and (allocator['components'] is prev_component):
+                allocator['components'] = self._model_data[key]
+        return None
         
     def tojson(self):
         """Exports model as a json list
@@ -177,10 +459,38 @@ class MolybdenumModel(object):
             json representation of the components defined in the model, with the
             same structure as the dictionary defined above
         """
-        json_rep = json.dumps(self.todict())
+        # dump the stored dictionaries directly, without copying them
+        json_rep = json.dumps({key: self._model_data[key] for key in MODEL_KEYS})
         return json_rep
 
-    def get_modifier_names(self, reac_id):
+    def get_expr_tokens(self, reac_id):
+        """Gets the reaction expression split into math characters and names
+
+        Args:
+            reac_id: ID assigned to the reaction
+
+        Returns:
+            tokens: list alternating names and math characters, joining it
+                gives back the expression. Ex. '2*E+kon' gives
+                ['2', '*', 'E', '+', 'kon']
+            names: set of non-empty names (species, parameters or numbers)
+                used in the expression. Ex. {'2', 'E', 'kon'}
+
+        Notes:
+            the split expression is kept and only computed again when the
+            expression of the reaction changes
+        """
+        expression = self.reactions[reac_id]['expression']
+        cached = self._expr_tokens.get(reac_id)
+        if (cached is None) or (cached[0] != expression):
+            tokens = re.split(MATH_CHARS, expression)
+            # math characters are in odd positions, names in even ones
+            names = set(token for token in tokens[::2] if token != '')
+            cached = (expression, tokens, names)
+            self._expr_tokens[reac_id] = cached
+        return cached[1], cached[2]
+
+    def get_modifier_names(self, reac_id, spec_names=None):
         """Identifies modifiers in a reaction
         
         Looks at the reaction expression to identify those species that 
@@ -189,27 +499,26 @@ class MolybdenumModel(object):
 
         Args:
             reac_id: ID assigned to the reaction with modifiers
+            spec_names: (optional) set of species names in the model, avoids
+                collecting them again when called for many reactions
 
         Returns:
             modifiers: list of species names that act as modifiers
         """
-        # define mathematical characters to split the expression into
-        math_chars = '[+\-*/\[\]\(\)\s,;^]'
-        
-        # get expression, reagents and products
-        reac_expr = self.reactions[reac_id]['expression']
+        # get reagents and products
         reac_reag = self.reactions[reac_id]['reagents']
         reac_prod = self.reactions[reac_id]['products']
 
         # get species names
-        spec_names = [spec['name'] for spec in self.species.values()]
+        if spec_names is None:
+            spec_names = set(spec['name'] for spec in self.species.values())
 
         # keep track of modifiers for this reaction as list of species names
         modifiers = []
-        # split expression by math characters, giving a list of parameters and species
-        vals = re.split(math_chars, reac_expr)
+        # names in the expression, parameters and species
+        _, vals = self.get_expr_tokens(reac_id)
         # iterate by each parameter
-        for val in set(vals):
+        for val in vals:
             # if it is neither a reagent nor a product but yes a specie, it is a modifier
             if (val not in reac_reag) and (val not in reac_prod) and (val in spec_names):
                 modifiers.append(val)
@@ -244,6 +553,7 @@ class MolybdenumModel(object):
             spec_dict[spec_name] = simpSbml_rep.addSpecies(species_id = spec_name, amt = spec['amt'])#, comp='c1')
         
         # add reactions
+        spec_names = set(spec['name'] for spec in self.species.values())
         for reac_id, reac in self.reactions.items():
             # keep reaction in variable in case we need to add modifiers to it
             reac_simpsbml = simpSbml_rep.addReaction(reactants=reac['reagents'],
@@ -251,7 +561,7 @@ class MolybdenumModel(object):
                                      expression=reac['expression'],
                                      rxn_id=reac['name'])
             # get names of modifier species
-            modifier_list = self.get_modifier_names(reac_id)
+            modifier_list = self.get_modifier_names(reac_id, spec_names)
             for modifier_name in modifier_list:
                 # add the addSpecies object by searching by species name in dictionary
                 reac_simpsbml.addModifier(spec_dict[modifier_name])
@@ -308,6 +618,36 @@ class MolybdenumModel(object):
         sb_rep = r.sbmlToAntimony(sbml_str)[1]
         return sb_rep
 
+    def get_representations(self):
+        """Gets all representations of the model, building SBML only once
+
+        Args:
+            internal model representation
+
+        Returns:
+            representations: dictionary with keys "hash" (see get_model_hash()),
+                "sbml", "antimony", "writeup" (simpleSBML commands) and "dict"
+                (see todict()). It is kept until the model changes, so calling
+                it again for the same model does not build anything
+
+        Raises:
+            the errors of toSBMLstr() if the model cannot be converted
+        """
+        model_hash = self.get_model_hash()
+        if (self._representations is not None) and (self._representations[0] == model_hash):
+            return self._representations[1]
+
+        sbml_str = self.toSBMLstr()
+        representations = {
+            'hash': model_hash,
+            'sbml': sbml_str,
+            'antimony': te.antimonyConverter().sbmlToAntimony(sbml_str)[1],
+            'writeup': simplesbml.simplesbml.writeCodeFromString(sbml_str),
+            'dict': self.todict(),
+        }
+        self._representations = (model_hash, representations)
+        return representations
+
     def toGraph(self):
         """Converts the current model to its node representation
 
@@ -391,32 +731,45 @@ class MolybdenumModel(object):
             graph_rep['nodes'].append(node_info)
             
         # fill in edge information from reactions
-        # inverse the information in nodes_to_id
-        id_to_nodes = {v: k for k, v in self.node_to_id.items()}
-        # relate each species name to its id
-        spec_name_to_id = {spec_info['name']: spec_id for spec_id, spec_info in self.species.items()}
-        # then iterate by each reaction
+        graph_rep['edges'] = self.get_edges()
+
+        return graph_rep
+
+    def get_edges(self):
+        """Gets the edges of the graphical representation of the model
+
+        Args:
+            internal model representation, specifically the node_to_id
+            information and reaction reagents/products
+
+        Returns:
+            edges: list of dictionaries with "source" and "target" attributes
+                that have a node id assigned to them, as in toGraph()
+                Ex. [{"source": 1, "target": 5}, {"source": 5, "target": 3}]
+        """
+        edges = []
+        # iterate by each reaction
         for reac_mb_id, reac in self.reactions.items():
             # first reagents
             for reagent in reac['reagents']:
                 # source is the species
-                source = id_to_nodes[spec_name_to_id[reagent]]
+                source = self.get_node_id(self.get_spec_id(reagent))
                 # target is the reaction
-                target = id_to_nodes[reac_mb_id]
+                target = self.get_node_id(reac_mb_id)
                 # keep information
-                graph_rep['edges'].append({'source': source,
-                                           'target': target})
+                edges.append({'source': source,
+                              'target': target})
             # then products
             for product in reac['products']:
                 # source is the reaction
-                source = id_to_nodes[reac_mb_id]
+                source = self.get_node_id(reac_mb_id)
                 # target is the species
-                target = id_to_nodes[spec_name_to_id[product]]
+                target = self.get_node_id(self.get_spec_id(product))
                 # keep information
-                graph_rep['edges'].append({'source': source,
-                                           'target': target})
+                edges.append({'source': source,
+                              'target': target})
 
-        return graph_rep
+        return edges
     
     def check_nodes(self, graph_rep):
         """Checks if there are any new species or reactions
@@ -443,18 +796,16 @@ class MolybdenumModel(object):
                 pass
         
         # check which ones are no longer there
-        # get list of current nodes in graph
-        graph_ids = [graph_node['id'] for graph_node in graph_rep['nodes']]
-        # get relation of model ids to node ids
-        id_to_nodes = {v: k for k, v in self.node_to_id.items()}
+        # get set of current nodes in graph
+        graph_ids = set(graph_node['id'] for graph_node in graph_rep['nodes'])
         # check if all current nodes in model are there or have been deleted
         for species_id in self.species.keys():
-            if id_to_nodes[species_id] not in graph_ids:
-                del_nodes['species'].append(id_to_nodes[species_id])
+            if self.get_node_id(species_id) not in graph_ids:
+                del_nodes['species'].append(self.get_node_id(species_id))
         
         for reaction_id in self.reactions.keys():
-            if id_to_nodes[reaction_id] not in graph_ids:
-                del_nodes['reactions'].append(id_to_nodes[reaction_id])
+            if self.get_node_id(reaction_id) not in graph_ids:
+                del_nodes['reactions'].append(self.get_node_id(reaction_id))
 
         return new_nodes, del_nodes
 
@@ -473,21 +824,90 @@ class MolybdenumModel(object):
         Returns:
             new_id: unique and non-used id for a component of the desired kind
                 Ex. 'spec3' or 'reac5'
+
+        Notes:
+            the integers in use are only searched once per component class,
+            see build_id_allocator(). Ids of components deleted by the model
+            methods are made available again with release_id().
         """
-        # define the prefix for each component class
-        prefixes = {'species': 'spec',
-                    'reactions': 'reac',
-                    'params': 'param'}
         try:
-            prefix = prefixes[comp_class]
+            prefix = ID_PREFIXES[comp_class]
         except:
-            raise ValueError(f'Component class must be one of {list(prefixes.keys())}, but got {comp_class}')
-        
-        ct = 1
-        while prefix+str(ct) in self.todict()[comp_class].keys():
-            ct += 1
-        new_id = prefix+str(ct)
+            raise ValueError(f'Component class must be one of {list(ID_PREFIXES.keys())}, but got {comp_class}')
+
+        components = self._model_data[comp_class]
+        allocator = self._id_allocators.get(comp_class)
+        if (allocator is None) or (allocator['components'] is not components):
+            # model was loaded or its dictionary was replaced
+            allocator = self.build_id_allocator(comp_class)
+
+        # integers below the highest one used are kept in a heap, discard the
+        # ones that have been used since they were freed
+        free = allocator['free']
+        while free and (prefix+str(free[0]) in components):
+            heapq.heappop(free)
+        if free:
+            return prefix+str(free[0])
+        # otherwise use the next integer after the highest one used
+        while prefix+str(allocator['highest']+1) in components:
+            allocator['highest'] += 1
+        new_id = prefix+str(allocator['highest']+1)
         return new_id
+
+    def build_id_allocator(self, comp_class):
+        """Finds the integers used in the ids of one component class
+
+        Args:
+            comp_class: string indicating the kind of component, either
+                'species', 'reactions' or 'params'
+
+        Returns:
+            allocator: dictionary assigned to self._id_allocators[comp_class]
+                with keys:
+                "components": species, reactions or params dictionary the
+                    allocator was built from
+                "highest": highest integer used in an id of this class
+                "free": heap with the unused integers below "highest"
+
+        Notes:
+            only depends on the ids present in the model, so models exported
+            with todict() or tojson() generate the same ids after loadm()
+        """
+        prefix = ID_PREFIXES[comp_class]
+        components = self._model_data[comp_class]
+        id_pattern = re.compile(f'{prefix}([1-9][0-9]*)$')
+        used = set()
+        for comp_id in components.keys():
+            id_match = id_pattern.match(comp_id)
+            if id_match:
+                used.add(int(id_match.group(1)))
+        highest = max(used) if used else 0
+        # a list of ascending integers is already a heap
+        free = [ct for ct in range(1, highest) if ct not in used]
+        allocator = {'components': components, 'highest': highest, 'free': free}
+        self._id_allocators[comp_class] = allocator
+        return allocator
+
+    def release_id(self, comp_class, comp_id):
+        """Makes the id of a deleted component available to get_new_id()
+
+        Args:
+            comp_class: string indicating the kind of component, either
+                'species', 'reactions' or 'params'
+            comp_id: id of the component that was deleted. Ex. 'spec2'
+
+        Returns:
+            updates the id generator of the component class, so nothing is returned
+        """
+        allocator = self._id_allocators.get(comp_class)
+        id_match = re.match(f'{ID_PREFIXES[comp_class]}([1-9][0-9]*)$', comp_id)
+        if (allocator is None) or (id_match is None):
+            # nothing to update, the allocator will be built when needed
+            return None
+        ct = int(id_match.group(1))
+        if ct <= allocator['highest']:
+            heapq.heappush(allocator['free'], ct)
+        return None
     
     ## TODO: what is the correct place to locate functions that do not use self? in or out the class or in a utils module?
     def init_spec(self, name, amt=10.0, fixed=False):
@@ -610,10 +1030,8 @@ class MolybdenumModel(object):
             if old_name is not found in the expression, the expression is still processed
             but nothing changes
         """
-        # surrounding it with parenthesis keeps the element that triggers splitting
-        math_chars = '([+\-*\[\]\(\)\s,;^])'
         # split into math symbols
-        split_exp = re.split(math_chars, expr)
+        split_exp = re.split(MATH_CHARS, expr)
         # replace name and merge back into string
         updated_expression = ''.join([new_name if name==old_name else name for name in split_exp])
         return updated_expression
@@ -629,34 +1047,100 @@ class MolybdenumModel(object):
             updates the name in the model, so nothing is returned
 
         Notes:
-            if changing a species name, it also updates its name in the expressions of reaction that use it
-            but if changing species name, it does not update reagents/products in the reactions that use it
+            if changing a species name, it also updates its name in the expressions,
+            reagents and products of reactions that use it, see rename_species_byid()
             does not work to rename parameters because they are not in kept track in the node_to_id dictionary
         """
+        self._graph_hash = None
         try:
             mb_id = self.node_to_id[node_id]
         except:
             raise ValueError(f'Could not find {node_id} in node_to_id relations')
             
         if mb_id in self.species.keys():
-            # get previous species name
-            prev_name = self.species[mb_id]['name']
-            # check if name has changed
-            if prev_name != element_name:
-                # if yes, update the expressions in reactions
-                for reac_info in self.reactions.values():
-                    reac_info['expression'] = self.update_expr(reac_info['expression'], prev_name, element_name)
-            else:
-                pass
-            # finally, update name to new one
-            self.species[mb_id]['name'] = element_name
+            self.rename_species_byid({mb_id: element_name})
         elif mb_id in self.reactions.keys():
+            self.unshare('reactions')
             self.reactions[mb_id]['name'] = element_name
         else:
             raise ValueError(f'Did not find id {node_id} in model')
             
         return None
     
+    def rename_species(self, name_map):
+        """Renames many species at once
+
+        Args:
+            name_map: dictionary with current species names as keys and their
+                new names as values. Ex. {'E': 'ns_E', 'S': 'ns_S'}
+
+        Returns:
+            updates species names and the expressions, reagents and products
+            of reactions that use them, so nothing is returned
+
+        Raises:
+            ValueError if a name in name_map is not a species name
+
+        Notes:
+            all names are replaced at the same time, so names can be swapped.
+            Ex. {'A': 'B', 'B': 'A'}
+        """
+        self._graph_hash = None
+        spec_names = dict()
+        for prev_name, new_name in name_map.items():
+            try:
+                spec_names[self.get_spec_id(prev_name)] = new_name
+            except KeyError:
+                raise ValueError(f'Could not find species named {prev_name}')
+        self.rename_species_byid(spec_names)
+        return None
+
+    def rename_species_byid(self, spec_names):
+        """Renames many species at once based on their species ids
+
+        Args:
+            spec_names: dictionary with species ids as keys and their new
+                names as values. Ex. {'spec1': 'ns_E', 'spec2': 'ns_S'}
+
+        Returns:
+            updates species names and the expressions, reagents and products
+            of reactions that use them, so nothing is returned
+
+        Notes:
+            each reaction that uses any of the renamed species is rewritten
+            once, using its split expression (see get_expr_tokens())
+        """
+        self._graph_hash = None
+        # relate previous names to new ones, skipping names that do not change
+        name_map = dict()
+        for spec_id, new_name in spec_names.items():
+            if self.species[spec_id]['name'] != new_name:
+                name_map[self.species[spec_id]['name']] = new_name
+        if len(name_map) == 0:
+            return None
+
+        self.unshare('species', 'reactions')
+        for reac_id, reac in self.reactions.items():
+            tokens, names = self.get_expr_tokens(reac_id)
+            if not names.isdisjoint(name_map):
+                # names are in even positions, math characters in odd ones
+                reac['expression'] = ''.join([name_map.get(token, token) if pos % 2 == 0 else token
+                                              for pos, token in enumerate(tokens)])
+            if not name_map.keys().isdisjoint(reac['reagents']):
+                reac['reagents'] = [name_map.get(name, name) for name in reac['reagents']]
+            if not name_map.keys().isdisjoint(reac['products']):
+                reac['products'] = [name_map.get(name, name) for name in reac['products']]
+
+        # finally, update names to new ones
+        for spec_id, new_name in spec_names.items():
+            prev_name = self.species[spec_id]['name']
+            self.species[spec_id]['name'] = new_name
+            if self._spec_name_to_id.get(prev_name) == spec_id:
+                self._spec_name_to_id.pop(prev_name)
+        for spec_id, new_name in spec_names.items():
+            self._spec_name_to_id[new_name] = spec_id
+        return None
+
     def add_connection(self, source, target):
         """Adds connection between source and target
 
@@ -677,6 +1161,7 @@ class MolybdenumModel(object):
             raising a warning means it ignores all connections between species or
             between reactions, but does not raise an error in response to them
         """
+        self._graph_hash = None
         try:
             source_id = self.node_to_id[source]
         except:
@@ -687,6 +1172,7 @@ class MolybdenumModel(object):
         except:
             raise ValueError(f'Could not find node_id with id {target}')
             
+        self.unshare('reactions')
         # if source is species, target is reaction
         if (source_id in self.species.keys()) and (target_id in self.reactions.keys()):
             # add source species as reagent in the target reaction
@@ -700,6 +1186,48 @@ class MolybdenumModel(object):
             warnings.warn(f'Warning, connection {source, target} is not between a species and a reaction')
         return None
 
+    def remove_connection(self, source, target):
+        """Removes connection between source and target
+
+        Args:
+            source: node_id of the species or reaction where connection starts
+            target: node_id of the species or reaction where connection ends
+
+        Returns:
+            updates the model directly.
+            if source is a species, removes its name from reagents of target reaction.
+            if source is a reaction, removes target species name from source reaction products.
+
+        Raises:
+            warning if both source and target are a species or a reaction
+            ValueError if node id of source or target is not in node_to_id
+            ValueError if the connection is not in the model
+        """
+        self._graph_hash = None
+        try:
+            source_id = self.node_to_id[source]
+        except:
+            raise ValueError(f'Could not find node_id with id {source}')
+
+        try:
+            target_id = self.node_to_id[target]
+        except:
+            raise ValueError(f'Could not find node_id with id {target}')
+
+        self.unshare('reactions')
+        try:
+            if (source_id in self.species.keys()) and (target_id in self.reactions.keys()):
+                # remove source species from reagents in the target reaction
+                self.reactions[target_id]['reagents'].remove(self.species[source_id]['name'])
+            elif (target_id in self.species.keys()) and (source_id in self.reactions.keys()):
+                # remove target species from products in the source reaction
+                self.reactions[source_id]['products'].remove(self.species[target_id]['name'])
+            else:
+                warnings.warn(f'Warning, connection {source, target} is not between a species and a reaction')
+        except ValueError:
+            raise ValueError(f'Connection {source, target} is not in the model')
+        return None
+
     def is_float(self, element):
         """Checks if an element can be converted to float
         
@@ -739,20 +1267,17 @@ class MolybdenumModel(object):
             Example input for two reactions: '(kon*E*S-koff*ES)', '2*E+ kcat+koff'
             Example output: param_list=['kon','koff','kcat']
         """
-        # define mathematical characters to split the expression into
-        math_chars = '[+\-*/\[\]\(\)\s,;^]'
         # initialize parameter list
         param_list = []
+        # get species names only once
+        spec_names = set(spec['name'] for spec in self.species.values())
         
-        for reac in self.reactions.values():
-            # split expression by math characters, giving a list of parameters and species
-            vals = re.split(math_chars, reac['expression'])
-            # adding set here allows using the same parameter multiple times in the reaction
-            for val in set(vals):
-                if val == '':
-                    # sometimes gets empty values if two math operations following or first/last are parenthesis
-                    pass
-                elif val in [spec['name'] for spec in self.species.values()]:
+        for reac_id in self.reactions.keys():
+            # names in the expression, parameters and species
+            _, vals = self.get_expr_tokens(reac_id)
+            # using a set allows using the same parameter multiple times in the reaction
+            for val in vals:
+                if val in spec_names:
                     # value is actually a specie, not a parameter
                     pass
                 elif self.is_float(val):
@@ -783,20 +1308,26 @@ class MolybdenumModel(object):
         model_param = [param['name'] for param in self.params.values()]
         
         # list of parameters in reactions not yet in model
-        new_param = [param for param in reac_param if param not in model_param]
+        model_param_set = set(model_param)
+        new_param = [param for param in reac_param if param not in model_param_set]
         # list of parameters in model not used in reactions
-        del_param = [param for param in model_param if param not in reac_param]
-        
+        reac_param_set = set(reac_param)
+        del_param = [param for param in model_param if param not in reac_param_set]
+        if new_param or del_param:
+            self.unshare('params')
+
         # add new parameters
         for param_name in new_param:
             new_id = self.get_new_id('params')
             self.params[new_id] = self.init_param(param_name)
+            self._param_name_to_id[param_name] = new_id
 
-        # get relation of param name and its id
-        param_name_to_id = {par_info['name']: par_id for par_id, par_info in self.params.items()}
         # delete unused parameters
         for param in del_param:
-            self.params.pop(param_name_to_id[param])
+            del_id = self.get_param_id(param)
+            self.params.pop(del_id)
+            self._param_name_to_id.pop(param)
+            self.release_id('params', del_id)
 
         return None
     
@@ -851,67 +1382,266 @@ class MolybdenumModel(object):
 
         Returns:
             updates internal model representation
+            updated: bool, False if the graph was the same as the one
+                applied last time and the model was not touched
+
+        Notes:
+            the model is assumed unchanged since the last graph if it was
+            only edited through the methods of this class, direct edits of
+            node_to_id, species or reactions names or connections must call
+            loadm() again
         """
-        graph_rep = copy.deepcopy(graph_rep_init)
-        
         ## TODO: write functions to check that graph_rep format is okay (unique ids, etc..)
-        
+
+        # nothing to do if the graph is the one applied last time, Ex. when
+        # only positions of nodes changed
+        graph_hash = self.get_graph_hash(graph_rep_init)
+        if graph_hash == self._graph_hash:
+            return False
+
+        # only apply what changed since the model was last updated
+        graph_ops = self.diff_graph(graph_rep_init)
+        self.apply_graph_ops(graph_ops)
+        self._graph_hash = graph_hash
+
+        return True
+
+    def graph_changed(self, graph_rep):
+        """Checks if a graph would change the model
+
+        Args:
+            graph_rep: graphical representation of the model, see
+                update_from_graph()
+
+        Returns:
+            changed: bool, False if graph_rep is the graph applied last time
+                by update_from_graph() and the model was not touched since
+                then, so update_from_graph() would not change anything
+        """
+        changed = self.get_graph_hash(graph_rep) != self._graph_hash
+        return changed
+
+    def get_graph_hash(self, graph_rep):
+        """Gets a fingerprint of the parts of a graph that define the model
+
+        Args:
+            graph_rep: graphical representation of the model, see
+                update_from_graph()
+
+        Returns:
+            graph_hash: string with a hash of node ids, titles and classes
+                and of edges. It does not depend on the position of nodes
+                or on the order of nodes and edges
+        """
+        nodes = sorted(json.dumps([node['id'], node['title'], node['nodeClass']]) for node in graph_rep['nodes'])
+        edges = sorted(json.dumps([edge['source'], edge['target']]) for edge in graph_rep['edges'])
+        graph_hash = hashlib.sha1(json.dumps([nodes, edges]).encode('utf-8')).hexdigest()
+        return graph_hash
+
+    def diff_graph(self, graph_rep):
+        """Gets the operations that update the model to a graphical representation
+
+        Args:
+            graph_rep: graphical representation of the model, as described in
+                update_from_graph()
+
+        Returns:
+            graph_ops: list of operations as defined in apply_graph_ops(), in
+                the order they have to be applied. Ex.
+                [
+                    {"op": "add_node", "id": 7, "title": "I", "nodeClass": "species"},
+                    {"op": "rename_node", "id": 4, "title": "Prod"},
+                    {"op": "remove_edge", "source": 2, "target": 5},
+                    {"op": "remove_node", "id": 2},
+                    {"op": "add_edge", "source": 7, "target": 5}
+                ]
+        """
         # get new/deleted node ids and its type (species or reactions)
         new_nodes, del_nodes = self.check_nodes(graph_rep)
-        # for each new species
-        for new_node_id in new_nodes['species']:
+        # relate each node id in the graph to its information
+        graph_nodes = {node['id']: node for node in graph_rep['nodes']}
+
+        graph_ops = []
+        # new species first and then new reactions
+        for node_class in ['species', 'reactions']:
+            for node_id in new_nodes[node_class]:
+                graph_ops.append({'op': 'add_node',
+                                  'id': node_id,
+                                  'title': graph_nodes[node_id]['title'],
+                                  'nodeClass': node_class})
+
+        # nodes that are still there but have a different name
+        for node_id, mb_id in self.node_to_id.items():
+            if node_id not in graph_nodes:
+                continue
+            if mb_id in self.species.keys():
+                prev_name = self.species[mb_id]['name']
+            elif mb_id in self.reactions.keys():
+                prev_name = self.reactions[mb_id]['name']
+            else:
+                raise ValueError(f'Could not find molybdenum id {mb_id} from node_to_id in species or reactions')
+            if graph_nodes[node_id]['title'] != prev_name:
+                graph_ops.append({'op': 'rename_node',
+                                  'id': node_id,
+                                  'title': graph_nodes[node_id]['title']})
+
+        # edges are compared as (source, target) counts, the same connection
+        # can be there more than once
+        prev_edges = Counter((edge['source'], edge['target']) for edge in self.get_edges())
+        graph_edges = Counter((edge['source'], edge['target']) for edge in graph_rep['edges'])
+        # edges from deleted nodes are also removed here, before the nodes
+        for (source, target), ct in (prev_edges - graph_edges).items():
+            graph_ops.extend([{'op': 'remove_edge', 'source': source, 'target': target}] * ct)
+
+        for node_class in ['species', 'reactions']:
+            for node_id in del_nodes[node_class]:
+                graph_ops.append({'op': 'remove_node', 'id': node_id})
+
+        # keep the order of new edges in the graph
+        added_edges = graph_edges - prev_edges
+        for edge in graph_rep['edges']:
+            edge_key = (edge['source'], edge['target'])
+            if added_edges[edge_key] > 0:
+                added_edges[edge_key] -= 1
+                graph_ops.append({'op': 'add_edge', 'source': edge['source'], 'target': edge['target']})
+
+        return graph_ops
+
+    def apply_graph_ops(self, graph_ops):
+        """Updates the model with a list of graph operations
+
+        Args:
+            graph_ops: list of dictionaries, each with an "op" key and:
+                "add_node": "id", "title" and "nodeClass" ('species' or
+                    'reactions') of the new node
+                "remove_node": "id" of the node to delete
+                "rename_node": "id" of the node and its new "title"
+                "add_edge": "source" and "target" node ids
+                "remove_edge": "source" and "target" node ids
+
+        Returns:
+            updates internal model representation. Only reactions and
+            parameters affected by the operations are modified
+
+        Raises:
+            ValueError if an operation is not recognized
+        """
+        # parameters only change if species or expressions change
+        params_affected = False
+        # consecutive species renames are applied together
+        spec_renames = dict()
+        for graph_op in graph_ops:
+            op = graph_op.get('op')
+            mb_id = self.node_to_id.get(graph_op.get('id'))
+            if (op == 'rename_node') and (mb_id in self.species):
+                spec_renames[mb_id] = graph_op['title']
+                params_affected = True
+                continue
+            elif len(spec_renames) > 0:
+                self.rename_species_byid(spec_renames)
+                spec_renames = dict()
+
+            if op == 'add_node':
+                self.add_node(graph_op['id'], graph_op['title'], graph_op['nodeClass'])
+                params_affected = True
+            elif op == 'remove_node':
+                self.remove_node(graph_op['id'])
+                params_affected = True
+            elif op == 'rename_node':
+                self.update_name_byid(graph_op['id'], graph_op['title'])
+            elif op == 'add_edge':
+                self.add_connection(graph_op['source'], graph_op['target'])
+            elif op == 'remove_edge':
+                self.remove_connection(graph_op['source'], graph_op['target'])
+            else:
+                raise ValueError(f'Unrecognized graph operation {graph_op}')
+        if len(spec_renames) > 0:
+            self.rename_species_byid(spec_renames)
+
+        if params_affected:
+            self.update_parameters()
+
+        return None
+
+    def add_node(self, node_id, title, node_class):
+        """Adds a new species or reaction with its node id
+
+        Args:
+            node_id: integer node id of the new node
+            title: name of the new species or reaction
+            node_class: either 'species' or 'reactions'
+
+        Returns:
+            updates the model directly, the new component gets default values
+
+        Raises:
+            ValueError if node_id is already used or node_class is not valid
+        """
+        self._graph_hash = None
+        if node_id in self.node_to_id.keys():
+            raise ValueError(f'Node id {node_id} is already in the model')
+        self.unshare('species', 'reactions', 'node_to_id')
+        if node_class == 'species':
             # create an id for it in the format 'spec{int}'
             new_id = self.get_new_id('species')
-            # get name defined in graph, this is always one element as ids are unique
-            name = [node['title'] for node in graph_rep['nodes'] if node['id'] == new_node_id][0]
             # add the new species
-            self.species[new_id] = self.init_spec(name)
-            # add relation between new node and new id
-            self.node_to_id[new_node_id] = new_id
-            
-        # for each new reaction
-        for new_node_id in new_nodes['reactions']:
+            self.species[new_id] = self.init_spec(title)
+            self._spec_name_to_id[self.species[new_id]['name']] = new_id
+        elif node_class == 'reactions':
             # create a name for it in the format 'reac{int}'
             new_id = self.get_new_id('reactions')
-            # get name defined in graph, this is always one element as ids are unique
-            name = [node['title'] for node in graph_rep['nodes'] if node['id'] == new_node_id][0]
             # add the new reaction
-            self.reactions[new_id] = self.init_reac(name)
-            # add relation between new node and new id
-            self.node_to_id[new_node_id] = new_id
-            
-        # for each deleted species
-        for del_node_id in del_nodes['species']:
+            self.reactions[new_id] = self.init_reac(title)
+        else:
+            raise ValueError(f'Node class must be "species" or "reactions", but got {node_class}')
+        # add relation between new node and new id
+        self.node_to_id[node_id] = new_id
+        self._id_to_node[new_id] = node_id
+        return None
+
+    def remove_node(self, node_id):
+        """Deletes a species or reaction by its node id
+
+        Args:
+            node_id: integer node id of the species or reaction to delete
+
+        Returns:
+            updates the model directly. Deleted species are also removed from
+            the reagents and products of reactions, but not from expressions
+
+        Raises:
+            ValueError if node_id is not in node_to_id
+        """
+        self._graph_hash = None
+        try:
+            mb_id = self.node_to_id[node_id]
+        except:
+            raise ValueError(f'Could not find {node_id} in node_to_id relations')
+
+        self.unshare('species', 'reactions', 'node_to_id')
+        if mb_id in self.species.keys():
             # delete this specie
-            self.species.pop(self.node_to_id[del_node_id])
-            # delete its relation in node_to_id
-            self.node_to_id.pop(del_node_id)
-            
-        # for each deleted reaction
-        for del_node_id in del_nodes['reactions']:
-            # delete this reaction
-            self.reactions.pop(self.node_to_id[del_node_id])
-            # delete its relation in node_to_id
-            self.node_to_id.pop(del_node_id)
-            
-        # update all names of species and reagents
-        for node_info in graph_rep['nodes']:
-            node_id = node_info['id']
-            node_name = node_info['title']
-            # this also updates the species name in reaction expressions
-            self.update_name_byid(node_id, node_name)
-        
-        # update all connectivity in reactions based on edges and nodes
-        # first delete all reagents and products information
-        for reac in self.reactions.values():
-            reac['reagents'] = []
-            reac['products'] = []
-        # then refill it
-        for edge_info in graph_rep['edges']:
-            self.add_connection(edge_info['source'], edge_info['target'])
-        # update parameters
-        self.update_parameters()
+            del_spec = self.species.pop(mb_id)
+            if self._spec_name_to_id.get(del_spec['name']) == mb_id:
+                self._spec_name_to_id.pop(del_spec['name'])
+            # and any connection left to it
+            for reac in self.reactions.values():
+                if del_spec['name'] in reac['reagents']:
+                    reac['reagents'] = [name for name in reac['reagents'] if name != del_spec['name']]
+                if del_spec['name'] in reac['products']:
+                    reac['products'] = [name for name in reac['products'] if name != del_spec['name']]
+            self.release_id('species', mb_id)
+        elif mb_id in self.reactions.keys():
+            # delete this reaction and its split expression
+            self.reactions.pop(mb_id)
+            self._expr_tokens.pop(mb_id, None)
+            self.release_id('reactions', mb_id)
+        else:
+            raise ValueError(f'Did not find id {node_id} in model')
 
+        # delete its relation in node_to_id
+        self.node_to_id.pop(node_id)
+        self._id_to_node.pop(mb_id, None)
         return None
 
 
@@ -946,6 +1676,7 @@ class MolybdenumModel(object):
             value = value[0]
             # find component_id in species, reactions or params, find attribute and assign or raise error
             if comp_id in self.species.keys():
+                self.unshare('species')
                 try:
                     if att == 'amt':
                         self.species[comp_id][att] = float(value)
@@ -956,6 +1687,7 @@ class MolybdenumModel(object):
                 except:
                     raise TypeError(f'Attribute {att} in {form_input} does not match with expected type')
             elif comp_id in self.reactions.keys():
+                self.unshare('reactions')
                 try:
                     if att == 'expression':
                         self.reactions[comp_id][att] = str(value)
@@ -966,9 +1698,13 @@ class MolybdenumModel(object):
                 except:
                     raise TypeError(f'Attribute {att} in {form_input} does not match with expected type')
             elif comp_id in self.params.keys():
+                self.unshare('params')
                 try:
                     if att == 'name':
+                        if self._param_name_to_id.get(self.params[comp_id][att]) == comp_id:
+                            self._param_name_to_id.pop(self.params[comp_id][att])
                         self.params[comp_id][att] = str(value)
+                        self._param_name_to_id[str(value)] = comp_id
                     elif att == 'val':
                         self.params[comp_id][att] = float(value)
                     else:
@@ -986,7 +1722,9 @@ class MolybdenumModel(object):
 
         Args:
             sim_param: data passed in the format of an html form having the 
-                attributes "sim_start", "sim_end", and/or "sim_points"
+                attributes "sim_start", "sim_end", and/or "sim_points", and
+                optionally "variable_step", "thin_tol" and "selections" as a
+                comma separated string, see simulate_sim_params()
                 example:
                     [
                         ('sim_start',['12.']),
@@ -1004,7 +1742,8 @@ class MolybdenumModel(object):
             ValueError if form input value is a list with more than one element
             ValueError if sim_start and sim_points are not integers or floats
             ValueError if sim_points is not an integer
-            ValueError if attribute is not "sim_start", "sim_end" or "sim_points"
+            ValueError if thin_tol is not a float
+            ValueError if attribute is not one of the ones above
         """
         # get dictionary from form
         form_dict = {}
@@ -1026,33 +1765,946 @@ class MolybdenumModel(object):
                     form_dict[param] = int(value)
                 except:
                     raise ValueError(f'Value for "sim_points" must be integer, but got {type(value)}')
+            elif (param == 'variable_step'):
+                # checkboxes are only sent when checked
+                form_dict[param] = value in ('True', 'true', 'on', '1')
+            elif (param == 'thin_tol'):
+                # empty input means no thinning
+                if value == '':
+                    continue
+                try:
+                    form_dict[param] = float(value)
+                except:
+                    raise ValueError(f'Value for "thin_tol" must be a float, but got {type(value)}')
+            elif (param == 'selections'):
+                # comma separated names, empty means all species
+                selections = [name.strip() for name in value.split(',') if name.strip() != '']
+                if len(selections) > 0:
+                    form_dict[param] = selections
             else:
-                raise ValueError(f'Unrecognized simulation parameter {param}, must be one of "sim_start", "sim_end" or "sim_points"')
+                raise ValueError(f'Unrecognized simulation parameter {param}, must be one of "sim_start", "sim_end", '
+                                 '"sim_points", "variable_step", "thin_tol" or "selections"')
 
         # then set sim_param to that dictionary
         self.sim_params = form_dict.copy()
 
         return None
 
-    def run(self):
+    def diff_model(self, prev_model):
+        """Gets the species, reactions and parameters that changed
+
+        Args:
+            prev_model: ModelSnapshot or dictionary exported with todict()
+                before the changes
+
+        Returns:
+            model_patch: dictionary with keys "species", "reactions" and
+                "params", each with
+                "changed": list of (component id, component) of the
+                    components that are new or have any attribute changed,
+                    in the order of the model
+                "removed": list of ids of the components no longer there
+                Ex. {'species': {'changed': [('spec2', {'name': 'S', 'amt': 1.0, 'fixed': False})],
+                                 'removed': ['spec4']},
+                     'reactions': {'changed': [], 'removed': []},
+                     'params': {'changed': [], 'removed': []}}
+        """
+        model_patch = dict()
+        for comp_class in ['species', 'reactions', 'params']:
+            # compare the stored dictionaries directly, without copying them
+            if isinstance(prev_model, ModelSnapshot):
+                prev_components = prev_model._data[comp_class]
+            else:
+                prev_components = prev_model[comp_class]
+            components = self._model_data[comp_class]
+            if components is prev_components:
+                # still shared with the snapshot, nothing changed
+                model_patch[comp_class] = {'changed': [], 'removed': []}
+                continue
+            changed = copy_component({comp_id: comp for comp_id, comp in components.items()
+                                      if prev_components.get(comp_id) != comp})
+            removed = [comp_id for comp_id in prev_components.keys() if comp_id not in components]
+            model_patch[comp_class] = {'changed': list(changed.items()), 'removed': removed}
+        return model_patch
+
+    def get_revision(self):
+        """Gets the number of edits of the model
+
+        Args:
+            internal model representation
+
+        Returns:
+            revision: int that increases every time the model is edited
+                through its methods, or a component is replaced. Direct edits
+                of the dictionaries of the model must call unshare() first
+                to be counted
+        """
+        return self._revision
+
+    def get_model_hash(self):
+        """Gets a fingerprint of the whole model
+
+        Args:
+            internal model representation, all components exported by todict()
+
+        Returns:
+            model_hash: string with a hash that changes when any component
+                of the model changes, including values and node ids
+
+        Notes:
+            the hash is kept until the revision of the model changes (see
+            get_revision()), so asking again for an unchanged model does
+            not serialize it
+        """
+        if (self._model_hash is not None) and (self._model_hash[0] == self._revision):
+            return self._model_hash[1]
+        # read the stored dictionaries directly, they are not modified
+        model_data = {key: self._model_data[key] for key in MODEL_KEYS}
+        model_hash = hashlib.sha1(json.dumps(model_data).encode('utf-8')).hexdigest()
+        self._model_hash = (self._revision, model_hash)
+        return model_hash
+
+    def get_model_info(self):
+        """Gets what worker processes need to simulate the model
+
+        Args:
+            internal model representation
+
+        Returns:
+            model_info: tuple with the structure key (see get_structure_key()),
+                SBML string and initial values (see get_init_values()) of the
+                model, see simulate_assignments_worker() and run_worker()
+
+        Notes:
+            the SBML string is only built again when the structure key
+            changes. Workers set the initial values themselves, so the
+            amounts and values written in a previous SBML string do not matter
+        """
+        structure_key = self.get_structure_key()
+        if (self._model_info_sbml is None) or (self._model_info_sbml[0] != structure_key):
+            self._model_info_sbml = (structure_key, self.toSBMLstr())
+        model_info = (structure_key, self._model_info_sbml[1], self.get_init_values())
+        return model_info
+
+    def get_structure_key(self):
+        """Gets a fingerprint of the model structure
+
+        Args:
+            internal model representation, specifically species names and
+            fixed attributes, reactions and parameter names
+
+        Returns:
+            structure_key: string with a hash that only changes when the
+                compiled model would change. Species amounts, parameter values
+                and simulation parameters are not part of it.
+        """
+        structure = {
+            'species': [(spec['name'], spec['fixed']) for spec in self.species.values()],
+            'reactions': [(reac['name'], list(reac['reagents']), list(reac['products']), reac['expression'])
+                          for reac in self.reactions.values()],
+            'params': [param['name'] for param in self.params.values()],
+        }
+        structure_key = hashlib.sha1(json.dumps(structure).encode('utf-8')).hexdigest()
+        return structure_key
+
+    def compile_model(self, from_antimony=False):
+        """Compiles the model into a tellurium model
+
+        Args:
+            from_antimony: if False (default), the SBML string of the model is
+                loaded directly in tellurium. If True, the model is converted
+                to antimony first, which tellurium converts back to SBML, so
+                it is slower but follows the same path as te.loada()
+
+        Returns:
+            temodel: tellurium model object, compiled from scratch
+        """
+        if from_antimony:
+            temodel = te.loada(self.toAntimony())
+        else:
+            temodel = te.loadSBMLModel(self.toSBMLstr())
+        return temodel
+
+    def set_temodel_values(self, temodel):
+        """Pushes species amounts and parameter values into a tellurium model
+
+        Args:
+            temodel: tellurium model compiled from a model with the same
+                structure as the one defined in self
+
+        Returns:
+            updates initial values in temodel and resets it so that the next
+            simulation starts from them
+        """
+        # setting init values through temodel.model is much faster than
+        # temodel.setValue(), which rebuilds the model for init values
+        for name, value in self.get_init_values().items():
+            temodel.model[f'init({name})'] = value
+        # resetAll also brings parameters back to the initial values set above
+        temodel.resetAll()
+        return None
+
+    def get_init_values(self):
+        """Gets the initial values of species and parameters of the model
+
+        Args:
+            internal model representation
+
+        Returns:
+            init_values: dictionary with species and parameter names, as used
+                in the compiled model, as keys and their amounts or values as
+                values. Ex. {'E': 5e-21, 'S': 1e-20, 'kon': 10000000.0}
+        """
+        init_values = dict()
+        for spec in self.species.values():
+            # $ only marks boundary species, it is not part of the sbml id
+            init_values[spec['name'].lstrip('$')] = spec['amt']
+        for param in self.params.values():
+            init_values[param['name']] = param['val']
+        return init_values
+
+    def get_temodel(self, from_antimony=False, conserved_moieties=False):
+        """Gets a tellurium model ready to simulate, compiling it only if needed
+
+        Args:
+            from_antimony: passed to compile_model() if the model has to be
+                compiled
+            conserved_moieties: if True, gets a model with conserved moiety
+                analysis enabled, as needed by the steady state solver. Its
+                floating species are reordered, so it is kept apart from the
+                model used for simulations
+
+        Returns:
+            temodel: tellurium model object with the current species amounts
+                and parameter values.
+
+        Notes:
+            compiled models are cached by get_structure_key(), so changing only
+            species amounts or parameter values reuses the compiled model.
+            The least recently used compiled model is dropped when there are
+            more than self._temodels_maxsize of them.
+        """
+        structure_key = self.get_structure_key()
+        if conserved_moieties:
+            structure_key += '-cma'
+        if structure_key in self._temodels:
+            temodel = self._temodels[structure_key]
+            self._temodels.move_to_end(structure_key)
+        else:
+            temodel = self.compile_model(from_antimony=from_antimony)
+            if conserved_moieties:
+                temodel.conservedMoietyAnalysis = True
+            self._temodels[structure_key] = temodel
+            if len(self._temodels) > self._temodels_maxsize:
+                self._temodels.popitem(last=False)
+        self.set_temodel_values(temodel)
+        return temodel
+
+    def run(self, from_antimony=False):
         """Simulates model and get results
-        
+
         Args:
-            uses the model representation converted to antimony to simulate it
-            with tellurium
+            uses the model representation, compiled with tellurium or taken
+            from the compiled models cache, see get_temodel()
+            from_antimony: compile the model through its antimony
+                representation instead of loading SBML directly
 
         Returns:
             temodel: tellurium model object
-            results: NamedArray from tellurium simulation
-        """
-        temodel = te.loada(self.toAntimony())
-        results = temodel.simulate(
-            start=self.sim_params['sim_start'],
-            end=self.sim_params['sim_end'],
-            points=self.sim_params['sim_points']
-        )
+            results: NamedArray from tellurium simulation, with the output
+                options of sim_params, see simulate_sim_params()
+        """
+        temodel = self.get_temodel(from_antimony=from_antimony)
+        results = simulate_sim_params(temodel, self.sim_params)
         return temodel, results
 
+    def iter_run(self, chunk_points=100, cancel_event=None):
+        """Simulates the model in chunks of time, yielding each one when done
+
+        Args:
+            chunk_points: number of points of the time grid of sim_params
+                simulated in each chunk
+            cancel_event: (optional) threading.Event, the simulation stops
+                before the next chunk once it is set
+
+        Returns:
+            generator of NamedArrays with consecutive rows of the results of
+            run(), the time of the last row of a chunk is not repeated in the
+            next one, see join_results(). The integrator only advances when
+            the next chunk is requested, so closing the generator or setting
+            cancel_event stops the simulation
+
+        Raises:
+            ValueError if chunk_points is smaller than 1
+
+        Notes:
+            each chunk continues from the state where the previous one
+            ended, results match the ones of run() up to the tolerances of
+            the integrator, which restarts at the beginning of each chunk.
+            "selections" of sim_params are recorded, but chunks always use
+            the evenly spaced time points, see simulate_sim_params()
+        """
+        if chunk_points < 1:
+            raise ValueError(f'Chunks must have at least 1 point, but got {chunk_points}')
+        temodel = self.get_temodel()
+        time = np.linspace(self.sim_params['sim_start'], self.sim_params['sim_end'], self.sim_params['sim_points'])
+        prev_selections = list(temodel.timeCourseSelections)
+        if 'selections' in self.sim_params:
+            temodel.timeCourseSelections = get_selection_ids(temodel, self.sim_params['selections'])
+        try:
+            # first chunk includes the start time, next ones start after the end of the previous
+            row_start = 0
+            while row_start < len(time):
+                if (cancel_event is not None) and cancel_event.is_set():
+                    return
+                row_end = min(row_start + chunk_points, len(time))
+                if row_start == 0:
+                    chunk = temodel.simulate(start=time[0], end=time[row_end-1], points=row_end)
+                else:
+                    chunk = temodel.simulate(start=time[row_start-1], end=time[row_end-1], points=row_end-row_start+1)[1:]
+                yield chunk
+                row_start = row_end
+        finally:
+            # also when the generator is closed before the end
+            temodel.timeCourseSelections = prev_selections
+
+    def join_results(self, chunks):
+        """Joins chunks of results of iter_run() into one NamedArray
+
+        Args:
+            chunks: list of NamedArrays with the same columns
+
+        Returns:
+            results: NamedArray with the rows of all chunks, as returned by
+                run(), None if there are no chunks
+        """
+        if len(chunks) == 0:
+            return None
+        n_rows = sum(chunk.shape[0] for chunk in chunks)
+        # NamedArray is not exported by roadrunner, create it from the type of the chunks
+        results = type(chunks[0])((n_rows, chunks[0].shape[1]))
+        results[:] = np.concatenate(chunks)
+        results.colnames = chunks[0].colnames
+        return results
+
+    def get_steady_state_key(self, assignment=None):
+        """Gets the key of the steady state of the model in the cache
+
+        Args:
+            assignment: (optional) dictionary with species or parameter
+                names and values that replace the ones of the model
+
+        Returns:
+            key: tuple with the structure key of the model, see
+                get_structure_key(), and the initial values of species and
+                parameters, see get_init_values()
+        """
+        init_values = self.get_init_values()
+        if assignment is not None:
+            init_values.update(assignment)
+        return (self.get_structure_key(), tuple(sorted(init_values.items())))
+
+    def cache_steady_state(self, key, values):
+        """Keeps a steady state in the cache, removing the oldest one if full
+
+        Args:
+            key: tuple from get_steady_state_key()
+            values: np.array with the concentrations of floating species
+        """
+        self._steady_states[key] = values
+        self._steady_states.move_to_end(key)
+        if len(self._steady_states) > self._steady_states_maxsize:
+            self._steady_states.popitem(last=False)
+        return None
+
+    def get_floating_species(self):
+        """Gets the names of the species that are not fixed
+
+        Args:
+            internal model representation
+
+        Returns:
+            spec_ids: list of names of floating species, in the order of the
+                model, which is the one of the columns of run()
+        """
+        spec_ids = [spec['name'] for spec in self.species.values()
+                    if (not spec['fixed']) and (not spec['name'].startswith('$'))]
+        return spec_ids
+
+    def steady_state(self):
+        """Finds the steady state of the model with its current values
+
+        Args:
+            uses the compiled model with conserved moiety analysis, see
+            get_temodel()
+
+        Returns:
+            steady_state: dictionary with floating species names as keys and
+                their concentration at steady state as values. Ex.
+                {'S1': 2.0, 'S2': 5.0}
+
+        Raises:
+            ValueError if the solver does not find a steady state
+
+        Notes:
+            results are cached by get_steady_state_key(), so asking again
+            for the same species amounts and parameter values does not
+            solve the model again. Fixed species keep their amounts
+        """
+        key = self.get_steady_state_key()
+        spec_ids = self.get_floating_species()
+        if key in self._steady_states:
+            values = self._steady_states[key]
+            self._steady_states.move_to_end(key)
+        else:
+            temodel = self.get_temodel(conserved_moieties=True)
+            values = solve_steady_state(temodel, spec_ids=spec_ids)
+            self.cache_steady_state(key, values)
+        return dict(zip(spec_ids, values.tolist()))
+
+    def steady_state_scan(self, name, values):
+        """Finds the steady states of the model along a range of values of one parameter
+
+        Args:
+            name: name of a parameter or fixed species of the model
+            values: list of values of the parameter, solved in order
+
+        Returns:
+            scan_results: dictionary with keys:
+                "results": np.array with dimensions (values, species) with
+                    the steady state concentrations, NaN where the solver
+                    did not find a steady state
+                "values": np.array with the values of the parameter
+                "columns": floating species names for the last dimension
+                    of "results"
+
+        Raises:
+            ValueError if name is not a parameter or fixed species
+
+        Notes:
+            uses continuation: each value starts solving from the steady
+            state of the previous one, which is already close to the solution
+            for small changes, so values should be sorted. Points are also
+            kept in the cache of steady_state()
+        """
+        fixed_names = [spec['name'].lstrip('$') for spec in self.species.values() if spec['fixed']]
+        param_names = [param['name'] for param in self.params.values()]
+        if name not in (param_names + fixed_names):
+            raise ValueError(f'Could not find {name} in parameters or fixed species of the model')
+        values = np.array(values, dtype=float)
+        temodel = self.get_temodel(conserved_moieties=True)
+        spec_ids = self.get_floating_species()
+        spec_indices = get_species_indices(temodel, spec_ids)
+        results = np.full((len(values), len(spec_ids)), np.nan)
+        # amounts of the last steady state found, to start from them, in the
+        # order of spec_ids
+        start_amounts = temodel.model.getFloatingSpeciesAmounts(spec_indices)
+        for value_ct, value in enumerate(values):
+            key = self.get_steady_state_key({name: value})
+            temodel.model[f'init({name})'] = value
+            temodel.model[name] = value
+            temodel.model.setFloatingSpeciesAmounts(spec_indices, start_amounts)
+            if key in self._steady_states:
+                results[value_ct] = self._steady_states[key]
+                self._steady_states.move_to_end(key)
+                # compartments of molybdenum models have volume 1
+                start_amounts = results[value_ct].copy()
+                continue
+            try:
+                results[value_ct] = solve_steady_state(temodel, spec_ids=spec_ids)
+            except ValueError:
+                # continue from the last steady state found
+                continue
+            self.cache_steady_state(key, results[value_ct].copy())
+            start_amounts = temodel.model.getFloatingSpeciesAmounts(spec_indices)
+        # go back to the values of the model
+        self.set_temodel_values(temodel)
+
+        scan_results = {
+            'results': results,
+            'values': values,
+            'columns': spec_ids,
+        }
+        return scan_results
+
+    def get_assignment_list(self, assignments):
+        """Gets the list of value assignments of each run of a sweep
+
+        Args:
+            assignments: either a list of dictionaries, one for each run, with
+                parameter or species names as keys and the value to use as values
+                Ex. [{'kon': 1.0, 'E': 5.0}, {'kon': 2.0, 'E': 5.0}]
+                or a dictionary with names as keys and a list of values, where
+                every combination of values is a run
+                Ex. {'kon': [1.0, 2.0], 'E': [5.0, 10.0]} gives four runs
+
+        Returns:
+            assignment_list: list of dictionaries, one for each run, with
+                names as keys and float values
+
+        Raises:
+            ValueError if a name is not a species or parameter in the model
+        """
+        if type(assignments) == dict:
+            names = list(assignments.keys())
+            assignment_list = [dict(zip(names, values))
+                               for values in itertools.product(*assignments.values())]
+        else:
+            assignment_list = [dict(assignment) for assignment in assignments]
+
+        init_values = self.get_init_values()
+        for assignment in assignment_list:
+            for name, value in assignment.items():
+                if name not in init_values:
+                    raise ValueError(f'Could not find {name} in species or parameters of the model')
+                assignment[name] = float(value)
+        return assignment_list
+
+    def sweep(self, assignments, sim_params=None, processes=None):
+        """Simulates the model for many parameter values or initial amounts
+
+        Args:
+            assignments: values to use in each run, see get_assignment_list()
+            sim_params: (optional) dictionary with "sim_start", "sim_end" and
+                "sim_points", by default uses the ones of the model
+            processes: (optional) number of worker processes, by default the
+                number of cpus. With 1, runs are simulated in this process
+
+        Returns:
+            sweep_results: dictionary with keys:
+                "results": np.array with dimensions (runs, time, species)
+                "runs": list of dictionaries with the values assigned in each run
+                "time": np.array with the time points
+                "columns": species names for the last dimension of "results",
+                    as named in te_result_to_df()
+
+        Notes:
+            runs are divided in one chunk per process. Each process compiles
+            the model once and only changes values between the runs of its chunk
+        """
+        assignment_list = self.get_assignment_list(assignments)
+        if sim_params is None:
+            sim_params = self.sim_params
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = max(1, min(processes, len(assignment_list)))
+
+        if processes == 1:
+            temodel = self.get_temodel()
+            time, colnames, results = simulate_assignments(temodel, self.get_init_values(),
+                                                           assignment_list, sim_params)
+        else:
+            # roadrunner models are compiled in each process from the sbml string
+            model_info = self.get_model_info()
+            chunks = [assignment_list[ct::processes] for ct in range(processes)]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                chunk_results = list(executor.map(simulate_assignments_worker,
+                                                  [model_info]*processes,
+                                                  chunks,
+                                                  [sim_params]*processes))
+            time, colnames, _ = chunk_results[0]
+            # runs were assigned to chunks in turns, put them back in order
+            results = np.empty((len(assignment_list),) + chunk_results[0][2].shape[1:])
+            for ct, (_, _, chunk_values) in enumerate(chunk_results):
+                results[ct::processes] = chunk_values
+
+        sweep_results = {
+            'results': results,
+            'runs': assignment_list,
+            'time': time,
+            'columns': self.get_result_columns(colnames)[1:],
+        }
+        return sweep_results
+
+    def sensitivities(self, rel_step=1e-3, steady_state=False, sim_params=None, processes=None):
+        """Computes scaled local sensitivities of species to every parameter
+
+        Args:
+            rel_step: relative change of each parameter, the derivatives
+                are central differences between the model simulated with
+                each parameter multiplied by (1+rel_step) and (1-rel_step)
+            steady_state: if True, sensitivities of the steady state of the
+                species instead of their trajectories
+            sim_params: (optional) dictionary with "sim_start", "sim_end" and
+                "sim_points", by default uses the ones of the model
+            processes: (optional) number of worker processes for the
+                trajectories, see sweep()
+
+        Returns:
+            sens_results: dictionary with keys:
+                "sensitivities": np.array with dimensions (params, time, species),
+                    or (params, species) for steady states, with the scaled
+                    sensitivities (p/y)*(dy/dp). NaN where the species is 0
+                "params": parameter names for the first dimension
+                "time": np.array with the time points, only for trajectories
+                "columns": species names for the last dimension
+
+        Raises:
+            ValueError if rel_step is not between 0 and 1, or if the steady
+                state is not found
+
+        Notes:
+            trajectories of all perturbed runs are simulated with sweep(),
+            so each worker process compiles the model once. Steady states are
+            solved in this process, each perturbation starting from the steady
+            state of the model, which takes microseconds, see solve_steady_state()
+        """
+        if not (0 < rel_step < 1):
+            raise ValueError(f'Relative step must be between 0 and 1, but got {rel_step}')
+        param_names = [param['name'] for param in self.params.values()]
+        param_values = np.array([param['val'] for param in self.params.values()], dtype=float)
+
+        if steady_state:
+            temodel = self.get_temodel(conserved_moieties=True)
+            columns = self.get_floating_species()
+            base = solve_steady_state(temodel, spec_ids=columns)
+            base_amounts = temodel.model.getFloatingSpeciesAmounts()
+            perturbed = np.empty((2, len(param_names), len(columns)))
+            for param_ct, (name, value) in enumerate(zip(param_names, param_values)):
+                for sign_ct, sign in enumerate((1, -1)):
+                    temodel.model[name] = value * (1 + sign*rel_step)
+                    temodel.model.setFloatingSpeciesAmounts(base_amounts)
+                    perturbed[sign_ct, param_ct] = solve_steady_state(temodel, spec_ids=columns)
+                temodel.model[name] = value
+            # go back to the values of the model
+            self.set_temodel_values(temodel)
+            time = None
+        else:
+            # first run is the model itself, then each parameter up and down
+            assignment_list = [dict()]
+            for name, value in zip(param_names, param_values):
+                assignment_list.append({name: value * (1 + rel_step)})
+                assignment_list.append({name: value * (1 - rel_step)})
+            sweep_results = self.sweep(assignment_list, sim_params=sim_params, processes=processes)
+            base = sweep_results['results'][0]
+            perturbed = np.stack([sweep_results['results'][1::2], sweep_results['results'][2::2]])
+            time = sweep_results['time']
+            columns = sweep_results['columns']
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sens = (perturbed[0] - perturbed[1]) / (2 * rel_step) / base
+        sens[~np.isfinite(sens)] = np.nan
+        # parameters that are 0 do not change when scaled
+        sens[param_values == 0] = 0.0
+
+        sens_results = {
+            'sensitivities': sens,
+            'params': param_names,
+            'columns': columns,
+        }
+        if time is not None:
+            sens_results['time'] = time
+        return sens_results
+
+    def ensemble(self, initial_amounts, sim_params=None, out=None):
+        """Simulates the model from many initial amounts of its species
+
+        Args:
+            initial_amounts: either a np.array with dimensions (members, species)
+                with species in the order of the columns of te_result_to_df(),
+                or a dictionary with species names as keys and a list of
+                amounts, one for each member, as values. Species not in the
+                dictionary keep the amount defined in the model
+                Ex. {'E': [1.0, 2.0, 5.0], 'S': [10.0, 10.0, 20.0]}
+            sim_params: (optional) dictionary with "sim_start", "sim_end" and
+                "sim_points", by default uses the ones of the model
+            out: (optional) np.array with dimensions (members, time, species)
+                where results are written
+
+        Returns:
+            ensemble_results: dictionary with keys:
+                "results": np.array with dimensions (members, time, species)
+                "initial_amounts": np.array with dimensions (members, species)
+                "time": np.array with the time points
+                "columns": species names for the last dimension of "results",
+                    as named in te_result_to_df()
+
+        Raises:
+            ValueError if a species is not a floating species of the model or
+                dimensions of initial_amounts or out do not match the model
+
+        Notes:
+            uses one compiled model, see get_temodel(), and writes each
+            trajectory directly into the results array
+        """
+        if sim_params is None:
+            sim_params = self.sim_params
+        temodel = self.get_temodel()
+        spec_ids = list(temodel.getFloatingSpeciesIds())
+
+        if type(initial_amounts) == dict:
+            n_members = len(next(iter(initial_amounts.values()), []))
+            amounts = np.tile(temodel.model.getFloatingSpeciesInitAmounts(), (n_members, 1))
+            for name, values in initial_amounts.items():
+                if name not in spec_ids:
+                    raise ValueError(f'Could not find {name} in floating species of the model')
+                amounts[:, spec_ids.index(name)] = values
+        else:
+            amounts = np.array(initial_amounts, dtype=float)
+        if (amounts.ndim != 2) or (amounts.shape[1] != len(spec_ids)):
+            raise ValueError(f'Initial amounts must have dimensions (members, {len(spec_ids)}), but got {amounts.shape}')
+
+        shape = (amounts.shape[0], sim_params['sim_points'], len(spec_ids))
+        if out is None:
+            out = np.empty(shape)
+        elif out.shape != shape:
+            raise ValueError(f'Output array must have dimensions {shape}, but got {out.shape}')
+
+        time = None
+        for member_ct, member_amounts in enumerate(amounts):
+            temodel.model.setFloatingSpeciesInitAmounts(member_amounts)
+            temodel.resetAll()
+            member_results = simulate_no_copy(temodel, sim_params)
+            out[member_ct] = member_results[:, 1:]
+            if time is None:
+                time = np.array(member_results[:, 0])
+        # go back to the values of the model
+        self.set_temodel_values(temodel)
+
+        ensemble_results = {
+            'results': out,
+            'initial_amounts': amounts,
+            'time': time,
+            'columns': spec_ids,
+        }
+        return ensemble_results
+
+    def stochastic_ensemble(self, n_runs, seed=0, quantiles=(0.05, 0.5, 0.95), sim_params=None,
+                            processes=None, n_bins=256):
+        """Simulates the model stochastically many times and summarizes the runs
+
+        Args:
+            n_runs: number of stochastic runs
+            seed: seed of the first run, run i uses seed + i, so results do
+                not depend on the number of processes
+            quantiles: quantile levels to estimate, between 0 and 1
+            sim_params: (optional) dictionary with "sim_start", "sim_end" and
+                "sim_points", by default uses the ones of the model
+            processes: (optional) number of worker processes, by default the
+                number of cpus. With 1, runs are simulated in this process
+            n_bins: number of bins used to estimate quantiles, see
+                EnsembleStats
+
+        Returns:
+            ensemble_stats: dictionary with keys:
+                "mean": np.array with dimensions (time, species)
+                "variance": np.array with dimensions (time, species), sample
+                    variance of the runs
+                "quantiles": np.array with dimensions (quantiles, time, species)
+                "quantile_levels": list of the quantile levels
+                "time": np.array with the time points
+                "columns": species names for the last dimension of the arrays,
+                    as named in te_result_to_df()
+                "n_runs": number of runs
+
+        Raises:
+            ValueError if n_runs is smaller than 1
+
+        Notes:
+            runs use the Gillespie direct method of roadrunner, species
+            amounts should be molecule counts. Trajectories are added to the
+            statistics in batches as they are simulated and then discarded,
+            so memory does not grow with n_runs. Each worker process compiles
+            the model once and returns its statistics, which are merged here
+            as workers finish
+        """
+        if n_runs < 1:
+            raise ValueError(f'Stochastic ensembles need at least 1 run, but got {n_runs}')
+        if sim_params is None:
+            sim_params = self.sim_params
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = max(1, min(processes, n_runs))
+        seeds = list(range(seed, seed + n_runs))
+
+        if processes == 1:
+            temodel = self.get_temodel()
+            time, colnames, stats = simulate_stochastic(temodel, seeds, sim_params, n_bins=n_bins)
+        else:
+            model_info = self.get_model_info()
+            # several chunks per process, so that faster processes take more
+            n_chunks = min(processes * 4, n_runs)
+            chunks = [seeds[ct::n_chunks] for ct in range(n_chunks)]
+            stats = None
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [executor.submit(simulate_stochastic_worker, model_info, chunk, sim_params, n_bins)
+                           for chunk in chunks]
+                for future in as_completed(futures):
+                    time, colnames, chunk_stats = future.result()
+                    if stats is None:
+                        stats = chunk_stats
+                    else:
+                        stats.merge(chunk_stats)
+
+        ensemble_stats = {
+            'mean': stats.mean,
+            'variance': stats.get_variance(),
+            'quantiles': stats.get_quantiles(quantiles),
+            'quantile_levels': list(quantiles),
+            'time': time,
+            'columns': self.get_result_columns(colnames)[1:],
+            'n_runs': stats.n,
+        }
+        return ensemble_stats
+
+    def get_fit_problem(self, data, free_params):
+        """Gets what is needed to compare the model with measured data
+
+        Args:
+            data: pd.DataFrame with a "time" column and one column for each
+                measured species, named as in te_result_to_df(). Missing
+                measurements can be NaN and times can be repeated
+            free_params: dictionary with names of parameters to fit as keys
+                and (lower, upper) bounds as values. Ex. {'kon': (1.0, 1e8)}
+
+        Returns:
+            fit_problem: dictionary with keys:
+                "param_names": list of the names of the free parameters
+                "lower", "upper": np.arrays with the bounds of each parameter
+                "columns": list of names of the measured species
+                "times": np.array with the sorted time points to simulate,
+                    starting at sim_start
+                "rows": np.array with the index in "times" of each row of data
+                "measured": np.array with dimensions (rows, columns)
+                "mask": np.array of booleans, False for missing measurements
+
+        Raises:
+            ValueError if a parameter is not in the model, its bounds are not
+                finite or lower is not smaller than upper, data has no "time"
+                column, no measurements or times before sim_start
+        """
+        param_names = list(free_params.keys())
+        model_params = [param['name'] for param in self.params.values()]
+        for name, (lower, upper) in free_params.items():
+            if name not in model_params:
+                raise ValueError(f'Could not find {name} in parameters of the model')
+            if not (np.isfinite(lower) and np.isfinite(upper) and (lower < upper)):
+                raise ValueError(f'Bounds of {name} must be finite with lower < upper, but got {(lower, upper)}')
+        if 'time' not in data.columns:
+            raise ValueError('Data must have a "time" column')
+        columns = [col_name for col_name in data.columns if col_name != 'time']
+        measured = data[columns].to_numpy(dtype=float)
+        mask = ~np.isnan(measured)
+        if (len(columns) == 0) or (not mask.any()):
+            raise ValueError('Data has no measurements to fit')
+        data_times = data['time'].to_numpy(dtype=float)
+        sim_start = self.sim_params['sim_start']
+        if data_times.min() < sim_start:
+            raise ValueError(f'Data has times before the start of the simulation {sim_start}')
+        times, rows = np.unique(np.concatenate([[sim_start], data_times]), return_inverse=True)
+
+        fit_problem = {
+            'param_names': param_names,
+            'lower': np.array([free_params[name][0] for name in param_names], dtype=float),
+            'upper': np.array([free_params[name][1] for name in param_names], dtype=float),
+            'columns': columns,
+            'times': times,
+            'rows': rows[1:],
+            'measured': measured,
+            'mask': mask,
+        }
+        return fit_problem
+
+    def get_fit_starts(self, fit_problem, n_starts, seed=0):
+        """Gets the starting values of the local optimizations of a fit
+
+        Args:
+            fit_problem: dictionary from get_fit_problem()
+            n_starts: number of starting points
+            seed: seed of the random starting values
+
+        Returns:
+            starts: list of n_starts np.arrays with a value for each parameter
+                of fit_problem["param_names"]. The first one has the current
+                values of the parameters clipped to the bounds. The others
+                are random, each parameter sampled log-uniform if its lower
+                bound is positive and its upper bound more than 100 times the
+                lower one, and uniform otherwise, Ex. bounds (1.0, 1e8) are
+                sampled log-uniform and (1.0, 2.0) or (0.0, 1e8) uniform
+        """
+        rng = np.random.default_rng(seed)
+        lower, upper = fit_problem['lower'], fit_problem['upper']
+        log_scale = (lower > 0) & (upper > 100 * lower)
+        # bounds of parameters sampled in log scale, 1 for the others to avoid logs of 0
+        log_lower = np.where(log_scale, lower, 1.0)
+        log_upper = np.where(log_scale, upper, 1.0)
+        init_values = self.get_init_values()
+        starts = [np.clip([init_values[name] for name in fit_problem['param_names']], lower, upper)]
+        for _ in range(n_starts - 1):
+            uniform = rng.uniform(size=len(lower))
+            log_start = log_lower * (log_upper / log_lower)**uniform
+            starts.append(np.where(log_scale, log_start, lower + uniform * (upper - lower)))
+        return starts
+
+    def fit(self, data, free_params, n_starts=8, seed=0, processes=None):
+        """Fits parameters of the model to measured data
+
+        Args:
+            data: pd.DataFrame with a "time" column and measured species,
+                see get_fit_problem()
+            free_params: dictionary with names of parameters to fit as keys
+                and (lower, upper) bounds as values. Ex. {'kon': (1.0, 1e8)}
+            n_starts: number of local optimizations. The first one starts
+                from the current values of the parameters, the others from
+                random values within the bounds, see get_fit_starts()
+            seed: seed of the random starting values
+            processes: (optional) number of worker processes, by default the
+                number of cpus. With 1, starts are optimized in this process
+
+        Returns:
+            fit_results: dictionary with keys:
+                "params": dictionary with the fitted value of each parameter
+                "ssr": sum of squared residuals of the fitted values
+                "starts": list with the "start" and fitted "params", "ssr" and
+                    "success" of each local optimization, best first
+            fitted values are written into the parameters of the model
+
+        Raises:
+            ValueError if data or free_params are not valid, see
+                get_fit_problem()
+
+        Notes:
+            each start is a bounded least squares optimization with
+            scipy.optimize.least_squares. Starts are divided in one chunk per
+            process, each process compiles the model once and only changes
+            parameter values between evaluations of the residuals
+        """
+        fit_problem = self.get_fit_problem(data, free_params)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = max(1, min(processes, n_starts))
+
+        starts = self.get_fit_starts(fit_problem, n_starts, seed=seed)
+
+        if processes == 1:
+            temodel = self.get_temodel()
+            start_results = fit_starts(temodel, fit_problem, starts)
+            # go back to the values of the model
+            self.set_temodel_values(temodel)
+        else:
+            model_info = self.get_model_info()
+            chunks = [starts[ct::processes] for ct in range(processes)]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                chunk_results = list(executor.map(fit_starts_worker,
+                                                  [model_info]*processes,
+                                                  [fit_problem]*processes,
+                                                  chunks))
+            start_results = [start_result for chunk in chunk_results for start_result in chunk]
+        start_results.sort(key=lambda start_result: start_result['ssr'])
+
+        # write the best values into the model
+        best = start_results[0]
+        self.unshare('params')
+        for name, value in best['params'].items():
+            self.params[self.get_param_id(name)]['val'] = value
+
+        fit_results = {
+            'params': dict(best['params']),
+            'ssr': best['ssr'],
+            'starts': start_results,
+        }
+        return fit_results
+
     def te_result_to_df(self, arr):
         """Converts namedarray results to a pandas dataframe
 
@@ -1062,16 +2714,124 @@ class MolybdenumModel(object):
         Returns:
             df: pd.DataFrame with names for each species
         """
-        columns = [c[1:-1] if c[0] == "[" else c for c in arr.colnames]
+        columns = self.get_result_columns(arr.colnames)
         df = pd.DataFrame(arr, columns=columns)
         return df
 
+    def select_results(self, results, columns=None, time_start=None, time_end=None):
+        """Selects columns and a time window of simulation results
+
+        Args:
+            results: NamedArray resulting from tellurium simulation
+            columns: list of species names to keep, None to keep all. Time
+                is always kept as first column
+            time_start: only keep rows with time >= time_start, None to keep
+                from the start
+            time_end: only keep rows with time <= time_end, None to keep
+                until the end
+
+        Returns:
+            col_names: list of names of the columns kept. Ex. ['time', 'S']
+            col_indices: list of indices of those columns in results
+            rows: slice of the rows kept, results[rows] is a view so that
+                nothing is copied until the selected rows are used
+
+        Raises:
+            ValueError if a column is not in the results
+        """
+        all_columns = self.get_result_columns(results.colnames)
+        if columns is None:
+            col_indices = list(range(len(all_columns)))
+        else:
+            missing = [col_name for col_name in columns if col_name not in all_columns]
+            if len(missing) > 0:
+                raise ValueError(f'Columns {missing} are not in the results, must be some of {all_columns[1:]}')
+            col_indices = [0] + [all_columns.index(col_name) for col_name in columns if col_name != all_columns[0]]
+        col_names = [all_columns[col_idx] for col_idx in col_indices]
+
+        # time is sorted, so the window is a contiguous range of rows
+        time = np.asarray(results)[:, 0]
+        row_start = 0 if time_start is None else int(np.searchsorted(time, time_start, side='left'))
+        row_end = len(time) if time_end is None else int(np.searchsorted(time, time_end, side='right'))
+        return col_names, col_indices, slice(row_start, row_end)
 
-    def get_plot_as_htmlimage(self, temodel):
+    def iter_results_csv(self, results, columns=None, time_start=None, time_end=None, chunk_rows=10000):
+        """Writes simulation results as csv in chunks
+
+        Args:
+            results: NamedArray resulting from tellurium simulation
+            columns, time_start, time_end: select part of the results, see
+                select_results()
+            chunk_rows: number of rows written in each chunk
+
+        Returns:
+            generator of strings, first the header and then chunks of rows,
+            so that a csv of large results is never kept in memory. Values
+            are written as in te_result_to_df(arr).to_csv(index=False)
+        """
+        col_names, col_indices, rows = self.select_results(results, columns=columns,
+                                                           time_start=time_start, time_end=time_end)
+        arr = np.asarray(results)[rows]
+        yield ','.join(col_names) + '\n'
+        for chunk_start in range(0, arr.shape[0], chunk_rows):
+            chunk = arr[chunk_start:chunk_start+chunk_rows, col_indices].tolist()
+            yield ''.join(','.join(map(repr, row)) + '\n' for row in chunk)
+
+    def get_result_columns(self, colnames):
+        """Gets species names from the column names of tellurium results
+
+        Args:
+            colnames: list of column names of a NamedArray resulting from
+                tellurium simulation. Ex. ['time', '[E]', '[S]']
+
+        Returns:
+            columns: list of names without brackets. Ex. ['time', 'E', 'S']
+        """
+        columns = [c[1:-1] if c[0] == "[" else c for c in colnames]
+        return columns
+
+
+    def get_trajectories(self, results, max_points=None):
+        """Gets simulation results as lists that can be exported as json
+
+        Args:
+            results: NamedArray resulting from tellurium simulation
+            max_points: maximum number of points of each trajectory, if
+                results have more points they are downsampled with
+                lttb_indices(), which keeps the shape of each trajectory.
+                None to keep all points
+
+        Returns:
+            trajectories: dictionary with "columns", the species names in the
+                order of the results, and "trajectories", with the "time" and
+                "values" lists of each species. Ex.
+                {
+                    'columns': ['E', 'S'],
+                    'trajectories': {
+                        'E': {'time': [0.0, 5.0, 10.0], 'values': [5.0, 4.2, 3.9]},
+                        'S': {'time': [0.0, 10.0], 'values': [1.0, 0.5]}
+                    }
+                }
+        """
+        columns = self.get_result_columns(results.colnames)[1:]
+        arr = np.asarray(results)
+        time = arr[:, 0]
+        trajectories = dict()
+        for col_idx, col_name in enumerate(columns, 1):
+            values = arr[:, col_idx]
+            if max_points is not None:
+                keep = lttb_indices(time, values, max_points)
+                trajectories[col_name] = {'time': time[keep].tolist(), 'values': values[keep].tolist()}
+            else:
+                trajectories[col_name] = {'time': time.tolist(), 'values': values.tolist()}
+        return {'columns': columns, 'trajectories': trajectories}
+
+    def get_plot_as_htmlimage(self, temodel, img_class=None):
         """Gets the plot produced by tellurium when running the model in HTML
 
         Args:
             temodel: tellurium model
+            img_class: class attribute added to the image tag, Ex. "img-fluid"
 
         Returns:
             img_str: image coded in base64 string and adjusted with html code
@@ -1080,6 +2840,572 @@ class MolybdenumModel(object):
         temodel.plot(dpi=300, savefig=io_str, format='jpg')
         io_str.seek(0)
         s = base64.b64encode(io_str.getvalue()).decode("utf-8").replace("\n", "")
-        img_str = f'<img align="center" src="data:image/png;base64,{s}">'
-
-        return img_str
\ No newline at end of file
+        if img_class is None:
+            img_str = f'<img align="center" src="data:image/png;base64,{s}">'
+        else:
+            img_str = f'<img align="center" class="{img_class}" src="data:image/png;base64,{s}">'
+
+        return img_str
+
+
+# compiled models kept by each worker process, see get_worker_temodel()
+_worker_temodels = OrderedDict()
+WORKER_TEMODELS_MAXSIZE = 8
+# whether RoadRunner.simulate() takes a SimulateOptions, None until checked,
+# see simulate_options()
+_simulate_takes_options = None
+# residual of each measurement when the model cannot be simulated, see fit_residuals()
+FIT_FAILED_RESIDUAL = 1e10
+
+
+def lttb_indices(x, y, n_out):
+    """Selects points of a series with Largest-Triangle-Three-Buckets
+
+    Args:
+        x: np.array with the x values of the series, sorted
+        y: np.array with the y values of the series
+        n_out: number of points to keep, at least 3
+
+    Returns:
+        indices: np.array with the indices of the points kept, sorted. Keeps
+            first and last point and, for each of the n_out-2 buckets in
+            between, the point forming the largest triangle with the point
+            kept in the previous bucket and the average of the next bucket
+
+    Raises:
+        ValueError if n_out is smaller than 3
+    """
+    if n_out < 3:
+        raise ValueError(f'At least 3 points must be kept when downsampling, but got {n_out}')
+    n_in = len(x)
+    if n_in <= n_out:
+        return np.arange(n_in)
+
+    # limits of buckets for all points except first and last
+    edges = np.linspace(1, n_in - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n_in - 1
+    prev_idx = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # next bucket is the last point after the last bucket
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n_in
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        # twice the area of the triangles, the constant factor does not matter
+        areas = np.abs((x[prev_idx] - next_x) * (y[start:end] - y[prev_idx])
+                       - (x[prev_idx] - x[start:end]) * (next_y - y[prev_idx]))
+        prev_idx = start + int(np.argmax(areas))
+        indices[bucket + 1] = prev_idx
+    return indices
+
+
+def thin_indices(time, values, tol):
+    """Selects the points of trajectories needed to keep their shape
+
+    Args:
+        time: np.array with the time points, sorted
+        values: np.array with dimensions (time, columns)
+        tol: maximum error allowed when interpolating linearly between the
+            points kept, as a fraction of the range of each column
+
+    Returns:
+        indices: np.array with the indices of the points kept, sorted.
+            Keeps first and last point and, with Ramer-Douglas-Peucker, splits
+            segments at their furthest point until all points in between
+            are within tol
+    """
+    n_in = len(time)
+    if n_in <= 2:
+        return np.arange(n_in)
+    scale = np.ptp(values, axis=0)
+    # constant columns are kept by the first and last points
+    scale[scale == 0] = 1.0
+    keep = np.zeros(n_in, dtype=bool)
+    keep[[0, -1]] = True
+    segments = [(0, n_in - 1)]
+    while len(segments) > 0:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        # error of interpolating the points in between, relative to the range of each column
+        frac = (time[start+1:end] - time[start]) / (time[end] - time[start])
+        interp = values[start] + frac[:, None] * (values[end] - values[start])
+        errors = (np.abs(values[start+1:end] - interp) / scale).max(axis=1)
+        furthest = int(np.argmax(errors))
+        if errors[furthest] > tol:
+            split = start + 1 + furthest
+            keep[split] = True
+            segments.append((start, split))
+            segments.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def get_selection_ids(temodel, selections):
+    """Gets the tellurium selections of species and reaction names
+
+    Args:
+        temodel: tellurium model
+        selections: list of species or reaction names. Ex. ['S', 'veq']
+
+    Returns:
+        selection_ids: list of selections starting with time, species are
+            selected by concentration. Ex. ['time', '[S]', 'veq']
+
+    Raises:
+        ValueError if a name is not a species or reaction of the model
+    """
+    spec_ids = list(temodel.getFloatingSpeciesIds()) + list(temodel.getBoundarySpeciesIds())
+    reac_ids = list(temodel.getReactionIds())
+    selection_ids = ['time']
+    for name in selections:
+        if name in spec_ids:
+            selection_ids.append(f'[{name}]')
+        elif name in reac_ids:
+            selection_ids.append(name)
+        else:
+            raise ValueError(f'Could not find {name} in species or reactions of the model')
+    return selection_ids
+
+
+def simulate_sim_params(temodel, sim_params):
+    """Simulates a compiled model with the output options of sim_params
+
+    Args:
+        temodel: tellurium model, simulated from its current state
+        sim_params: dictionary with "sim_start", "sim_end" and "sim_points",
+            and optionally:
+            "variable_step": if True, results have the time points taken by
+                the integrator instead of sim_points evenly spaced ones
+            "thin_tol": only keep the points needed to interpolate the
+                results within this fraction of the range of each column,
+                see thin_indices()
+            "selections": list of species or reaction names to record
+                instead of all floating species, see get_selection_ids()
+
+    Returns:
+        results: NamedArray from tellurium simulation, with time as first
+            column. Columns of species are concentrations and columns of
+            reactions their rates
+
+    Notes:
+        selections and the step mode of the integrator are set back to the
+        previous ones afterwards, so that the compiled model can be reused
+    """
+    prev_selections = list(temodel.timeCourseSelections)
+    prev_variable_step = temodel.integrator.getValue('variable_step_size')
+    if 'selections' in sim_params:
+        temodel.timeCourseSelections = get_selection_ids(temodel, sim_params['selections'])
+    try:
+        if sim_params.get('variable_step', False):
+            temodel.integrator.setValue('variable_step_size', True)
+            results = temodel.simulate(start=sim_params['sim_start'], end=sim_params['sim_end'])
+        else:
+            results = temodel.simulate(start=sim_params['sim_start'],
+                                       end=sim_params['sim_end'],
+                                       points=sim_params['sim_points'])
+    finally:
+        temodel.integrator.setValue('variable_step_size', prev_variable_step)
+        temodel.timeCourseSelections = prev_selections
+    if sim_params.get('thin_tol') is not None:
+        keep = thin_indices(results[:, 0], results[:, 1:], sim_params['thin_tol'])
+        colnames = results.colnames
+        # indexing loses the column names of NamedArrays
+        results = results[keep]
+        results.colnames = colnames
+    return results
+
+
+def simulate_no_copy(temodel, sim_params):
+    """Simulates a compiled model returning its internal result buffer
+
+    Args:
+        temodel: tellurium model ready to simulate
+        sim_params: dictionary with "sim_start", "sim_end" and "sim_points"
+
+    Returns:
+        results: NamedArray with the results of the simulation. It is
+            overwritten by the next simulation of temodel, so it has to be
+            copied somewhere else before simulating again
+
+    Notes:
+        avoids allocating a new array for each simulation when results are
+        written to a bigger array. Results are not copied through the
+        options of this call only, see simulate_options(). The global
+        roadrunner configuration is not changed, so simulations of other
+        threads are not affected
+    """
+    options = roadrunner.SimulateOptions()
+    options.start = sim_params['sim_start']
+    options.end = sim_params['sim_end']
+    options.steps = sim_params['sim_points'] - 1
+    options.copy_result = False
+    # same as temodel.simulate() with a number of points, results on the
+    # time points instead of at every step of the integrator
+    integrator = temodel.integrator
+    variable_step = integrator.hasValue('variable_step_size') and integrator.getValue('variable_step_size')
+    if variable_step:
+        integrator.setValue('variable_step_size', False)
+    try:
+        results = simulate_options(temodel, options)
+    finally:
+        if variable_step:
+            integrator.setValue('variable_step_size', True)
+    return results
+
+
+def simulate_options(temodel, options):
+    """Simulates a compiled model with a roadrunner.SimulateOptions
+
+    Args:
+        temodel: tellurium model ready to simulate
+        options: roadrunner.SimulateOptions with the start, end, steps and
+            output options of the simulation
+
+    Returns:
+        results: NamedArray with the results of the simulation
+
+    Notes:
+        the options are passed to RoadRunner.simulate(). Its python wrapper
+        in roadrunner 2.x only takes start, end and points and builds its
+        own options from them, so where it rejects the options object the
+        binding of the C++ RoadRunner::simulate(SimulateOptions) that the
+        wrapper calls is used instead. If neither is available, the model is
+        simulated from start, end and points, and the other options are
+        ignored. Which one works is only checked once
+    """
+    global _simulate_takes_options
+    if _simulate_takes_options is not False:
+        try:
+            results = temodel.simulate(options)
+            _simulate_takes_options = True
+            return results
+        except TypeError:
+            if _simulate_takes_options:
+                raise
+            # the wrapper fails setting the options before simulating
+            _simulate_takes_options = False
+    simulate_binding = getattr(temodel, '_simulate', None)
+    if simulate_binding is not None:
+        return simulate_binding(options)
+    return temodel.simulate(start=options.start, end=options.end, points=options.steps + 1)
+
+
+def get_species_indices(temodel, spec_ids):
+    """Gets the indices of floating species in a compiled model
+
+    Args:
+        temodel: tellurium model
+        spec_ids: list of floating species names
+
+    Returns:
+        spec_indices: list with the index of each species of spec_ids in
+            temodel.getFloatingSpeciesIds(), which is reordered by conserved
+            moiety analysis
+    """
+    temodel_ids = list(temodel.getFloatingSpeciesIds())
+    return [temodel_ids.index(spec_id) for spec_id in spec_ids]
+
+
+def solve_steady_state(temodel, spec_ids=None):
+    """Solves the steady state of a compiled model from its current state
+
+    Args:
+        temodel: tellurium model, its current state is the starting point.
+            Conserved moiety analysis is enabled if it is not, since the
+            solver fails for models with conserved totals without it, Ex.
+            E + ES of an enzyme. Enabling it compiles the model again, which
+            keeps the current amounts but resets initial values, and reorders
+            its floating species, see MolybdenumModel.get_temodel() to keep
+            such a model
+        spec_ids: (optional) list of floating species names, to get the
+            values in that order instead of the order of the compiled model
+
+    Returns:
+        values: np.array with the concentrations of floating species at
+            steady state, the model is left at that state
+
+    Raises:
+        ValueError if no steady state is found
+
+    Notes:
+        the solver is called directly first, which takes microseconds when
+        the state is close to the solution. temodel.steadyState() checks the
+        model for conserved moieties every time, which takes much longer, so
+        it is only used if solving directly fails
+    """
+    if not temodel.conservedMoietyAnalysis:
+        # the amounts are lost when the model is compiled again
+        prev_amounts = dict(zip(temodel.getFloatingSpeciesIds(), temodel.model.getFloatingSpeciesAmounts()))
+        temodel.conservedMoietyAnalysis = True
+        temodel.model.setFloatingSpeciesAmounts(get_species_indices(temodel, list(prev_amounts)),
+                                                list(prev_amounts.values()))
+    if spec_ids is None:
+        spec_ids = list(temodel.getFloatingSpeciesIds())
+    spec_indices = get_species_indices(temodel, spec_ids)
+    start_amounts = temodel.model.getFloatingSpeciesAmounts()
+    solver = temodel.getSteadyStateSolver()
+    try:
+        solver.solve()
+    except RuntimeError:
+        # failed attempts leave the model at the last iteration
+        temodel.model.setFloatingSpeciesAmounts(start_amounts)
+        # simulating for a while before solving gets closer to the solution
+        solver.setValue('allow_presimulation', True)
+        try:
+            temodel.steadyState()
+        except RuntimeError as e:
+            temodel.model.setFloatingSpeciesAmounts(start_amounts)
+            raise ValueError(f'Could not find a steady state of the model: {e}')
+        finally:
+            solver.setValue('allow_presimulation', False)
+    return np.array(temodel.model.getFloatingSpeciesConcentrations(spec_indices))
+
+
+def simulate_assignments(temodel, init_values, assignment_list, sim_params, out=None):
+    """Simulates a compiled model once for each assignment of values
+
+    Args:
+        temodel: tellurium model with the initial values in init_values
+        init_values: dictionary with the initial values of species and
+            parameters of the model, see MolybdenumModel.get_init_values()
+        assignment_list: list of dictionaries with the names and values to
+            change in each run
+        sim_params: dictionary with "sim_start", "sim_end" and "sim_points"
+        out: (optional) np.array with dimensions (runs, time, species) where
+            results are written
+
+    Returns:
+        time: np.array with the time points
+        colnames: column names of the tellurium results, including time
+        out: np.array with dimensions (runs, time, species)
+    """
+    colnames = list(temodel.timeCourseSelections)
+    if out is None:
+        out = np.empty((len(assignment_list), sim_params['sim_points'], len(colnames) - 1))
+    time = None
+    for run_ct, assignment in enumerate(assignment_list):
+        for name, value in assignment.items():
+            temodel.model[f'init({name})'] = value
+        temodel.resetAll()
+        run_results = simulate_no_copy(temodel, sim_params)
+        out[run_ct] = run_results[:, 1:]
+        if time is None:
+            time = np.array(run_results[:, 0])
+        # go back to the values of the model for the next run
+        for name in assignment.keys():
+            temodel.model[f'init({name})'] = init_values[name]
+    temodel.resetAll()
+    return time, colnames, out
+
+
+def simulate_assignments_worker(model_info, assignment_list, sim_params):
+    """Simulates a chunk of runs of a sweep in a worker process
+
+    Args:
+        model_info: tuple with the structure key, SBML string and initial
+            values of the model
+        assignment_list: list of dictionaries with the names and values to
+            change in each run
+        sim_params: dictionary with "sim_start", "sim_end" and "sim_points"
+
+    Returns:
+        same as simulate_assignments()
+
+    Notes:
+        compiled models are kept in the worker by structure key, so further
+        chunks of the same model do not compile it again
+    """
+    temodel = get_worker_temodel(model_info)
+    return simulate_assignments(temodel, model_info[2], assignment_list, sim_params)
+
+
+def simulate_stochastic(temodel, seeds, sim_params, n_bins=256, batch_size=32):
+    """Simulates a compiled model stochastically once for each seed
+
+    Args:
+        temodel: tellurium model with the initial values of the runs
+        seeds: list of seeds, one for each run
+        sim_params: dictionary with "sim_start", "sim_end" and "sim_points"
+        n_bins: number of bins used to estimate quantiles, see EnsembleStats
+        batch_size: number of runs kept before adding them to the statistics
+
+    Returns:
+        time: np.array with the time points
+        colnames: column names of the tellurium results, including time
+        stats: EnsembleStats of the runs
+
+    Notes:
+        the integrator of temodel is set back to the previous one afterwards,
+        so that the compiled model can be reused for other simulations
+    """
+    colnames = list(temodel.timeCourseSelections)
+    batch = np.empty((min(batch_size, len(seeds)), sim_params['sim_points'], len(colnames) - 1))
+    stats = EnsembleStats(batch.shape[1:], n_bins=n_bins)
+    prev_integrator = temodel.integrator.getName()
+    temodel.setIntegrator('gillespie')
+    # results on the time points of sim_params instead of at every reaction
+    temodel.integrator.setValue('variable_step_size', False)
+    time = None
+    try:
+        for run_ct, seed in enumerate(seeds):
+            temodel.integrator.setValue('seed', seed)
+            temodel.resetAll()
+            run_results = simulate_no_copy(temodel, sim_params)
+            batch[run_ct % batch.shape[0]] = run_results[:, 1:]
+            if time is None:
+                time = np.array(run_results[:, 0])
+            if (run_ct % batch.shape[0] == batch.shape[0] - 1) or (run_ct == len(seeds) - 1):
+                stats.add(batch[:run_ct % batch.shape[0] + 1])
+    finally:
+        temodel.setIntegrator(prev_integrator)
+        temodel.resetAll()
+    return time, colnames, stats
+
+
+def simulate_stochastic_worker(model_info, seeds, sim_params, n_bins):
+    """Simulates a chunk of runs of a stochastic ensemble in a worker process
+
+    Args:
+        model_info: tuple with the structure key, SBML string and initial
+            values of the model
+        seeds: list of seeds, one for each run
+        sim_params: dictionary with "sim_start", "sim_end" and "sim_points"
+        n_bins: number of bins used to estimate quantiles
+
+    Returns:
+        same as simulate_stochastic(), only the statistics of the runs are
+        sent back to the main process
+    """
+    temodel = get_worker_temodel(model_info)
+    return simulate_stochastic(temodel, seeds, sim_params, n_bins=n_bins)
+
+
+def fit_residuals(values, temodel, fit_problem):
+    """Gets the differences between the model and measured data
+
+    Args:
+        values: values of the free parameters
+        temodel: tellurium model recording the measured columns, see fit_starts()
+        fit_problem: dictionary from MolybdenumModel.get_fit_problem()
+
+    Returns:
+        residuals: np.array with simulated minus measured values of every
+            measurement, FIT_FAILED_RESIDUAL if the simulation fails
+    """
+    for name, value in zip(fit_problem['param_names'], values):
+        temodel.model[f'init({name})'] = value
+    temodel.resetAll()
+    try:
+        results = temodel.simulate(times=fit_problem['times'])
+    except RuntimeError:
+        return np.full(fit_problem['mask'].sum(), FIT_FAILED_RESIDUAL)
+    simulated = np.asarray(results)[fit_problem['rows'], 1:]
+    return (simulated - fit_problem['measured'])[fit_problem['mask']]
+
+
+def fit_starts(temodel, fit_problem, starts):
+    """Optimizes the free parameters of a compiled model from several starts
+
+    Args:
+        temodel: tellurium model
+        fit_problem: dictionary from MolybdenumModel.get_fit_problem()
+        starts: list of np.arrays with the starting values of the free parameters
+
+    Returns:
+        start_results: list of dictionaries, one for each start, with the
+            "start" and fitted "params" as dictionaries, the sum of squared
+            residuals "ssr" and "success" of the optimization
+
+    Notes:
+        the compiled model records only the measured columns while fitting,
+        its selections are set back to the previous ones afterwards
+    """
+    prev_selections = list(temodel.timeCourseSelections)
+    temodel.timeCourseSelections = get_selection_ids(temodel, fit_problem['columns'])
+    start_results = []
+    try:
+        for start in starts:
+            opt_result = optimize.least_squares(fit_residuals, start, args=(temodel, fit_problem),
+                                                bounds=(fit_problem['lower'], fit_problem['upper']),
+                                                x_scale='jac')
+            start_results.append({
+                'start': dict(zip(fit_problem['param_names'], np.asarray(start, dtype=float).tolist())),
+                'params': dict(zip(fit_problem['param_names'], opt_result.x.tolist())),
+                'ssr': float(2 * opt_result.cost),
+                'success': bool(opt_result.success),
+            })
+    finally:
+        temodel.timeCourseSelections = prev_selections
+    return start_results
+
+
+def fit_starts_worker(model_info, fit_problem, starts):
+    """Optimizes a chunk of starts of a fit in a worker process
+
+    Args:
+        model_info: tuple with the structure key, SBML string and initial
+            values of the model
+        fit_problem: dictionary from MolybdenumModel.get_fit_problem()
+        starts: list of np.arrays with the starting values of the free parameters
+
+    Returns:
+        same as fit_starts()
+    """
+    temodel = get_worker_temodel(model_info)
+    return fit_starts(temodel, fit_problem, starts)
+
+
+def get_worker_temodel(model_info):
+    """Gets the compiled model of a worker process, with its initial values
+
+    Args:
+        model_info: tuple with the structure key, SBML string and initial
+            values of the model, see MolybdenumModel.get_model_info()
+
+    Returns:
+        temodel: tellurium model, compiled only if the worker did not compile
+            a model with the same structure key before
+    """
+    structure_key, sbml_str, init_values = model_info
+    if structure_key in _worker_temodels:
+        temodel = _worker_temodels[structure_key]
+        _worker_temodels.move_to_end(structure_key)
+    else:
+        temodel = te.loadSBMLModel(sbml_str)
+        _worker_temodels[structure_key] = temodel
+        if len(_worker_temodels) > WORKER_TEMODELS_MAXSIZE:
+            _worker_temodels.popitem(last=False)
+    for name, value in init_values.items():
+        temodel.model[f'init({name})'] = value
+    temodel.resetAll()
+    return temodel
+
+
+def run_worker(model_info, sim_params):
+    """Simulates a model in a worker process, as MolybdenumModel.run()
+
+    Args:
+        model_info: tuple with the structure key, SBML string and initial
+            values of the model, see MolybdenumModel.get_model_info()
+        sim_params: dictionary with "sim_start", "sim_end" and "sim_points",
+            and optionally output options, see simulate_sim_params()
+
+    Returns:
+        results: NamedArray from tellurium simulation
+    """
+    temodel = get_worker_temodel(model_info)
+    results = simulate_sim_params(temodel, sim_params)
+    return results
+
+
+def warm_worker():
+    """Imports tellurium and simulates a trivial model in a worker process
+
+    Returns:
+        process id of the worker, once it is ready to simulate
+    """
+    temodel = te.loada('S1 -> S2; k1*S1; S1 = 10; S2 = 0; k1 = 0.1')
+    temodel.simulate(0, 1, 10)
+    return os.getpid()
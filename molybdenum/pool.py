@@ -0,0 +1,95 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .molybdenum import run_worker, warm_worker
+
+
+class SimulationPool(object):
+    """Worker processes that keep tellurium loaded and models compiled
+
+    Args:
+        processes: number of worker processes
+        start_method: "forkserver" or "spawn", how worker processes are
+            started. "forkserver" falls back to "spawn" where not available.
+            Workers are not forked from the calling process, which may
+            have threads running (Ex. a web server)
+
+    Notes:
+        workers import tellurium and simulate a trivial model as soon as the
+        pool is created. Models are sent to a worker chosen by their
+        structure key, so runs of the same model land on the worker that
+        already compiled it, unless that worker is much busier than others
+    """
+    def __init__(self, processes=2, start_method='forkserver'):
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = 'spawn'
+        mp_context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            # workers are forked from a server that already imported tellurium
+            mp_context.set_forkserver_preload(['tellurium', 'molybdenum.molybdenum'])
+        # one executor per process so that jobs can be sent to a given worker
+        self._workers = [ProcessPoolExecutor(max_workers=1, mp_context=mp_context) for _ in range(processes)]
+        # jobs sent to each worker and not finished yet
+        self._pending = [0] * processes
+        self._lock = threading.Lock()
+        self.warm_futures = [worker.submit(warm_worker) for worker in self._workers]
+
+    def wait_ready(self, timeout=None):
+        """Waits until all workers are ready to simulate
+
+        Returns:
+            list of process ids of the workers
+        """
+        return [future.result(timeout=timeout) for future in self.warm_futures]
+
+    def get_worker_index(self, structure_key):
+        """Chooses the worker that simulates a model
+
+        Args:
+            structure_key: structure key of the model, see
+                MolybdenumModel.get_structure_key()
+
+        Returns:
+            index of the worker, the one assigned to the structure key if it
+            has at most one job more than the least busy worker
+        """
+        preferred = int(structure_key[:8], 16) % len(self._workers)
+        with self._lock:
+            least_busy = min(range(len(self._workers)), key=self._pending.__getitem__)
+            if self._pending[preferred] > self._pending[least_busy] + 1:
+                return least_busy
+        return preferred
+
+    def run(self, mb_model, sim_params=None):
+        """Simulates a model in one of the workers
+
+        Args:
+            mb_model: MolybdenumModel to simulate
+            sim_params: dictionary with "sim_start", "sim_end" and
+                "sim_points", by default the ones of the model
+
+        Returns:
+            future: concurrent.futures.Future, its result is the NamedArray
+                that mb_model.run() would return
+        """
+        if sim_params is None:
+            sim_params = mb_model.sim_params
+        model_info = mb_model.get_model_info()
+        worker_idx = self.get_worker_index(model_info[0])
+        with self._lock:
+            self._pending[worker_idx] += 1
+        future = self._workers[worker_idx].submit(run_worker, model_info, sim_params)
+        future.add_done_callback(lambda _: self._job_done(worker_idx))
+        return future
+
+    def _job_done(self, worker_idx):
+        with self._lock:
+            self._pending[worker_idx] -= 1
+        return None
+
+    def shutdown(self, wait=True):
+        """Stops the worker processes"""
+        for worker in self._workers:
+            worker.shutdown(wait=wait)
+        return None
@@ -0,0 +1,125 @@
+from collections.abc import Mapping, Sequence
+
+# components of a molybdenum model, in the order they are exported
+MODEL_KEYS = ['species', 'reactions', 'params', 'node_to_id', 'sim_params']
+
+
+class FrozenDict(Mapping):
+    """Read-only view of a dictionary
+
+    Nested dictionaries and lists are also returned as read-only views, so
+    the wrapped dictionary cannot be modified through it.
+    """
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return freeze(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return repr(thaw(self))
+
+
+class FrozenList(Sequence):
+    """Read-only view of a list, compares equal to lists with the same elements"""
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrozenList(self._data[index])
+        return freeze(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, FrozenList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(thaw(self))
+
+
+class ModelSnapshot(FrozenDict):
+    """Read-only molybdenum model at the moment it was taken
+
+    Taking a snapshot does not copy the model. The model shares its
+    dictionaries with the snapshot and copies them the next time it edits
+    them, see MolybdenumModel.snapshot().
+
+    Args:
+        data: dictionary with the MODEL_KEYS of the model
+        source: (optional) snapshot the model was loaded from, kept alive
+            while this snapshot may share its dictionaries
+    """
+    def __init__(self, data, source=None):
+        super().__init__(data)
+        self._source = source
+
+
+def freeze(value):
+    """Wraps dictionaries and lists into read-only views
+
+    Args:
+        value: any element of a molybdenum model
+
+    Returns:
+        FrozenDict for dictionaries, FrozenList for lists, value otherwise
+    """
+    if isinstance(value, dict):
+        return FrozenDict(value)
+    elif isinstance(value, list):
+        return FrozenList(value)
+    return value
+
+
+def thaw(value):
+    """Copies read-only views into plain dictionaries and lists
+
+    Args:
+        value: FrozenDict, FrozenList or any element of a molybdenum model
+
+    Returns:
+        plain dictionaries and lists that can be modified without affecting
+        the model they came from
+    """
+    if isinstance(value, (FrozenDict, dict)):
+        return {key: thaw(val) for key, val in value.items()}
+    elif isinstance(value, (FrozenList, list)):
+        return [thaw(val) for val in value]
+    return value
+
+
+def json_default(value):
+    """Converts read-only views for json.dumps(), pass it as default"""
+    if isinstance(value, FrozenDict):
+        return dict(value.items())
+    elif isinstance(value, FrozenList):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def copy_component(component):
+    """Copies a species, reactions, params, node_to_id or sim_params dictionary
+
+    Args:
+        component: dictionary of one of the model keys
+
+    Returns:
+        copy where the dictionary of each element and its lists are new
+        objects, so they can be modified without changing the original
+    """
+    component_copy = dict()
+    for key, value in component.items():
+        if isinstance(value, dict):
+            value = {att: list(val) if isinstance(val, list) else val for att, val in value.items()}
+        component_copy[key] = value
+    return component_copy
@@ -0,0 +1,160 @@
+import numpy as np
+
+
+class EnsembleStats(object):
+    """Running mean, variance and quantiles of trajectories on a time grid
+
+    Args:
+        shape: tuple with the dimensions (time, species) of each trajectory
+        n_bins: number of bins of the histogram of each time point and
+            species, used to estimate quantiles. Must be a power of 2, the
+            histograms take time*species*n_bins*4 bytes
+
+    Notes:
+        trajectories are added in batches and then discarded, only the
+        statistics are kept. Mean and variance are updated with Welford's
+        algorithm. Quantiles come from a histogram of the values of each
+        time point and species, which are expected to be non-negative
+        molecule counts: bins start with width 1, so quantiles are exact, and
+        their width is doubled while the largest value does not fit in
+        n_bins bins.
+        Statistics of different processes can be combined with merge()
+    """
+    def __init__(self, shape, n_bins=256):
+        if (n_bins < 1) or (n_bins & (n_bins - 1)):
+            raise ValueError(f'Number of bins must be a power of 2, but got {n_bins}')
+        self.shape = tuple(shape)
+        self.n_bins = n_bins
+        self.n = 0
+        self.mean = np.zeros(self.shape)
+        # sum of squared differences to the mean
+        self.m2 = np.zeros(self.shape)
+        # counts of values in each bin, bins of each time point and species
+        # have the width in widths
+        self.hist = np.zeros(self.shape + (n_bins,), dtype=np.int32)
+        self.widths = np.ones(self.shape, dtype=np.int64)
+
+    def add(self, batch):
+        """Adds a batch of trajectories
+
+        Args:
+            batch: np.array with dimensions (runs, time, species)
+
+        Returns:
+            None, updates the statistics
+        """
+        n_batch = batch.shape[0]
+        if n_batch == 0:
+            return None
+        self._combine_moments(n_batch, batch.mean(axis=0), ((batch - batch.mean(axis=0))**2).sum(axis=0))
+
+        # widen bins of time points and species with values that do not fit
+        needed = np.maximum(batch.max(axis=0), 0) // self.n_bins + 1
+        for cell in zip(*np.nonzero(needed > self.widths)):
+            self._widen(cell, int(needed[cell]))
+        bins = np.clip(batch // self.widths, 0, self.n_bins - 1).astype(np.int64)
+        # flat index of (time, species, bin) in the histogram
+        cells = np.arange(self.shape[0] * self.shape[1]).reshape(self.shape)
+        flat = (cells * self.n_bins + bins).ravel()
+        # count only the bins with values, the temporary arrays are the size
+        # of the batch and not of the whole histogram
+        flat_bins, counts = np.unique(flat, return_counts=True)
+        self.hist.reshape(-1)[flat_bins] += counts.astype(np.int32)
+        return None
+
+    def merge(self, other):
+        """Adds the statistics of another EnsembleStats with the same shape
+
+        Args:
+            other: EnsembleStats, Ex. computed in another process
+
+        Returns:
+            None, updates the statistics as if the trajectories of other
+            had been added
+        """
+        if other.n == 0:
+            return None
+        self._combine_moments(other.n, other.mean, other.m2)
+        other_hist = other.hist.copy()
+        for cell in zip(*np.nonzero(self.widths != other.widths)):
+            width = max(self.widths[cell], other.widths[cell])
+            self._widen(cell, width)
+            other_hist[cell] = coarsen_bins(other_hist[cell], width // other.widths[cell])
+        self.hist += other_hist
+        return None
+
+    def get_variance(self):
+        """Gets the sample variance (ddof=1), 0 with less than two trajectories"""
+        if self.n < 2:
+            return np.zeros(self.shape)
+        return self.m2 / (self.n - 1)
+
+    def get_quantiles(self, levels):
+        """Gets quantiles of the values at each time point and species
+
+        Args:
+            levels: list of quantile levels between 0 and 1. Ex. [0.05, 0.95]
+
+        Returns:
+            quantiles: np.array with dimensions (levels, time, species), the
+                smallest value with at least that fraction of the values at
+                or below it. Within bins wider than 1 the value is
+                interpolated between the integers of the bin
+
+        Raises:
+            ValueError if a level is not between 0 and 1, or there are no
+                trajectories
+        """
+        if self.n == 0:
+            raise ValueError('Cannot get quantiles without trajectories')
+        cdf = np.cumsum(self.hist, axis=2)
+        quantiles = np.empty((len(levels),) + self.shape)
+        for level_ct, level in enumerate(levels):
+            if not (0 <= level <= 1):
+                raise ValueError(f'Quantile levels must be between 0 and 1, but got {level}')
+            target = max(int(np.ceil(level * self.n)), 1)
+            bin_idx = np.argmax(cdf >= target, axis=2)
+            below = np.where(bin_idx > 0, np.take_along_axis(cdf, (bin_idx - 1)[..., None], axis=2)[..., 0], 0)
+            in_bin = np.take_along_axis(self.hist, bin_idx[..., None], axis=2)[..., 0]
+            frac = (target - below - 1) / np.maximum(in_bin - 1, 1)
+            quantiles[level_ct] = bin_idx * self.widths + frac * (self.widths - 1)
+        return quantiles
+
+    def _combine_moments(self, n_other, mean_other, m2_other):
+        # Chan et al. update of mean and sum of squares with another group
+        n_total = self.n + n_other
+        delta = mean_other - self.mean
+        self.mean = self.mean + delta * n_other / n_total
+        self.m2 = self.m2 + m2_other + delta**2 * self.n * n_other / n_total
+        self.n = n_total
+        return None
+
+    def _widen(self, cell, width):
+        # make bins of a (time, species) cell at least width wide, keeping powers of 2
+        factor = 1
+        while self.widths[cell] * factor < width:
+            factor *= 2
+        if factor > 1:
+            self.hist[cell] = coarsen_bins(self.hist[cell], factor)
+            self.widths[cell] *= factor
+        return None
+
+
+def coarsen_bins(hist, factor):
+    """Joins consecutive bins of histograms
+
+    Args:
+        hist: np.array with the bins in its last dimension, a power of 2
+        factor: power of 2, number of bins joined into one
+
+    Returns:
+        coarse: np.array with the same shape as hist, with bin i containing
+            bins i*factor to (i+1)*factor-1 of hist and empty bins at the end
+    """
+    if factor == 1:
+        return hist
+    n_bins = hist.shape[-1]
+    group = min(factor, n_bins)
+    coarse = np.zeros_like(hist)
+    coarse[..., :n_bins // group] = hist.reshape(hist.shape[:-1] + (n_bins // group, group)).sum(axis=-1)
+    return coarse
@@ -1,8 +1,13 @@
-from molybdenum import MolybdenumModel
+from molybdenum import MolybdenumModel, ModelSnapshot, SimulationPool
+from molybdenum.stats import EnsembleStats
+from molybdenum.molybdenum import simulate_no_copy
 import simplesbml
 import unittest
 
 import sys
+import json
+import subprocess
+import threading
 
 import numpy as np
 import pandas as pd
@@ -66,6 +71,25 @@ class TestMolybdenumModel(unittest.TestCase):
             6: "reac2",
         }
 
+        # linear chain with steady state S1 = k0/k1, S2 = k0/k2
+        self.example_chain_mbmodel = {
+            "species": {
+                "spec1": {"name": "S1", "amt": 0.0, "fixed": False},
+                "spec2": {"name": "S2", "amt": 0.0, "fixed": False},
+            },
+            "reactions": {
+                "reac1": {"name": "J0", "reagents": [], "products": ["S1"], "expression": "k0"},
+                "reac2": {"name": "J1", "reagents": ["S1"], "products": ["S2"], "expression": "k1*S1"},
+                "reac3": {"name": "J2", "reagents": ["S2"], "products": [], "expression": "k2*S2"},
+            },
+            "params": {
+                "param1": {"name": "k0", "val": 1.0},
+                "param2": {"name": "k1", "val": 0.5},
+                "param3": {"name": "k2", "val": 0.25},
+            },
+            "sim_params": self.example_sim_param,
+        }
+
         # add this to another version of the model
         self.example_mbmodel_wnode = self.example_mbmodel.copy()
         self.example_mbmodel_wnode["node_to_id"] = self.example_node_to_id
@@ -336,6 +360,27 @@ end
         # check if it matches with the example one
         self.assertEqual(mbmodel.node_to_id, self.example_node_to_id)
 
+    def test_build_indexes(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        self.assertEqual(mbmodel.get_node_id('reac1'), 5)
+        self.assertEqual(mbmodel.get_spec_id('ES'), 'spec3')
+        self.assertEqual(mbmodel.get_param_id('kcat'), 'param3')
+        # lookups follow edits done through the model methods
+        mbmodel.update_name_byid(2, 'Subs')
+        self.assertEqual(mbmodel.get_spec_id('Subs'), 'spec2')
+        with self.assertRaises(KeyError):
+            mbmodel.get_spec_id('S')
+        mbmodel.update_from_form([('param3_name', ['kinh'])])
+        self.assertEqual(mbmodel.get_param_id('kinh'), 'param3')
+        # and also edits done directly on the model dictionaries
+        mbmodel.species['spec4']['name'] = 'Prod'
+        self.assertEqual(mbmodel.get_spec_id('Prod'), 'spec4')
+        mbmodel.node_to_id = {10: 'spec1', 11: 'reac1'}
+        self.assertEqual(mbmodel.get_node_id('reac1'), 11)
+        with self.assertRaises(KeyError):
+            mbmodel.get_node_id('reac2')
+
     def test_loadm(self):
         mbmodel = MolybdenumModel()
         # load example model
@@ -397,10 +442,83 @@ end
             }
             mbmodel_fail.loadm(example_model_fail)
 
+    def test_lazy_imports(self):
+        # editing models does not import the simulation libraries
+        check_imports = ("import sys, molybdenum; "
+                         "mbmodel = molybdenum.MolybdenumModel(); "
+                         f"mbmodel.loadm({self.example_mbmodel!r}); "
+                         "mbmodel.toGraph(); "
+                         "print(sorted(m for m in ('tellurium', 'pandas', 'roadrunner', 'simplesbml', 'scipy') if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", check_imports], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "[]")
+        return None
+
     def test_todict(self):
         mbmodel = MolybdenumModel()
         mbmodel.loadm(self.example_mbmodel)
         self.assertEqual(mbmodel.todict(), self.example_mbmodel_wnode)
+        # plain dictionaries, independent of the model
+        model_dict = mbmodel.todict()
+        self.assertIs(type(model_dict["species"]), dict)
+        json.dumps(model_dict)
+        model_dict["species"]["spec1"]["name"] = "X"
+        model_dict["reactions"]["reac1"]["reagents"].append("X")
+        self.assertEqual(mbmodel.todict(), self.example_mbmodel_wnode)
+
+    def test_snapshot(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        model_snapshot = mbmodel.snapshot()
+        self.assertIsInstance(model_snapshot, ModelSnapshot)
+        self.assertEqual(model_snapshot, self.example_mbmodel_wnode)
+        # snapshots cannot be modified
+        with self.assertRaises(TypeError):
+            model_snapshot["species"]["spec1"]["name"] = "X"
+        with self.assertRaises(AttributeError):
+            model_snapshot["reactions"]["reac1"]["reagents"].append("X")
+
+        # reading the model does not copy it, shared components are read-only
+        self.assertEqual(mbmodel.species["spec1"]["name"], "E")
+        mbmodel.get_structure_key()
+        mbmodel.get_init_values()
+        self.assertIs(mbmodel._model_data["species"], model_snapshot._data["species"])
+        with self.assertRaises(TypeError):
+            mbmodel.params["param1"]["val"] = 1.0
+
+        # editing the model does not change the snapshot
+        mbmodel.update_name_byid(1, "Enz")
+        mbmodel.unshare("params")
+        mbmodel.params["param1"]["val"] = 1.0
+        self.assertEqual(model_snapshot, self.example_mbmodel_wnode)
+        self.assertIs(mbmodel._model_data["sim_params"], model_snapshot._data["sim_params"])
+        self.assertEqual(mbmodel.species["spec1"]["name"], "Enz")
+        self.assertEqual(mbmodel.reactions["reac1"]["reagents"], ["Enz", "S"])
+
+        # loading a snapshot shares it until the new model is edited
+        mbmodel2 = MolybdenumModel()
+        mbmodel2.loadm(model_snapshot)
+        self.assertEqual(mbmodel2.todict(), self.example_mbmodel_wnode)
+        self.assertEqual(mbmodel2.get_new_id("species"), "spec5")
+        mbmodel2.update_from_form([("spec2_amt", ["1.0"])])
+        self.assertEqual(mbmodel2.species["spec2"]["amt"], 1.0)
+        self.assertEqual(model_snapshot["species"]["spec2"]["amt"], 1e-20)
+        self.assertEqual(self.example_species["spec2"]["amt"], 1e-20)
+
+        # components stop being shared when snapshots are dropped
+        mbmodel3 = MolybdenumModel()
+        mbmodel3.loadm(self.example_mbmodel)
+        species = mbmodel3._model_data["species"]
+        model_snapshot3 = mbmodel3.snapshot()
+        self.assertTrue(mbmodel3.is_shared("species"))
+        # a model loaded from the snapshot keeps it in use
+        mbmodel4 = MolybdenumModel()
+        mbmodel4.loadm(model_snapshot3)
+        del model_snapshot3
+        self.assertTrue(mbmodel3.is_shared("species"))
+        del mbmodel4
+        self.assertFalse(mbmodel3.is_shared("species"))
+        mbmodel3.species["spec1"]["amt"] = 1.0
+        self.assertIs(mbmodel3._model_data["species"], species)
 
     def test_tojson(self):
         mbmodel = MolybdenumModel()
@@ -496,6 +614,27 @@ end
         self.assertEqual(mbmodel.get_new_id('species'), 'spec5')
         self.assertEqual(mbmodel.get_new_id('reactions'), 'reac3')
         self.assertEqual(mbmodel.get_new_id('params'), 'param4')
+        # ids are not used until a component is added with them
+        self.assertEqual(mbmodel.get_new_id('species'), 'spec5')
+        mbmodel.species['spec5'] = mbmodel.init_spec('I')
+        self.assertEqual(mbmodel.get_new_id('species'), 'spec6')
+        # lowest unused id is generated after deleting components
+        mbmodel.species.pop('spec2')
+        mbmodel.release_id('species', 'spec2')
+        self.assertEqual(mbmodel.get_new_id('species'), 'spec2')
+        # gaps in loaded models are used first, also after a json round trip
+        example_model_gaps = self.example_mbmodel.copy()
+        example_model_gaps['params'] = {
+            "param1": {"name": "koff", "val": 0.2},
+            "param4": {"name": "kon", "val": 10000000.0},
+        }
+        mbmodel.loadm(example_model_gaps)
+        self.assertEqual(mbmodel.get_new_id('params'), 'param2')
+        mbmodel_json = MolybdenumModel()
+        mbmodel_json.loadm(json.loads(mbmodel.tojson()))
+        self.assertEqual(mbmodel_json.get_new_id('params'), 'param2')
+        with self.assertRaises(ValueError):
+            mbmodel.get_new_id('events')
 
     def test_init_spec(self):
         mbmodel = MolybdenumModel()
@@ -565,6 +704,23 @@ end
         self.assertEqual(updated_expr.replace(' ',''), 'B*kon+C*2')
         updated_expr = MolybdenumModel().update_expr('A*kon + C*2', 'kon', 'koff')
         self.assertEqual(updated_expr.replace(' ',''), 'A*koff+C*2')
+        # names next to a division are also updated
+        updated_expr = MolybdenumModel().update_expr('kon*A/C', 'C', 'D')
+        self.assertEqual(updated_expr, 'kon*A/D')
+
+    def test_get_expr_tokens(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        tokens, names = mbmodel.get_expr_tokens('reac1')
+        # joining tokens gives back the expression
+        self.assertEqual(''.join(tokens), '(kon*E*S-koff*ES)')
+        self.assertEqual(names, {'kon', 'E', 'S', 'koff', 'ES'})
+        # split expression is reused until the expression changes
+        self.assertIs(mbmodel.get_expr_tokens('reac1')[0], tokens)
+        mbmodel.reactions['reac1']['expression'] = '2*E/kin'
+        tokens, names = mbmodel.get_expr_tokens('reac1')
+        self.assertEqual(''.join(tokens), '2*E/kin')
+        self.assertEqual(names, {'2', 'E', 'kin'})
 
     def test_update_name_byid(self):
         mbmodel = MolybdenumModel()
@@ -574,8 +730,8 @@ end
         self.assertEqual(mbmodel.species[mbmodel.node_to_id[2]]['name'], 'Subs')
         # check if it also has updated the reaction where this is used
         self.assertEqual(mbmodel.reactions['reac1']['expression'], '(kon*E*Subs-koff*ES)')
-        # this is not in charge of updating reagents and products, since they are re-built every time there is a change
-        # self.assertEqual(mbmodel.reactions['reac1']['reagents'], ['E','Subs'])
+        # and the reagents and products of reactions that use it
+        self.assertEqual(mbmodel.reactions['reac1']['reagents'], ['E','Subs'])
 
         # now try checking a reaction
         mbmodel = MolybdenumModel()
@@ -588,6 +744,25 @@ end
         with self.assertRaises(ValueError):
             mbmodel.update_name_byid(25, 'Subs')
 
+    def test_rename_species(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        mbmodel.rename_species({'E': 'ns_E', 'ES': 'ns_ES'})
+        self.assertEqual(mbmodel.species['spec1']['name'], 'ns_E')
+        self.assertEqual(mbmodel.species['spec3']['name'], 'ns_ES')
+        self.assertEqual(mbmodel.reactions['reac1']['expression'], '(kon*ns_E*S-koff*ns_ES)')
+        self.assertEqual(mbmodel.reactions['reac1']['reagents'], ['ns_E', 'S'])
+        self.assertEqual(mbmodel.reactions['reac1']['products'], ['ns_ES'])
+        self.assertEqual(mbmodel.reactions['reac2']['reagents'], ['ns_ES'])
+        self.assertEqual(mbmodel.get_spec_id('ns_E'), 'spec1')
+        # names are replaced at the same time, so they can be swapped
+        mbmodel.rename_species({'S': 'P', 'P': 'S'})
+        self.assertEqual(mbmodel.reactions['reac1']['expression'], '(kon*ns_E*P-koff*ns_ES)')
+        self.assertEqual(mbmodel.reactions['reac2']['products'], ['S'])
+        self.assertEqual(mbmodel.get_spec_id('P'), 'spec2')
+        with self.assertRaises(ValueError):
+            mbmodel.rename_species({'kon': 'k1'})
+
     def test_add_connection(self):
         mbmodel = MolybdenumModel()
         mbmodel.loadm(self.example_mbmodel)
@@ -691,8 +866,95 @@ end
         self.assertEqual(mbmodel.reactions['reac3']['products'],
             self.example_updated_mbmodel['reactions']['reac3']['products'])
 
+        # same graph with nodes moved does not touch the model
+        moved_graph = json.loads(json.dumps(self.example_updated_graph))
+        for node in moved_graph['nodes']:
+            node['x'] += 10.0
+        moved_graph['edges'].reverse()
+        self.assertFalse(mbmodel.graph_changed(moved_graph))
+        self.assertFalse(mbmodel.update_from_graph(moved_graph))
+        # until the model is changed by other means
+        mbmodel.update_name_byid(1, 'Enz')
+        self.assertTrue(mbmodel.graph_changed(moved_graph))
+        self.assertTrue(mbmodel.update_from_graph(moved_graph))
+        self.assertEqual(mbmodel.species['spec1']['name'], 'E')
+
         return None
 
+    def test_get_graph_hash(self):
+        mbmodel = MolybdenumModel()
+        graph_hash = mbmodel.get_graph_hash(self.example_graph)
+        moved_graph = json.loads(json.dumps(self.example_graph))
+        moved_graph['nodes'][0]['y'] = 5.0
+        moved_graph['nodes'].reverse()
+        self.assertEqual(mbmodel.get_graph_hash(moved_graph), graph_hash)
+        moved_graph['nodes'][0]['title'] = 'vcat2'
+        self.assertNotEqual(mbmodel.get_graph_hash(moved_graph), graph_hash)
+        moved_graph = json.loads(json.dumps(self.example_graph))
+        moved_graph['edges'].pop()
+        self.assertNotEqual(mbmodel.get_graph_hash(moved_graph), graph_hash)
+        return None
+
+    def test_diff_graph(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        # same graph gives no operations
+        self.assertEqual(mbmodel.diff_graph(self.example_graph), [])
+        graph_ops = mbmodel.diff_graph(self.example_updated_graph)
+        self.assertEqual(graph_ops, [
+            {'op': 'add_node', 'id': 7, 'title': 'I', 'nodeClass': 'species'},
+            {'op': 'add_node', 'id': 8, 'title': 'vkcat', 'nodeClass': 'reactions'},
+            {'op': 'rename_node', 'id': 4, 'title': 'Prod'},
+            {'op': 'remove_edge', 'source': 2, 'target': 5},
+            {'op': 'remove_edge', 'source': 3, 'target': 6},
+            {'op': 'remove_edge', 'source': 6, 'target': 4},
+            {'op': 'remove_node', 'id': 2},
+            {'op': 'remove_node', 'id': 6},
+            {'op': 'add_edge', 'source': 7, 'target': 5},
+            {'op': 'add_edge', 'source': 3, 'target': 8},
+            {'op': 'add_edge', 'source': 7, 'target': 8},
+            {'op': 'add_edge', 'source': 8, 'target': 4},
+        ])
+
+    def test_apply_graph_ops(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        mbmodel.apply_graph_ops([
+            {'op': 'add_node', 'id': 7, 'title': 'I', 'nodeClass': 'species'},
+            {'op': 'add_edge', 'source': 7, 'target': 6},
+            {'op': 'rename_node', 'id': 3, 'title': 'C'},
+        ])
+        self.assertEqual(mbmodel.species['spec5']['name'], 'I')
+        # renaming updates expressions and connections
+        self.assertEqual(mbmodel.reactions['reac1']['expression'], '(kon*E*S-koff*C)')
+        self.assertEqual(mbmodel.reactions['reac1']['products'], ['C'])
+        self.assertEqual(mbmodel.reactions['reac2']['reagents'], ['C', 'I'])
+        # removing a species also removes its connections
+        mbmodel.apply_graph_ops([{'op': 'remove_node', 'id': 2}])
+        self.assertEqual(mbmodel.reactions['reac1']['reagents'], ['E'])
+        # result is the same as updating from the whole graph
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        mbmodel.apply_graph_ops(mbmodel.diff_graph(self.example_updated_graph))
+        self.assertEqual(mbmodel.toGraph(), self.example_updated_graph)
+        with self.assertRaises(ValueError):
+            mbmodel.apply_graph_ops([{'op': 'move_node', 'id': 1}])
+
+    def test_remove_connection(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        mbmodel.remove_connection(2, 5)
+        self.assertEqual(mbmodel.reactions['reac1']['reagents'], ['E'])
+        mbmodel.remove_connection(6, 4)
+        self.assertEqual(mbmodel.reactions['reac2']['products'], [])
+        # connection that is not there
+        with self.assertRaises(ValueError):
+            mbmodel.remove_connection(6, 4)
+        with self.assertWarns(Warning):
+            mbmodel.remove_connection(1, 2)
+        with self.assertRaises(ValueError):
+            mbmodel.remove_connection(1, 200)
+
     def test_update_from_form(self):
         mbmodel = MolybdenumModel()
         mbmodel.loadm(self.example_mbmodel)
@@ -744,6 +1006,21 @@ end
         mbmodel.update_sim_params(correct_form_sim_params)
         self.assertEqual(mbmodel.sim_params,
         {'sim_start': 12., 'sim_end': 24.,'sim_points': 500})
+        # output options
+        mbmodel.update_sim_params(correct_form_sim_params + [
+            ('variable_step',['True']),
+            ('thin_tol',['0.01']),
+            ('selections',['S, veq'])
+        ])
+        self.assertEqual(mbmodel.sim_params,
+        {'sim_start': 12., 'sim_end': 24.,'sim_points': 500,
+         'variable_step': True, 'thin_tol': 0.01, 'selections': ['S', 'veq']})
+        # empty inputs are not set
+        mbmodel.update_sim_params(correct_form_sim_params + [('thin_tol',['']), ('selections',[''])])
+        self.assertEqual(mbmodel.sim_params,
+        {'sim_start': 12., 'sim_end': 24.,'sim_points': 500})
+        with self.assertRaises(ValueError):
+            mbmodel.update_sim_params(correct_form_sim_params + [('thin_tol',['abc'])])
         # test multiple failure modes with invalid inputs
         with self.assertRaises(ValueError):
             mbmodel.update_sim_params([
@@ -793,6 +1070,465 @@ end
         # check if obtained results have expected dimensions
         self.assertEqual(results.shape, (120, 5))
 
+    def test_run_output_options(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_chain_mbmodel)
+        _, results = mbmodel.run()
+        # only the selected species and reaction rates
+        mbmodel.sim_params = dict(self.example_sim_param, selections=['S2', 'J1'])
+        _, sel_results = mbmodel.run()
+        self.assertEqual(sel_results.colnames, ['time', '[S2]', 'J1'])
+        self.assertTrue(np.allclose(sel_results[:, 1], results[:, 2]))
+        self.assertTrue(np.allclose(sel_results[:, 2], 0.5*results[:, 1]))
+        # the compiled model keeps recording all species
+        mbmodel.sim_params = dict(self.example_sim_param)
+        _, results = mbmodel.run()
+        self.assertEqual(results.colnames, ['time', '[S1]', '[S2]'])
+        mbmodel.sim_params = dict(self.example_sim_param, selections=['J5'])
+        with self.assertRaises(ValueError):
+            mbmodel.run()
+
+        # time points of the integrator
+        mbmodel.sim_params = dict(self.example_sim_param, variable_step=True)
+        _, vs_results = mbmodel.run()
+        self.assertEqual(vs_results[-1, 0], 10.0)
+        self.assertFalse(np.allclose(np.diff(vs_results[:, 0]), 10.0/119))
+        # thinned results are within the tolerance of the full ones
+        mbmodel.sim_params = dict(self.example_sim_param, sim_points=5000, thin_tol=0.001)
+        _, thin_results = mbmodel.run()
+        mbmodel.sim_params = dict(self.example_sim_param, sim_points=5000)
+        _, results = mbmodel.run()
+        self.assertLess(thin_results.shape[0], 100)
+        self.assertEqual(thin_results.colnames, results.colnames)
+        for col_idx in (1, 2):
+            thin_interp = np.interp(results[:, 0], thin_results[:, 0], thin_results[:, col_idx])
+            self.assertLessEqual(np.abs(thin_interp - results[:, col_idx]).max(),
+                                 0.001*np.ptp(results[:, col_idx]) + 1e-12)
+
+    def test_iter_run(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        _, results = mbmodel.run()
+        chunks = list(mbmodel.iter_run(chunk_points=50))
+        self.assertEqual([chunk.shape[0] for chunk in chunks], [50, 50, 20])
+        joined = mbmodel.join_results(chunks)
+        self.assertEqual(joined.colnames, results.colnames)
+        np.testing.assert_allclose(joined[:, 0], results[:, 0])
+        np.testing.assert_allclose(joined, results, rtol=1e-3, atol=1e-25)
+        # stops before the next chunk once cancelled
+        cancel_event = threading.Event()
+        n_chunks = 0
+        for chunk in mbmodel.iter_run(chunk_points=10, cancel_event=cancel_event):
+            n_chunks += 1
+            cancel_event.set()
+        self.assertEqual(n_chunks, 1)
+        self.assertIsNone(mbmodel.join_results([]))
+        with self.assertRaises(ValueError):
+            next(mbmodel.iter_run(chunk_points=0))
+
+    def test_diff_model(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        prev_model = mbmodel.snapshot()
+        no_changes = {'changed': [], 'removed': []}
+        self.assertEqual(mbmodel.diff_model(prev_model),
+                         {'species': no_changes, 'reactions': no_changes, 'params': no_changes})
+        mbmodel.update_from_form([('spec2_amt', ['2.0']), ('reac1_expression', ['kon*E*S-koff*ES+kn'])])
+        model_patch = mbmodel.diff_model(prev_model)
+        self.assertEqual(model_patch['species'],
+                         {'changed': [('spec2', {'name': 'S', 'amt': 2.0, 'fixed': False})], 'removed': []})
+        self.assertEqual([comp_id for comp_id, _ in model_patch['reactions']['changed']], ['reac1'])
+        self.assertEqual(model_patch['params'],
+                         {'changed': [('param4', {'name': 'kn', 'val': 0.0})], 'removed': []})
+        # also from dictionaries
+        prev_model = mbmodel.todict()
+        mbmodel.update_from_form([('reac1_expression', ['kon*E*S-koff*ES'])])
+        self.assertEqual(mbmodel.diff_model(dict(prev_model))['params'],
+                         {'changed': [], 'removed': ['param4']})
+        return None
+
+    def test_get_model_hash(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        model_hash = mbmodel.get_model_hash()
+        mbmodel2 = MolybdenumModel()
+        mbmodel2.loadm(mbmodel.todict())
+        self.assertEqual(mbmodel2.get_model_hash(), model_hash)
+        # any change gives another hash
+        revision = mbmodel.get_revision()
+        mbmodel.update_from_form([("spec1_amt", ["1.0"])])
+        self.assertGreater(mbmodel.get_revision(), revision)
+        self.assertNotEqual(mbmodel.get_model_hash(), model_hash)
+        mbmodel2.update_sim_params([("sim_start", ["0.0"]), ("sim_end", ["20.0"]), ("sim_points", ["120"])])
+        self.assertNotEqual(mbmodel2.get_model_hash(), model_hash)
+        # kept until the next edit, direct edits call unshare() first
+        model_hash2 = mbmodel2.get_model_hash()
+        self.assertEqual(mbmodel2.get_model_hash(), model_hash2)
+        mbmodel2.unshare("params")
+        mbmodel2.params["param1"]["val"] = 1.0
+        self.assertNotEqual(mbmodel2.get_model_hash(), model_hash2)
+        return None
+
+    def test_get_representations(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        representations = mbmodel.get_representations()
+        self.assertEqual(representations["hash"], mbmodel.get_model_hash())
+        self.assertEqual(representations["sbml"], mbmodel.toSBMLstr())
+        self.assertEqual(representations["antimony"], mbmodel.toAntimony())
+        self.assertEqual(representations["writeup"], mbmodel.tosimpleSbmlWriteup())
+        self.assertEqual(representations["dict"], self.example_mbmodel_wnode)
+        # kept while the model does not change
+        self.assertIs(mbmodel.get_representations(), representations)
+        mbmodel.update_from_form([("param1_val", ["1.0"])])
+        representations2 = mbmodel.get_representations()
+        self.assertIsNot(representations2, representations)
+        self.assertIn("koff = 1", representations2["antimony"])
+        return None
+
+    def test_get_model_info(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        structure_key, sbml_str, init_values = mbmodel.get_model_info()
+        self.assertEqual(structure_key, mbmodel.get_structure_key())
+        self.assertEqual(sbml_str, mbmodel.toSBMLstr())
+        self.assertEqual(init_values, mbmodel.get_init_values())
+        # the SBML string is reused while the structure does not change
+        mbmodel.update_from_form([("param1_val", ["1.0"])])
+        _, sbml_str2, init_values2 = mbmodel.get_model_info()
+        self.assertIs(sbml_str2, sbml_str)
+        self.assertNotEqual(init_values2, init_values)
+        mbmodel.update_from_form([("param1_name", ["kcat2"])])
+        _, sbml_str3, init_values3 = mbmodel.get_model_info()
+        self.assertIn("kcat2", sbml_str3)
+        self.assertIn("kcat2", init_values3)
+        return None
+
+    def test_simulation_pool(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        _, results = mbmodel.run()
+        pool = SimulationPool(processes=2)
+        try:
+            self.assertEqual(len(set(pool.wait_ready())), 2)
+            # same model goes to the same worker
+            worker_idx = pool.get_worker_index(mbmodel.get_structure_key())
+            self.assertEqual(pool.get_worker_index(mbmodel.get_structure_key()), worker_idx)
+            pool_results = pool.run(mbmodel).result()
+            self.assertEqual(pool_results.colnames, results.colnames)
+            np.testing.assert_allclose(pool_results, results)
+            # values are updated in the compiled model of the worker
+            mbmodel.params["param3"]["val"] = 1.0
+            _, results = mbmodel.run()
+            np.testing.assert_allclose(pool.run(mbmodel).result(), results)
+        finally:
+            pool.shutdown()
+        return None
+
+    def test_get_structure_key(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        structure_key = mbmodel.get_structure_key()
+        # changing values does not change the structure
+        mbmodel.species['spec1']['amt'] = 42.0
+        mbmodel.params['param1']['val'] = 42.0
+        self.assertEqual(mbmodel.get_structure_key(), structure_key)
+        # changing expressions or fixed species does
+        mbmodel.reactions['reac2']['expression'] = '2*kcat*ES'
+        self.assertNotEqual(mbmodel.get_structure_key(), structure_key)
+        structure_key = mbmodel.get_structure_key()
+        mbmodel.species['spec1']['fixed'] = True
+        self.assertNotEqual(mbmodel.get_structure_key(), structure_key)
+
+    def test_compile_model(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        # loading sbml directly or through antimony gives the same model
+        temod_sbml = mbmodel.compile_model()
+        temod_ant = mbmodel.compile_model(from_antimony=True)
+        self.assertEqual(temod_sbml.getFloatingSpeciesIds(), temod_ant.getFloatingSpeciesIds())
+        # antimony may declare parameters in a different order
+        self.assertEqual(sorted(temod_sbml.getGlobalParameterIds()), sorted(temod_ant.getGlobalParameterIds()))
+        results_sbml = temod_sbml.simulate(0, 10, 120)
+        results_ant = temod_ant.simulate(0, 10, 120)
+        self.assertTrue(np.allclose(results_sbml, results_ant))
+
+    def test_get_temodel(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        temod = mbmodel.get_temodel()
+        # changing values reuses the compiled model but updates its values
+        mbmodel.species['spec2']['amt'] = 3.0
+        mbmodel.params['param2']['val'] = 2.0
+        self.assertIs(mbmodel.get_temodel(), temod)
+        self.assertEqual(temod['S'], 3.0)
+        self.assertEqual(temod['kon'], 2.0)
+        # results match the ones of a model compiled from scratch
+        _, results = mbmodel.run()
+        mbmodel_new = MolybdenumModel()
+        mbmodel_new.loadm(mbmodel.todict())
+        _, results_new = mbmodel_new.run()
+        self.assertTrue(np.allclose(results, results_new))
+        # changing the structure compiles a new model
+        mbmodel.reactions['reac2']['expression'] = '2*kcat*ES'
+        self.assertIsNot(mbmodel.get_temodel(), temod)
+
+    def test_get_assignment_list(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        # grid of values gives every combination
+        assignment_list = mbmodel.get_assignment_list({'kon': [1, 2], 'E': [5.0, 10.0]})
+        self.assertEqual(assignment_list, [
+            {'kon': 1.0, 'E': 5.0},
+            {'kon': 1.0, 'E': 10.0},
+            {'kon': 2.0, 'E': 5.0},
+            {'kon': 2.0, 'E': 10.0},
+        ])
+        # list of values is kept as it is
+        assignment_list = mbmodel.get_assignment_list([{'kcat': 3}, {'S': 1.0}])
+        self.assertEqual(assignment_list, [{'kcat': 3.0}, {'S': 1.0}])
+        with self.assertRaises(ValueError):
+            mbmodel.get_assignment_list([{'kin': 3}])
+
+    def test_sweep(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        grid = {'kon': [1e6, 1e8], 'E': [5e-21, 1e-20]}
+        sweep_results = mbmodel.sweep(grid, processes=1)
+        self.assertEqual(sweep_results['results'].shape, (4, 120, 4))
+        self.assertEqual(sweep_results['columns'], ['E', 'S', 'ES', 'P'])
+        self.assertEqual(sweep_results['time'].shape, (120,))
+        self.assertEqual(sweep_results['runs'][3], {'kon': 1e8, 'E': 1e-20})
+        # model values are not changed by the sweep
+        self.assertEqual(mbmodel.params['param2']['val'], 10000000.0)
+        # each run matches running the model with those values
+        mbmodel.params['param2']['val'] = 1e8
+        mbmodel.species['spec1']['amt'] = 1e-20
+        _, results = mbmodel.run()
+        self.assertTrue(np.allclose(sweep_results['results'][3], results[:, 1:]))
+        # runs in worker processes give the same results in the same order
+        mbmodel.loadm(self.example_mbmodel)
+        sweep_results_pool = mbmodel.sweep(grid, processes=2)
+        self.assertEqual(sweep_results_pool['runs'], sweep_results['runs'])
+        self.assertTrue(np.allclose(sweep_results_pool['results'], sweep_results['results']))
+
+    def test_steady_state(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_chain_mbmodel)
+        steady_state = mbmodel.steady_state()
+        self.assertEqual(list(steady_state.keys()), ['S1', 'S2'])
+        self.assertTrue(np.allclose(list(steady_state.values()), [2.0, 4.0]))
+        # same values come from the cache
+        self.assertEqual(len(mbmodel._steady_states), 1)
+        self.assertEqual(mbmodel.steady_state(), steady_state)
+        self.assertEqual(len(mbmodel._steady_states), 1)
+
+        scan_results = mbmodel.steady_state_scan('k0', [0.5, 1.0, 1.5])
+        self.assertEqual(scan_results['columns'], ['S1', 'S2'])
+        self.assertTrue(np.allclose(scan_results['results'], [[1.0, 2.0], [2.0, 4.0], [3.0, 6.0]]))
+        # scanned points are cached, and the model keeps its values
+        self.assertEqual(len(mbmodel._steady_states), 3)
+        _, results = mbmodel.run()
+        self.assertEqual(results[0, 1], 0.0)
+        mbmodel.update_from_form([('param1_val', ['1.5'])])
+        self.assertTrue(np.allclose(list(mbmodel.steady_state().values()), [3.0, 6.0]))
+        self.assertEqual(len(mbmodel._steady_states), 3)
+        with self.assertRaises(ValueError):
+            mbmodel.steady_state_scan('S1', [1.0])
+
+        # totals of the enzyme model are conserved, E + ES + P and S + ES + P,
+        # which the solver needs conserved moiety analysis for
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        _, results = mbmodel.run()
+        mbmodel.update_from_form([("spec1_amt", ["5.0"]), ("spec2_amt", ["10.0"])])
+        steady_state = mbmodel.steady_state()
+        self.assertEqual(list(steady_state.keys()), ['E', 'S', 'ES', 'P'])
+        self.assertTrue(np.allclose(list(steady_state.values()), [0.0, 5.0, 0.0, 5.0], atol=1e-6))
+        # the model used for simulations keeps the order of its species
+        self.assertFalse(mbmodel.get_temodel().conservedMoietyAnalysis)
+        _, results2 = mbmodel.run()
+        self.assertEqual(results2.colnames, results.colnames)
+
+    def test_sensitivities(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_chain_mbmodel)
+        # at steady state S1 only depends on k0/k1 and S2 on k0/k2
+        sens_results = mbmodel.sensitivities(steady_state=True)
+        self.assertEqual(sens_results['params'], ['k0', 'k1', 'k2'])
+        self.assertEqual(sens_results['columns'], ['S1', 'S2'])
+        self.assertTrue(np.allclose(sens_results['sensitivities'], [[1.0, 1.0], [-1.0, 0.0], [0.0, -1.0]], atol=1e-6))
+        self.assertNotIn('time', sens_results)
+
+        sens_results = mbmodel.sensitivities(processes=1)
+        sens = sens_results['sensitivities']
+        self.assertEqual(sens.shape, (3, 120, 2))
+        self.assertEqual(len(sens_results['time']), 120)
+        # species start at 0, then both are proportional to k0
+        self.assertTrue(np.all(np.isnan(sens[:, 0, :])))
+        self.assertTrue(np.allclose(sens[0, 1:, :], 1.0, atol=1e-4))
+        # same results in worker processes
+        sens_results_pool = mbmodel.sensitivities(processes=2)
+        self.assertTrue(np.allclose(sens_results_pool['sensitivities'], sens, equal_nan=True))
+        with self.assertRaises(ValueError):
+            mbmodel.sensitivities(rel_step=0)
+
+    def test_ensemble(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        initial_amounts = np.array([
+            [5e-21, 1e-20, 0.0, 0.0],
+            [1e-20, 1e-20, 0.0, 0.0],
+            [1e-20, 2e-20, 1e-21, 0.0],
+        ])
+        ensemble_results = mbmodel.ensemble(initial_amounts)
+        self.assertEqual(ensemble_results['results'].shape, (3, 120, 4))
+        self.assertEqual(ensemble_results['columns'], ['E', 'S', 'ES', 'P'])
+        # results are written in the array that is passed
+        out = np.zeros((3, 120, 4))
+        ensemble_results_out = mbmodel.ensemble(initial_amounts, out=out)
+        self.assertIs(ensemble_results_out['results'], out)
+        self.assertTrue(np.allclose(out, ensemble_results['results']))
+        # other simulations still get their own copy of the results
+        _, results = mbmodel.run()
+        _, results_next = mbmodel.run()
+        self.assertFalse(np.shares_memory(results, results_next))
+        # each member matches running the model with those amounts
+        _, results = mbmodel.run()
+        self.assertTrue(np.allclose(ensemble_results['results'][0], results[:, 1:]))
+        mbmodel.species['spec2']['amt'] = 2e-20
+        mbmodel.species['spec3']['amt'] = 1e-21
+        mbmodel.species['spec1']['amt'] = 1e-20
+        _, results = mbmodel.run()
+        self.assertTrue(np.allclose(ensemble_results['results'][2], results[:, 1:]))
+        # dictionary only changes the species passed
+        ensemble_results_dict = mbmodel.ensemble({'S': [1e-20, 2e-20]})
+        self.assertTrue(np.allclose(ensemble_results_dict['initial_amounts'][:, 1], [1e-20, 2e-20]))
+        self.assertTrue(np.allclose(ensemble_results_dict['initial_amounts'][:, 0], 1e-20))
+        with self.assertRaises(ValueError):
+            mbmodel.ensemble({'kon': [1.0]})
+        with self.assertRaises(ValueError):
+            mbmodel.ensemble(np.ones((2, 3)))
+
+    def test_simulate_no_copy(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        temodel = mbmodel.get_temodel()
+        results = simulate_no_copy(temodel, mbmodel.sim_params)
+        self.assertEqual(results.shape, (120, 5))
+        results_next = simulate_no_copy(temodel, mbmodel.sim_params)
+        # the result buffer of the compiled model is reused
+        self.assertTrue(np.shares_memory(results, results_next))
+        _, run_results = mbmodel.run()
+        self.assertFalse(np.shares_memory(run_results, results_next))
+        self.assertTrue(np.allclose(run_results, results_next))
+
+    def test_stochastic_ensemble(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_chain_mbmodel)
+        ensemble_stats = mbmodel.stochastic_ensemble(200, seed=1, processes=1)
+        _, results = mbmodel.run()
+        self.assertEqual(ensemble_stats['columns'], list(mbmodel.te_result_to_df(results).columns[1:]))
+        self.assertEqual(ensemble_stats['n_runs'], 200)
+        self.assertEqual(ensemble_stats['mean'].shape, (120, 2))
+        self.assertEqual(ensemble_stats['variance'].shape, (120, 2))
+        self.assertEqual(ensemble_stats['quantiles'].shape, (3, 120, 2))
+        self.assertTrue(np.allclose(ensemble_stats['time'], results[:, 0]))
+        # the mean follows the deterministic model, S1 = k0/k1 = 2 at the end
+        self.assertLess(abs(ensemble_stats['mean'][-1, 0] - results[-1, 1]), 0.5)
+        self.assertTrue(np.all(np.diff(ensemble_stats['quantiles'], axis=0) >= 0))
+        # molecule counts are integers, quantiles are exact
+        self.assertTrue(np.all(ensemble_stats['quantiles'] == np.round(ensemble_stats['quantiles'])))
+        # same runs with the same seeds, also in worker processes
+        ensemble_stats_pool = mbmodel.stochastic_ensemble(200, seed=1, processes=2)
+        self.assertTrue(np.allclose(ensemble_stats_pool['mean'], ensemble_stats['mean']))
+        self.assertTrue(np.allclose(ensemble_stats_pool['variance'], ensemble_stats['variance']))
+        self.assertTrue(np.array_equal(ensemble_stats_pool['quantiles'], ensemble_stats['quantiles']))
+        # the compiled model is deterministic again
+        _, results_after = mbmodel.run()
+        self.assertTrue(np.allclose(results_after, results))
+        with self.assertRaises(ValueError):
+            mbmodel.stochastic_ensemble(0)
+
+    def test_ensemble_stats(self):
+        rng = np.random.default_rng(0)
+        values = rng.poisson(lam=[[3, 50], [20, 700]], size=(500, 2, 2)).astype(float)
+        levels = [0.05, 0.5, 0.95]
+        stats = EnsembleStats((2, 2), n_bins=1024)
+        for batch_start in range(0, 500, 64):
+            stats.add(values[batch_start:batch_start+64])
+        self.assertTrue(np.allclose(stats.mean, values.mean(axis=0)))
+        self.assertTrue(np.allclose(stats.get_variance(), values.var(axis=0, ddof=1)))
+        self.assertTrue(np.array_equal(stats.get_quantiles(levels),
+                                       np.quantile(values, levels, axis=0, method='inverted_cdf')))
+        # merged statistics with wider bins are close
+        stats = EnsembleStats((2, 2), n_bins=64)
+        stats.add(values[:100])
+        other_stats = EnsembleStats((2, 2), n_bins=64)
+        other_stats.add(values[100:])
+        stats.merge(other_stats)
+        self.assertEqual(stats.n, 500)
+        self.assertTrue(np.allclose(stats.mean, values.mean(axis=0)))
+        self.assertTrue(np.allclose(stats.get_variance(), values.var(axis=0, ddof=1)))
+        self.assertTrue(np.allclose(stats.get_quantiles(levels),
+                                    np.quantile(values, levels, axis=0, method='inverted_cdf'), rtol=0.02))
+        with self.assertRaises(ValueError):
+            EnsembleStats((2, 2), n_bins=100)
+
+    def test_fit(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_chain_mbmodel)
+        _, results = mbmodel.run()
+        data = mbmodel.te_result_to_df(results).iloc[5::10].reset_index(drop=True)
+        # missing and repeated measurements
+        data.loc[2, 'S2'] = np.nan
+        data = pd.concat([data, data.iloc[:3]])
+        free_params = {'k1': (0.01, 10.0), 'k2': (0.01, 10.0)}
+
+        mbmodel.update_from_form([('param2_val', ['3.0']), ('param3_val', ['3.0'])])
+        fit_results = mbmodel.fit(data, free_params, n_starts=4, processes=1)
+        self.assertTrue(np.allclose(list(fit_results['params'].values()), [0.5, 0.25], rtol=1e-4))
+        self.assertLess(fit_results['ssr'], 1e-6)
+        self.assertEqual(len(fit_results['starts']), 4)
+        # the first start is the value of the model
+        self.assertIn({'k1': 3.0, 'k2': 3.0}, [start_result['start'] for start_result in fit_results['starts']])
+        # fitted values are written into the model
+        self.assertAlmostEqual(mbmodel.params['param2']['val'], fit_results['params']['k1'])
+        self.assertAlmostEqual(mbmodel.params['param3']['val'], fit_results['params']['k2'])
+        self.assertEqual(mbmodel.params['param1']['val'], 1.0)
+
+        # same fit in worker processes
+        mbmodel.update_from_form([('param2_val', ['3.0']), ('param3_val', ['3.0'])])
+        fit_results_pool = mbmodel.fit(data, free_params, n_starts=4, processes=2)
+        self.assertTrue(np.allclose(list(fit_results_pool['params'].values()), [0.5, 0.25], rtol=1e-4))
+
+        with self.assertRaises(ValueError):
+            mbmodel.fit(data, {'k5': (0.01, 10.0)})
+        with self.assertRaises(ValueError):
+            mbmodel.fit(data, {'k1': (1.0, 0.1)})
+        with self.assertRaises(ValueError):
+            mbmodel.fit(data.drop(columns='time'), free_params)
+
+    def test_get_fit_starts(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_chain_mbmodel)
+        _, results = mbmodel.run()
+        data = mbmodel.te_result_to_df(results).iloc[5::10].reset_index(drop=True)
+        # narrow positive bounds are sampled uniform, wide ones log-uniform
+        fit_problem = mbmodel.get_fit_problem(data, {'k1': (1.0, 2.0), 'k2': (0.01, 10.0)})
+        starts = mbmodel.get_fit_starts(fit_problem, 5, seed=3)
+        self.assertEqual(len(starts), 5)
+        # the first start is the value of the model, clipped to the bounds
+        self.assertTrue(np.allclose(starts[0], [1.0, 0.25]))
+        uniform = np.random.default_rng(3).uniform(size=(4, 2))
+        self.assertTrue(np.allclose([start[0] for start in starts[1:]], 1.0 + uniform[:, 0]))
+        self.assertTrue(np.allclose([start[1] for start in starts[1:]], 0.01 * 1000.0**uniform[:, 1]))
+        # bounds starting at 0 are sampled uniform
+        fit_problem = mbmodel.get_fit_problem(data, {'k1': (0.0, 1e8)})
+        starts = mbmodel.get_fit_starts(fit_problem, 3, seed=3)
+        uniform = np.random.default_rng(3).uniform(size=(2, 1))
+        self.assertTrue(np.allclose([start[0] for start in starts[1:]], 1e8 * uniform[:, 0]))
+
     def test_te_result_to_df(self):
         mbmodel = MolybdenumModel()
         mbmodel.loadm(self.example_mbmodel)
@@ -801,6 +1537,57 @@ end
         self.assertEqual(list(df.columns), ['time', 'E', 'S', 'ES', 'P'])
         self.assertEqual(list(df.shape), [120, 5])
 
+    def test_select_results(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        _, results = mbmodel.run()
+        col_names, col_indices, rows = mbmodel.select_results(results)
+        self.assertEqual(col_names, ["time", "E", "S", "ES", "P"])
+        self.assertEqual(col_indices, [0, 1, 2, 3, 4])
+        self.assertEqual(rows, slice(0, 120))
+        col_names, col_indices, rows = mbmodel.select_results(results, columns=["P", "S"], time_start=1.0, time_end=2.0)
+        self.assertEqual(col_names, ["time", "P", "S"])
+        self.assertEqual(col_indices, [0, 4, 2])
+        self.assertTrue(all((results[rows, 0] >= 1.0) & (results[rows, 0] <= 2.0)))
+        self.assertEqual(len(results[rows]), 12)
+        with self.assertRaises(ValueError):
+            mbmodel.select_results(results, columns=["X"])
+        return None
+
+    def test_iter_results_csv(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        _, results = mbmodel.run()
+        csv_chunks = list(mbmodel.iter_results_csv(results, chunk_rows=50))
+        # header and three chunks of rows
+        self.assertEqual(len(csv_chunks), 4)
+        self.assertEqual("".join(csv_chunks), mbmodel.te_result_to_df(results).to_csv(index=False))
+        csv_str = "".join(mbmodel.iter_results_csv(results, columns=["S"], time_end=0.0))
+        self.assertEqual(csv_str, "time,S\n0.0,1e-20\n")
+        return None
+
+    def test_get_trajectories(self):
+        mbmodel = MolybdenumModel()
+        mbmodel.loadm(self.example_mbmodel)
+        _, results = mbmodel.run()
+        trajectories = mbmodel.get_trajectories(results)
+        self.assertEqual(trajectories["columns"], ["E", "S", "ES", "P"])
+        self.assertEqual(trajectories["trajectories"]["S"]["time"], list(results[:, 0]))
+        self.assertEqual(trajectories["trajectories"]["S"]["values"], list(results[:, 2]))
+        # json compatible
+        json.dumps(trajectories)
+
+        # downsampled keeps first and last points
+        trajectories = mbmodel.get_trajectories(results, max_points=10)
+        for col_name in trajectories["columns"]:
+            time = trajectories["trajectories"][col_name]["time"]
+            self.assertEqual(len(time), 10)
+            self.assertEqual(time[0], 0.0)
+            self.assertEqual(time[-1], 10.0)
+        with self.assertRaises(ValueError):
+            mbmodel.get_trajectories(results, max_points=2)
+        return None
+
     def test_get_plot_as_htmlimage(self):
         # check if beggining of image representing plot beggins with expected value
         mbmodel = MolybdenumModel()